@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# benchmarks of the GTK-free modules on synthetic backups
+#
+#  File: benchmarks/bench.py
+#
+#  Times what the GUI and the command line do with a backup: opening it
+#  (building the sidecar, completing it and reusing it), listing the domains, switching to
+#  the largest domain, searching paths, decoding file BLOBs, exporting the
+#  table Files and extracting files. The backups are made by synthetic.py
+#  and kept in the work directory, later runs with the same number of rows
+#  and seed reuse them.
+#
+#  Every result is written as one line of JSON, so runs of different
+#  commits can be appended to one file and compared:
+#    {"name": "search.substring", "rows": 100000, "min": 0.0012, "median": ...,
+#     "repeat": 3, "items": 1000, "items_per_second": ..., "python": ..., ...}
+#
+#  Usage: bench.py [--rows 10000 100000 1000000] [--only PREFIX] [--output FILE]
+
+import argparse, gc, json, os, platform, random, shutil, sqlite3, statistics, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, HERE)
+
+# local modules
+from manifestdb import backup
+from manifestdb import export
+from manifestdb import extraction
+from manifestdb import filemeta
+import synthetic
+
+DEFAULT_ROWS = (10000, 100000, 1000000)
+# file BLOBs decoded by the decode benchmarks
+DECODE_FILES = 10000
+# files copied by the extract benchmark
+EXTRACT_FILES = 20000
+# patterns of the search benchmarks
+SEARCHES = (('substring', 'IMG_1'), ('prefix', 'Library/Preferences/'),
+    ('glob', '*/Caches/*.plist'), ('regex', r'IMG_\d{4}\.HEIC$'))
+
+class Context:
+    # synthetic backup of one size and scratch directories for one run
+    def __init__(self, path, rows, work):
+        self.path = path
+        self.rows = rows
+        self.cache = os.path.join(work, 'cache')
+        self.scratch = os.path.join(work, 'scratch')
+        self.backup = None
+
+    def open(self):
+        if self.backup is None:
+            self.backup = backup.Backup(self.path, self.cache)
+            self.backup.open_index()
+            # sizes, attributes and the full-text index for the other benchmarks
+            self.backup.complete_index()
+        return self.backup
+
+    def close(self):
+        if self.backup is not None:
+            self.backup.close()
+            self.backup = None
+
+    def largest_domain(self):
+        return max(self.open().domains(), key=lambda domain: domain[1])[0]
+
+    def clean(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        os.makedirs(self.scratch)
+
+def synthetic_backup(work, rows, seed, max_payload, regenerate=False):
+    # path of a generated backup, made only if not there from an earlier run
+    path = os.path.join(work, 'backup-{}-{}'.format(rows, seed))
+    marker = os.path.join(path, 'synthetic.json')
+    wanted = {'version': synthetic.GENERATOR_VERSION, 'rows': rows, 'seed': seed,
+        'max_payload': max_payload}
+    try:
+        with open(marker) as f:
+            if json.load(f) == wanted and not regenerate:
+                return path
+    except (EnvironmentError, ValueError):
+        pass
+    shutil.rmtree(path, ignore_errors=True)
+    start = time.perf_counter()
+    synthetic.generate(path, rows, seed, max_payload)
+    print('generated {} rows in {:.1f} s: {}'.format(rows, time.perf_counter() - start, path),
+        file=sys.stderr)
+    with open(marker, 'w') as f:
+        json.dump(wanted, f)
+    return path
+
+# the benchmarks, each returns the number of items it handled
+
+def bench_open_cold(context):
+    # no sidecar yet, the small columns are copied and indexed, the domains can be shown
+    context.close()
+    shutil.rmtree(context.cache, ignore_errors=True)
+    with backup.Backup(context.path, context.cache) as opened:
+        opened.open_index()
+    return context.rows
+
+def bench_open_complete(context):
+    # no sidecar yet, in addition all BLOBs are decoded and the full-text index is built
+    context.close()
+    shutil.rmtree(context.cache, ignore_errors=True)
+    with backup.Backup(context.path, context.cache) as opened:
+        opened.open_index()
+        opened.complete_index()
+    return context.rows
+
+def bench_open_warm(context):
+    # the sidecar is current, a stat and a query of table Meta
+    context.close()
+    with backup.Backup(context.path, context.cache) as opened:
+        opened.open_index()
+        return len(opened.domains())
+
+def bench_domains(context):
+    return len(context.open().domains())
+
+def bench_domain_switch(context):
+    # what choosing a domain in the combobox does: all rowids, then the first page
+    opened = context.open()
+    rowids = []
+    for batch in opened.rowid_batches(context.domain):
+        rowids.extend(batch)
+    opened.rows_by_rowid(rowids[:256])
+    return len(rowids)
+
+def bench_domain_rows(context):
+    # all rows of a domain, as listed by the command line
+    return sum(len(batch) for batch in context.open().file_batches(context.domain))
+
+def bench_tree_top(context):
+    return len(context.open().children(context.domain))
+
+def _search(mode, pattern):
+    def bench_search(context):
+        return len(context.open().search(pattern, mode))
+    return bench_search
+
+def bench_decode(context):
+    # BLOBs fetched from Manifest.db and decoded
+    opened = context.open()
+    blobs = [blob for file_id, blob in opened.manifest_db.blobs(context.sample)]
+    return sum(filemeta.decode(blob) is not None for blob in blobs)
+
+def bench_properties(context):
+    # activating rows, nothing in the cache yet
+    opened = context.open()
+    opened.file_metadata.cache_clear()
+    for file_id in context.sample[:1000]:
+        opened.properties(file_id)
+    return min(len(context.sample), 1000)
+
+def bench_export_csv(context):
+    context.clean()
+    with export.open_text(os.path.join(context.scratch, 'Manifest.csv')) as f:
+        return export.write_csv(context.open().manifest_db, f, decode=True)
+
+def bench_export_parquet(context):
+    context.clean()
+    return export.write_columnar(context.open().manifest_db,
+        os.path.join(context.scratch, 'Manifest.parquet'))
+
+def bench_extract(context):
+    # files of the largest domain into an empty directory, with the attribute pass
+    context.clean()
+    opened = context.open()
+    attributes = []
+    rows = []
+    for batch in opened.file_batches(context.domain):
+        rows.extend(batch)
+        if len(rows) >= EXTRACT_FILES:
+            break
+    jobs = opened.extraction_jobs(rows[:EXTRACT_FILES], context.scratch, attributes)
+    worker = extraction.Extraction(jobs, extraction.DEFAULT_WORKERS,
+        extraction.Journal(context.scratch), attributes)
+    worker.start()
+    worker.join()
+    return len(jobs)
+
+BENCHMARKS = [('open.cold', bench_open_cold), ('open.complete', bench_open_complete),
+    ('open.warm', bench_open_warm),
+    ('domains', bench_domains), ('domain.switch', bench_domain_switch),
+    ('domain.rows', bench_domain_rows), ('tree.top', bench_tree_top)] \
+    + [('search.' + mode, _search(mode, pattern)) for mode, pattern in SEARCHES] \
+    + [('decode', bench_decode), ('properties', bench_properties),
+    ('export.csv', bench_export_csv), ('export.parquet', bench_export_parquet),
+    ('extract', bench_extract)]
+
+def environment():
+    return {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(), 'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+def measure(function, context, repeat):
+    # (seconds of every repetition, items of the last one), None if not available
+    seconds = []
+    items = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        try:
+            items = function(context)
+        except ImportError:
+            # optional package (e.g. pyarrow) not installed
+            return None
+        seconds.append(time.perf_counter() - start)
+    return seconds, items
+
+def run(rows_list, work, repeat, only, seed, max_payload, regenerate, output):
+    env = environment()
+    for rows in rows_list:
+        path = synthetic_backup(work, rows, seed, max_payload, regenerate)
+        context = Context(path, rows, os.path.join(work, 'run-{}'.format(rows)))
+        shutil.rmtree(context.cache, ignore_errors=True)
+        context.domain = context.largest_domain()
+        ids = [row[0] for row in context.open().sidecar.connection.execute(
+            "SELECT fileID FROM Files WHERE flags = 1")]
+        context.sample = random.Random(seed).sample(ids, min(DECODE_FILES, len(ids)))
+        try:
+            for name, function in BENCHMARKS:
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                result = measure(function, context, repeat)
+                if result is None:
+                    print('{:<20} {:>8} skipped'.format(name, rows), file=sys.stderr)
+                    continue
+                seconds, items = result
+                record = {'name': name, 'rows': rows, 'min': min(seconds),
+                    'median': statistics.median(seconds), 'repeat': repeat, 'items': items,
+                    'items_per_second': items / max(min(seconds), 1e-9)}
+                record.update(env)
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+                print('{:<20} {:>8} {:>10.4f} s {:>12.0f} items/s'.format(
+                    name, rows, record['min'], record['items_per_second']), file=sys.stderr)
+        finally:
+            context.close()
+            shutil.rmtree(context.scratch, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic iOS backups.')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+        help='sizes of the backups in rows (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions (default %(default)s)')
+    parser.add_argument('--only', nargs='+', metavar='PREFIX',
+        help='run only the benchmarks with names starting with one of these')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-payload', type=int, default=synthetic.MAX_PAYLOAD,
+        help='upper limit for the size of a payload file (default %(default)s)')
+    parser.add_argument('--work', default=os.path.join(tempfile.gettempdir(), 'manifestdb-bench'),
+        help='directory for the backups, kept between runs (default %(default)s)')
+    parser.add_argument('--regenerate', action='store_true', help='make new backups')
+    parser.add_argument('-o', '--output', help='append the results to this file (default standard output)')
+    parser.add_argument('-l', '--list', action='store_true', help='list the benchmarks')
+    args = parser.parse_args(argv)
+    if args.list:
+        for name, function in BENCHMARKS:
+            print(name)
+        return 0
+    os.makedirs(args.work, exist_ok=True)
+    if args.output is None:
+        run(args.rows, args.work, args.repeat, args.only, args.seed, args.max_payload,
+            args.regenerate, sys.stdout)
+    else:
+        with open(args.output, 'a') as output:
+            run(args.rows, args.work, args.repeat, args.only, args.seed, args.max_payload,
+                args.regenerate, output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
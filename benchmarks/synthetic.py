@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# synthetic iOS backup for benchmarks and testing
+#
+#  File: benchmarks/synthetic.py
+#
+#  Writes a backup directory as made by iTunes or Finder without needing an
+#  iPhone: Manifest.db with the real schema of table Files, a 'file' BLOB
+#  archived by NSKeyedArchiver for every row, Manifest.plist, Status.plist
+#  and the payload files named by their fileID in subdirectories 'xx'.
+#  The rows are spread over domains and paths like in a real backup, a few
+#  big domains (camera roll, media, home) and many small app containers,
+#  every directory has a row of its own, a few entries are symlinks and
+#  some payloads have the same content. The output depends on the seed only.
+#  With a password the backup is encrypted like one with "Encrypt local
+#  backup" (keybag, ManifestKey, an EncryptionKey per file), but with far
+#  fewer PBKDF2 iterations; this needs the package 'cryptography'.
+#
+#  Usage: synthetic.py DIRECTORY ROWS [--seed N] [--max-payload BYTES] [--password TEXT]
+
+import argparse, hashlib, os, plistlib, random, sqlite3, struct, sys, uuid
+
+# written into synthetic.json, bump when the generated backups change
+GENERATOR_VERSION = 1
+# default upper limit for the size of a payload file
+MAX_PAYLOAD = 4 * 1024
+# share of regular files getting the content of an earlier one
+DUPLICATES = 0.05
+# share of entries being symlinks
+SYMLINKS = 0.01
+# number of app containers
+APPS = 200
+# rows inserted at once
+BATCH_SIZE = 10000
+# PBKDF2 iterations of encrypted backups (DPIC, ITER), iOS uses 10000000 and 10000
+KDF_ITERATIONS = (1000, 100)
+# protection classes of the keybag, files use 3 and Manifest.db 4
+PROTECTION_CLASSES = range(1, 12)
+# schema of Manifest.db as written by iOS
+SCHEMA = (
+    "CREATE TABLE Files (fileID TEXT PRIMARY KEY, domain TEXT, relativePath TEXT,"
+    " flags INTEGER, file BLOB)",
+    "CREATE INDEX FilesDomainIdx ON Files(domain)",
+    "CREATE INDEX FilesRelativePathIdx ON Files(relativePath)",
+    "CREATE INDEX FilesFlagsIdx ON Files(flags)",
+    "CREATE TABLE Properties (key TEXT PRIMARY KEY, value BLOB)",
+)
+# small system domains, they share what is left by the others
+SYSTEM_DOMAINS = ('KeychainDomain', 'RootDomain', 'WirelessDomain', 'ManagedPreferencesDomain',
+    'SystemPreferencesDomain', 'DatabaseDomain', 'HealthDomain', 'HomeKitDomain',
+    'KeyboardDomain', 'TonesDomain', 'MobileDeviceDomain', 'InstallDomain')
+WORDS = ('data', 'cache', 'images', 'store', 'sync', 'index', 'settings', 'session', 'media',
+    'thumbnails', 'offline', 'events', 'messages', 'contacts', 'assets', 'logs', 'blobs')
+VENDORS = ('com.apple', 'com.google', 'com.facebook', 'net.whatsapp', 'org.mozilla',
+    'com.spotify', 'com.microsoft', 'de.example', 'com.dropbox', 'ch.threema')
+
+def _apps(rng):
+    return ['{}.{}{}'.format(rng.choice(VENDORS), rng.choice(WORDS), number)
+        for number in range(APPS)]
+
+def _domain(rng, apps):
+    # skewed like real backups, app containers follow a Zipf-like distribution
+    draw = rng.random()
+    if draw < 0.20:
+        return 'camera', 'CameraRollDomain'
+    if draw < 0.35:
+        return 'media', 'MediaDomain'
+    if draw < 0.55:
+        return 'home', 'HomeDomain'
+    if draw < 0.97:
+        app = apps[min(int(rng.paretovariate(1.0)) - 1, len(apps) - 1)]
+        kind = rng.random()
+        if kind < 0.85:
+            return 'app', 'AppDomain-' + app
+        if kind < 0.95:
+            return 'app', 'AppDomainGroup-group.' + app
+        return 'app', 'AppDomainPlugin-' + app + '.extension'
+    return 'system', rng.choice(SYSTEM_DOMAINS)
+
+def _path(rng, kind, domain):
+    # (directory, file name, typical size in bytes) of a new entry
+    if kind == 'camera':
+        folder = '{}APPLE'.format(100 + rng.randrange(20))
+        name = 'IMG_{:04d}.{}'.format(rng.randrange(10000), rng.choice(('HEIC', 'JPG', 'MOV', 'PNG')))
+        if rng.random() < 0.3:
+            return 'Media/PhotoData/Thumbnails/V2/DCIM/' + folder + '/' + name, '5005.JPG', 20000
+        return 'Media/DCIM/' + folder, name, 2000000
+    if kind == 'media':
+        if rng.random() < 0.7:
+            directory = 'Library/SMS/Attachments/{:02x}/{:02d}/{}'.format(
+                rng.randrange(256), rng.randrange(16), str(uuid.UUID(int=rng.getrandbits(128))).upper())
+            return directory, rng.choice(('IMG_{:04d}.jpeg'.format(rng.randrange(10000)),
+                'Audio Message.caf', 'video.mov')), 500000
+        return rng.choice(('Media/Recordings', 'Media/Books/Purchases', 'Media/iTunes_Control/Music/F{:02d}'
+            .format(rng.randrange(50)))), '{}.m4a'.format(rng.randrange(100000)), 4000000
+    if kind == 'home':
+        directory = rng.choice(('Library/Preferences', 'Library/Caches/com.apple.{}/fsCachedData'
+            .format(rng.choice(WORDS)), 'Library/Mail', 'Library/SMS', 'Library/Safari',
+            'Library/Cookies', 'Library/Calendar', 'Library/AddressBook'))
+        if directory.endswith('fsCachedData'):
+            return directory, str(uuid.UUID(int=rng.getrandbits(128))).upper(), 8000
+        return directory, 'com.apple.{}{}.{}'.format(rng.choice(WORDS), rng.randrange(1000),
+            rng.choice(('plist', 'db', 'sqlite'))), 4000
+    if kind == 'app':
+        bundle = domain.split('-', 1)[1]
+        directory = rng.choice(('Documents', 'Documents/' + rng.choice(WORDS),
+            'Library/Caches/{}/{:02x}'.format(bundle, rng.randrange(256)), 'Library/Preferences',
+            'Library/Application Support/' + rng.choice(WORDS), 'tmp'))
+        return directory, '{}{}.{}'.format(rng.choice(WORDS), rng.randrange(100000),
+            rng.choice(('plist', 'json', 'sqlite', 'png', 'dat'))), 6000
+    return 'Library/Preferences', 'com.apple.{}{}.plist'.format(rng.choice(WORDS), rng.randrange(1000)), 2000
+
+def file_blob(relative_path, flags, size, mtime, inode, target=None, encryption_key=None):
+    # 'file' BLOB of an MBFile archived by NSKeyedArchiver
+    mode = {1: 0o100644, 2: 0o40755, 3: 0o120755}[flags]
+    root = {'$class': plistlib.UID(3), 'Birth': mtime - 3600, 'LastModified': mtime,
+        'LastStatusChange': mtime, 'InodeNumber': inode, 'Mode': mode, 'Size': size,
+        'UserID': 501, 'GroupID': 501, 'RelativePath': plistlib.UID(2),
+        'ProtectionClass': 3 if flags == 1 else 0, 'Flags': 0}
+    objects = ['$null', root, relative_path,
+        {'$classname': 'MBFile', '$classes': ['MBFile', 'NSObject']}]
+    if target is not None:
+        root['Target'] = plistlib.UID(len(objects))
+        objects.append(target)
+    if encryption_key is not None:
+        root['EncryptionKey'] = plistlib.UID(len(objects))
+        objects.append({'NS.data': encryption_key, '$class': plistlib.UID(len(objects) + 1)})
+        objects.append({'$classname': 'NSMutableData',
+            '$classes': ['NSMutableData', 'NSData', 'NSObject']})
+    return plistlib.dumps({'$version': 100000, '$archiver': 'NSKeyedArchiver',
+        '$top': {'root': plistlib.UID(1)}, '$objects': objects}, fmt=plistlib.FMT_BINARY)
+
+def file_id(domain, relative_path):
+    # as computed by iOS
+    return hashlib.sha1('{}-{}'.format(domain, relative_path).encode()).hexdigest()
+
+class Encryptor:
+    # keybag and keys of an encrypted backup
+    def __init__(self, rng, password):
+        from cryptography.hazmat.primitives import keywrap, padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        self._keywrap = keywrap
+        self._padding = padding
+        self._cipher = lambda key: Cipher(algorithms.AES(key), modes.CBC(bytes(16)))
+        self.rng = rng
+        dpsl, salt = rng.randbytes(20), rng.randbytes(20)
+        dpic, iterations = KDF_ITERATIONS
+        key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), dpsl, dpic, 32)
+        key = hashlib.pbkdf2_hmac('sha1', key, salt, iterations, 32)
+        self.class_keys = {number: rng.randbytes(32) for number in PROTECTION_CLASSES}
+        blocks = [(b'VERS', 4), (b'TYPE', 1), (b'UUID', rng.randbytes(16)),
+            (b'HMCK', rng.randbytes(40)), (b'WRAP', 0), (b'SALT', salt), (b'ITER', iterations),
+            (b'DPWT', 1), (b'DPIC', dpic), (b'DPSL', dpsl)]
+        for number, class_key in self.class_keys.items():
+            blocks += [(b'UUID', rng.randbytes(16)), (b'CLAS', number), (b'WRAP', 2),
+                (b'KTYP', 0), (b'WPKY', keywrap.aes_key_wrap(key, class_key))]
+        self.keybag = b''.join(tag + struct.pack('>I', 4 if isinstance(value, int) else len(value))
+            + (struct.pack('>I', value) if isinstance(value, int) else value) for tag, value in blocks)
+
+    def new_key(self, protection_class):
+        # (plain key, wrapped key as stored in EncryptionKey or ManifestKey)
+        key = self.rng.randbytes(32)
+        wrapped = self._keywrap.aes_key_wrap(self.class_keys[protection_class], key)
+        return key, struct.pack('<I', protection_class) + wrapped
+
+    def encrypt(self, key, data):
+        padder = self._padding.PKCS7(128).padder()
+        encryptor = self._cipher(key).encryptor()
+        return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+def _rows(rng, rows, max_payload):
+    # yields (fileID, domain, relativePath, flags, size, target, content) until rows are made,
+    # content is (offset, size) into a shared pool of random bytes
+    apps = _apps(rng)
+    paths = set()
+    contents = []
+    count = 0
+    while count < rows:
+        kind, domain = _domain(rng, apps)
+        directory, name, typical = _path(rng, kind, domain)
+        relative_path = directory + '/' + name
+        if (domain, relative_path) in paths:
+            continue
+        # every directory up to the domain itself has a row
+        parts = directory.split('/')
+        for depth in range(len(parts) + 1):
+            parent = '/'.join(parts[:depth])
+            if (domain, parent) not in paths and count < rows:
+                paths.add((domain, parent))
+                count += 1
+                yield file_id(domain, parent), domain, parent, 2, 0, None, None
+        if count >= rows:
+            break
+        paths.add((domain, relative_path))
+        count += 1
+        if rng.random() < SYMLINKS:
+            yield file_id(domain, relative_path), domain, relative_path, 3, 0, \
+                '/private/var/mobile/' + relative_path, None
+            continue
+        if contents and rng.random() < DUPLICATES:
+            content = rng.choice(contents)
+        else:
+            size = min(int(rng.lognormvariate(0, 1.0) * typical / 4), max_payload)
+            content = (rng.randrange(max_payload + 1), size)
+            contents.append(content)
+        yield file_id(domain, relative_path), domain, relative_path, 1, content[1], None, content
+
+def generate(path, rows, seed=0, max_payload=MAX_PAYLOAD, password=None):
+    # backup of about rows rows in the directory path, an earlier one is replaced,
+    # encrypted with a password
+    rng = random.Random(seed)
+    encryptor = Encryptor(random.Random(seed + 1), password) if password is not None else None
+    os.makedirs(path, exist_ok=True)
+    db_url = os.path.join(path, 'Manifest.db')
+    if os.path.exists(db_url):
+        os.remove(db_url)
+    for number in range(256):
+        os.makedirs(os.path.join(path, '{:02x}'.format(number)), exist_ok=True)
+    # payloads are slices of one buffer, twice as long as the largest one
+    pool = rng.randbytes(2 * max_payload + 1)
+    connection = sqlite3.connect(db_url)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    batch = []
+    inode = 1000
+    for file_id_, domain, relative_path, flags, size, target, content in _rows(rng, rows, max_payload):
+        inode += 1
+        mtime = 1500000000 + rng.randrange(200000000)
+        key = wrapped = None
+        if encryptor is not None and content is not None:
+            key, wrapped = encryptor.new_key(3)
+        batch.append((file_id_, domain, relative_path, flags,
+            file_blob(relative_path, flags, size, mtime, inode, target, wrapped)))
+        if content is not None:
+            offset, size = content
+            data = pool[offset:offset + size]
+            with open(os.path.join(path, file_id_[:2], file_id_), 'wb') as f:
+                f.write(encryptor.encrypt(key, data) if key is not None else data)
+        if len(batch) >= BATCH_SIZE:
+            connection.executemany("INSERT INTO Files VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    connection.executemany("INSERT INTO Files VALUES (?, ?, ?, ?, ?)", batch)
+    connection.commit()
+    connection.close()
+    manifest = {'IsEncrypted': False, 'Version': '10.0', 'Lockdown': {
+        'DeviceName': 'Synthetic iPhone', 'ProductVersion': '17.0', 'BuildVersion': '21A329'},
+        'Applications': {}}
+    if encryptor is not None:
+        key, wrapped = encryptor.new_key(4)
+        with open(db_url, 'rb') as f:
+            data = f.read()
+        with open(db_url, 'wb') as f:
+            f.write(encryptor.encrypt(key, data))
+        manifest.update({'IsEncrypted': True, 'BackupKeyBag': encryptor.keybag,
+            'ManifestKey': wrapped})
+    with open(os.path.join(path, 'Manifest.plist'), 'wb') as f:
+        plistlib.dump(manifest, f, fmt=plistlib.FMT_BINARY)
+    with open(os.path.join(path, 'Status.plist'), 'wb') as f:
+        plistlib.dump({'SnapshotState': 'finished', 'IsFullBackup': True, 'Version': '3.3',
+            'BackupState': 'new'}, f, fmt=plistlib.FMT_BINARY)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic iOS backup.')
+    parser.add_argument('directory')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-payload', type=int, default=MAX_PAYLOAD,
+        help='upper limit for the size of a payload file (default %(default)s)')
+    parser.add_argument('--password', help='encrypt the backup (needs cryptography)')
+    args = parser.parse_args(argv)
+    generate(args.directory, args.rows, args.seed, args.max_payload, args.password)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# virtual list model for the rows of table Files
+#
+#  File: filelist.py
+#
+#  A Gtk.ListStore holds a copy of every row and sorts in Python, which gets
+#  sluggish for domains with hundreds of thousands of files. FileListModel
+#  keeps only the rowids of the sidecar's table Files in the order SQLite
+#  returned them, the rows are fetched a page at a time when the TreeView
+#  draws them. Clicking a column header hands the new order back to the
+#  application, which queries the rowids again with another ORDER BY.
+#  The alternating background is a column of the model too, so the view
+#  needs no cell data function.
+#
+#  reset emits no signals, detach the model from the TreeView before and
+#  attach it again afterwards. extend does the same, or, for later batches
+#  of a model already shown, emits row-inserted for every new row with
+#  signal=True, so the TreeView keeps its scroll position and selection.
+
+import functools, os
+from array import array
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import GObject, Gtk
+
+# local modules
+from manifestdb import instrument
+
+# rows fetched at once when drawing
+PAGE_SIZE = 256
+# number of pages kept in memory
+PAGE_CACHE_SIZE = 64
+# names of the columns shown, as in table Files
+COLUMNS = ('fileID', 'relativePath', 'flags')
+# types of the columns, the last one is the background color of the row
+COLUMN_TYPES = (GObject.TYPE_STRING, GObject.TYPE_STRING, GObject.TYPE_LONG, GObject.TYPE_STRING)
+BACKGROUND_COLUMN = 3
+
+class FileListModel(GObject.Object, Gtk.TreeModel, Gtk.TreeSortable):
+    def __init__(self, fetch, on_sort, colors):
+        GObject.Object.__init__(self)
+        # fetch(rowids) returns a dict rowid -> (fileID, domain, relativePath, flags)
+        self._fetch = fetch
+        # on_sort(column, descending) is called when a column header was clicked
+        self._on_sort = on_sort
+        # background colors of even and odd rows
+        self._colors = colors
+        self._rowids = array('q')
+        self._show_domain = False
+        self._sort_column_id = COLUMNS.index('relativePath')
+        self._sort_type = Gtk.SortType.ASCENDING
+        # iterators of an earlier content are invalid
+        self._stamp = 0
+        self._page = functools.lru_cache(maxsize=PAGE_CACHE_SIZE)(self._fetch_page)
+
+    def reset(self, show_domain=False):
+        # remove all rows, with show_domain the paths are shown below their domain
+        self._rowids = array('q')
+        self._show_domain = show_domain
+        self._stamp = (self._stamp + 1) & 0x7fffffff
+        self._page.cache_clear()
+
+    def extend(self, rowids, signal=False):
+        start = len(self._rowids)
+        self._rowids.extend(rowids)
+        # the last page may have been fetched before it was complete
+        self._page.cache_clear()
+        if signal:
+            for index in range(start, len(self._rowids)):
+                self.row_inserted(Gtk.TreePath([index]), self._iter(index))
+
+    def sort_order(self):
+        # (column name, descending) for the ORDER BY of the next query
+        return (COLUMNS[self._sort_column_id], self._sort_type == Gtk.SortType.DESCENDING)
+
+    def _rows(self, rowids):
+        rows = self._fetch(rowids)
+        result = []
+        for rowid in rowids:
+            file_id, domain, relative_path, flags = rows[rowid]
+            if self._show_domain:
+                relative_path = os.path.join(domain, relative_path)
+            result.append((file_id, relative_path, flags))
+        return result
+
+    @instrument.timed('filelist.page')
+    def _fetch_page(self, number):
+        return self._rows(self._rowids[number * PAGE_SIZE:(number + 1) * PAGE_SIZE])
+
+    def rows(self):
+        # all rows as (fileID, relativePath, flags) in the order shown, page by page
+        for start in range(0, len(self._rowids), PAGE_SIZE):
+            yield from self._rows(self._rowids[start:start + PAGE_SIZE])
+
+    def _iter(self, index):
+        tree_iter = Gtk.TreeIter()
+        tree_iter.stamp = self._stamp
+        # user_data is a pointer, rows are counted from 1 so the first is not NULL
+        tree_iter.user_data = index + 1
+        return tree_iter
+
+    def _index(self, tree_iter):
+        return tree_iter.user_data - 1
+
+    # Gtk.TreeModel
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(COLUMN_TYPES)
+
+    def do_get_column_type(self, index):
+        return COLUMN_TYPES[index]
+
+    def do_get_iter(self, path):
+        index = path.get_indices()[0]
+        if index < len(self._rowids):
+            return (True, self._iter(index))
+        return (False, None)
+
+    def do_get_path(self, tree_iter):
+        return Gtk.TreePath([self._index(tree_iter)])
+
+    def do_get_value(self, tree_iter, column):
+        index = self._index(tree_iter)
+        if column == BACKGROUND_COLUMN:
+            return self._colors[index % 2]
+        return self._page(index // PAGE_SIZE)[index % PAGE_SIZE][column]
+
+    def do_iter_next(self, tree_iter):
+        index = self._index(tree_iter) + 1
+        if index < len(self._rowids):
+            return (True, self._iter(index))
+        return (False, None)
+
+    def do_iter_previous(self, tree_iter):
+        index = self._index(tree_iter) - 1
+        if index >= 0:
+            return (True, self._iter(index))
+        return (False, None)
+
+    def do_iter_children(self, parent):
+        if parent is None and self._rowids:
+            return (True, self._iter(0))
+        return (False, None)
+
+    def do_iter_has_child(self, tree_iter):
+        return False
+
+    def do_iter_n_children(self, tree_iter):
+        if tree_iter is None:
+            return len(self._rowids)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and n < len(self._rowids):
+            return (True, self._iter(n))
+        return (False, None)
+
+    def do_iter_parent(self, child):
+        return (False, None)
+
+    # Gtk.TreeSortable, the sorting itself is done by SQLite
+
+    def do_get_sort_column_id(self):
+        return (True, self._sort_column_id, self._sort_type)
+
+    def do_set_sort_column_id(self, sort_column_id, order):
+        if not 0 <= sort_column_id < len(COLUMNS):
+            return
+        self._sort_column_id = sort_column_id
+        self._sort_type = order
+        self.sort_column_changed()
+        self._on_sort(COLUMNS[sort_column_id], order == Gtk.SortType.DESCENDING)
+
+    def do_set_sort_func(self, sort_column_id, sort_func, user_data=None):
+        pass
+
+    def do_set_default_sort_func(self, sort_func, user_data=None):
+        pass
+
+    def do_has_default_sort_func(self):
+        return False
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# List ManifestDB from the command line
+#
+#  File: manifestDBcli.py
+#
+#  Starts the command line interface of the package manifestdb out of this
+#  directory without installing it, see manifestdb/cli.py for the usage.
+#  Installed with setup.py the same is the command 'manifestdb'.
+
+import sys
+
+# local modules
+from manifestdb import cli
+
+if __name__ == '__main__':
+    sys.exit(cli.main())
@@ -38,7 +38,7 @@
 #                  last changes Sun, November 23, 2025
 #         Copyright © 2016-2025 Erich Küster. All rights reserved.
 
-import csv, os, queue, re, sqlite3, sys, threading
+import os, re, sqlite3, sys, threading
 
 import gettext
 _ = gettext.gettext
@@ -46,13 +46,17 @@ _ = gettext.gettext
 import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gdk, GdkPixbuf, Gio, GLib, GObject
-import plistlib as _plistlib
-from datetime import datetime
 from inspect import currentframe
 from time import sleep
 
 # local modules
 from icon_svg import svg
+from manifestdb import backup
+from manifestdb import encryption
+from manifestdb import export
+from manifestdb import extraction
+from manifestdb import instrument
+import filelist
 import toolbar
 
 ###########
@@ -70,6 +74,18 @@ css = b"""
 """
 provider.load_from_data(css)
 
+# icons of the entries in the directory tree by flags
+NODE_ICONS = {1: 'text-x-generic', 2: 'folder', 3: 'emblem-symbolic-link'}
+
+def format_size(size):
+    # sizes are None until the sidecar is complete
+    return '' if size is None else GLib.format_size(size)
+
+def domain_summary(files, size):
+    if size is None:
+        return _('{} files').format(files)
+    return _('{} files, {}').format(files, GLib.format_size(size))
+
 ###########
 # classes #
 ###########
@@ -91,39 +107,55 @@ class InfoDialog(Gtk.Dialog):
         box.add(label)
         self.show_all()
 
-class ProgressThread(threading.Thread):
-    def __init__(self, queue, grand_parent):
+class LoaderThread(threading.Thread):
+    # reads batches of rows outside of the GTK main thread and hands them
+    # over to the main loop, on_batch(batch) and on_done(cancelled, error)
+    # are always called in the main thread
+    def __init__(self, batches, on_batch, on_done, connection=None, name='loader'):
         threading.Thread.__init__(self)
-        self._extract_path = grand_parent.extract_path
-        self._files = grand_parent.files
-        self._queue = queue
+        self.daemon = True
+        # timer of the instrumentation
+        self._timer = 'gui.' + name
+        self._batches = batches
+        self._on_batch = on_batch
+        self._on_done = on_done
+        # connection to interrupt a long running query when cancelled
+        self._connection = connection
+        self.cancelled = threading.Event()
+        # a detached loader was replaced by another one and reports nothing
+        self.detached = False
 
-    def run(self):
-        file_count = 0
-        subtotal = 0
-        for file in self._files:
-            file_url = file['fileURL']
-            target_url = os.path.join(self._extract_path, file['relativePath'])
-            target_dirs = os.path.dirname(target_url)
-            os.makedirs(target_dirs, exist_ok=True, mode=0o750)
-            try:
-                with open(file_url, 'rb') as fr, open(target_url, 'wb') as fw:
-                    while True:
-                        chunk = fr.read(1024)
-                        if chunk: 
-                            fw.write(chunk)
-                        else:
-                            break
-            except EnvironmentError:
-                app.window.context_id = app.window.status_bar.push(app.window.context_id,\
-                    _('An error occurred while copying, good luck!'))
-            finally:
-                file_count += 1
-                subtotal += file['fileSize']
-                self._queue.put(subtotal)
-        app.window.context_id = app.window.status_bar.push(app.window.context_id,\
-            _('{} files extracted to: {}').format(file_count, self._extract_path))
+    def cancel(self, detach=False):
+        self.detached = detach
+        self.cancelled.set()
+        if self._connection is not None:
+            self._connection.interrupt()
+
+    def _idle_batch(self, batch):
+        # batches still queued in the main loop are dropped after cancelling
+        if not self.cancelled.is_set():
+            self._on_batch(batch)
+        return False
+
+    def _idle_done(self, error):
+        if not self.detached:
+            self._on_done(self.cancelled.is_set(), error)
+        return False
 
+    @instrument.profiled
+    def run(self):
+        error = None
+        try:
+            with instrument.timer(self._timer):
+                for batch in self._batches():
+                    if self.cancelled.is_set():
+                        break
+                    GLib.idle_add(self._idle_batch, batch)
+        except sqlite3.Error as exception:
+            # an interrupted query is no error if we cancelled it
+            if not self.cancelled.is_set():
+                error = exception
+        GLib.idle_add(self._idle_done, error)
 
 class ProgressbarDialog(Gtk.Dialog):
     def __init__(self, parent):
@@ -136,36 +168,57 @@ class ProgressbarDialog(Gtk.Dialog):
         self.connect("response", self._on_response)
         label = Gtk.Label(label=_("Copying Files ..."))
         self.progressbar = Gtk.ProgressBar(show_text=True)
+        # throughput in MB/s and files/s
+        self.rate_label = Gtk.Label()
         box = self.get_content_area()
         box.add(label)
         box.add(self.progressbar)
+        box.add(self.rate_label)
         self.show_all()
-        # total number of bytes to copy
-        self._total = parent.total
-        # queue to share data between threads
-        self._queue = queue.Queue()
-        # install timer event to check the queue every interval for new data from the thread
+        self._parent = parent
+        self._extract_path = parent.extract_path
+        # aggregated progress of all worker threads
+        self._progress = extraction.Progress(len(parent.jobs), parent.total)
+        # pool of threads copying the files, they share one queue for progress events
+        self._extraction = extraction.Extraction(parent.jobs, parent.workers, parent.journal,\
+            parent.attributes, parent.dedup, parent.backup.keybag)
+        # install timer event to check the queue every interval for new data from the threads
         GLib.timeout_add(interval=20, function=self._on_timer)
-        # start the thread
-        self._thread = ProgressThread(self._queue, parent)
-        self._thread.daemon = True
-        self._thread.start()
+        self._extraction.start()
 
     def _on_timer(self):
-        # if the thread is dead and no more data available...
-        if not self._thread.is_alive() and self._queue.empty():
+        finished = not self._extraction.is_alive()
+        # read data from the threads
+        self._progress.drain(self._extraction.events)
+        if self._extraction.cancelled.is_set():
+            # dialog is destroyed already
+            if finished:
+                self._report(_('Extraction cancelled after {} files'))
+                return False
+            return True
+        # update the progressbar
+        self.progressbar.set_fraction(self._progress.fraction())
+        self.rate_label.set_text(self._progress.summary())
+        # if the threads are done and no more data available...
+        if finished and self._extraction.events.empty():
+            self._report(_('{} files extracted to: {}'))
             # ...end the timer
             return False
-        # if data available
-        while not self._queue.empty():
-            # read data from the thread
-            subtotal = self._queue.get()
-            # update the progressbar
-            self.progressbar.set_fraction(subtotal / self._total)
         # keep the timer alive
         return True
 
+    def _report(self, message):
+        self._progress.finish()
+        self._progress.errors.extend(self._extraction.errors)
+        message = message.format(self._progress.files, self._extract_path)
+        if self._progress.errors:
+            message = _('{} ({} errors while copying)').format(message, len(self._progress.errors))
+        self._parent.push_status('{}, {}'.format(message, self._progress.summary()))
+
     def _on_response(self, dialog, response_id):
+        # closing the dialog stops copying
+        if self._extraction.is_alive():
+            self._extraction.cancel()
         dialog.destroy()
 
 class Window(Gtk.ApplicationWindow):
@@ -197,21 +250,23 @@ class Window(Gtk.ApplicationWindow):
         settings = Gtk.Settings.get_default()
         theme_name = settings.get_property("gtk-theme-name")
         self.is_dark = "dark" in theme_name.lower()
-        self.backup_path = str()
         # records of 'naked' domains
         self.naked_domains = []
-        self.domain_items = []
         self.clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
         self.dialog_label = Gtk.Label()
         self.dialog_label.set_justify(Gtk.Justification.LEFT)
 
         # create combobox with entry
-        listmodel = Gtk.ListStore(str, int)
+        listmodel = Gtk.ListStore(str, int, str)
         self.combo = Gtk.ComboBox.new_with_model_and_entry(model=listmodel)
         # cellrenderers to render the data
         renderer_text = Gtk.CellRendererText()
         self.combo.pack_start(renderer_text, True)
         self.combo.add_attribute(renderer_text, "text", 1)
+        # number of files and total size of the domain
+        renderer_summary = Gtk.CellRendererText(xalign=1.0)
+        self.combo.pack_end(renderer_summary, False)
+        self.combo.add_attribute(renderer_summary, "text", 2)
         # active row at the beginning is undefined
         self.combo.set_active(-1)
         self.combo.connect("changed", app.on_combo_changed)
@@ -229,10 +284,50 @@ class Window(Gtk.ApplicationWindow):
         domain_button.show()
         # set the name of the action associated with the button.
         domain_button.connect("clicked", app.on_extract_domain_clicked)
-        # combination of combobox and button
+        # button extract all domains (or those matching a pattern in the entry)
+        all_button = Gtk.Button.new_with_label(_("Extract All..."))
+        all_button.set_tooltip_text(_("Extract all domains, or those matching a pattern "
+            "like AppDomain-* in the entry, each into a folder of its name"))
+        all_button.connect("clicked", app.on_extract_all_clicked)
+        # number of threads copying files in parallel
+        adjustment = Gtk.Adjustment(value=extraction.DEFAULT_WORKERS, lower=1, upper=64,\
+            step_increment=1, page_increment=4)
+        self.workers_button = Gtk.SpinButton(adjustment=adjustment, numeric=True)
+        self.workers_button.set_tooltip_text(_("Number of threads copying files"))
+        # button to cancel loading in the background
+        self.cancel_button = Gtk.Button.new_with_label(_("Cancel"))
+        self.cancel_button.set_tooltip_text(_("Cancel loading"))
+        self.cancel_button.set_sensitive(False)
+        self.cancel_button.connect("clicked", app.on_cancel_loading_clicked)
+        # identical files are written once while extracting
+        self.dedup_button = Gtk.CheckButton(label=_("Dedup"))
+        self.dedup_button.set_tooltip_text(_("Write identical files once, link the duplicates"))
+        # switch between the list and the directory tree of a domain
+        self.tree_button = Gtk.ToggleButton(label=_("Tree"))
+        self.tree_button.set_tooltip_text(_("Show domain as directory tree"))
+        self.tree_button.connect("toggled", app.on_tree_toggled)
+        # combination of combobox and buttons
         self.domain_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
         self.domain_box.pack_start(self.combo, True, True, 0)
+        self.domain_box.pack_end(all_button, False, True, 0)
         self.domain_box.pack_end(domain_button, False, True, 0)
+        self.domain_box.pack_end(self.workers_button, False, True, 0)
+        self.domain_box.pack_end(self.dedup_button, False, True, 0)
+        self.domain_box.pack_end(self.cancel_button, False, True, 0)
+        self.domain_box.pack_end(self.tree_button, False, True, 0)
+        # search for paths in all domains while typing
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text(_("Search paths in all domains"))
+        self.search_entry.connect("search-changed", app.on_search_changed)
+        self.search_mode = Gtk.ComboBoxText()
+        for mode in backup.SEARCH_MODES:
+            self.search_mode.append(mode, _(mode))
+        self.search_mode.set_active_id(backup.SEARCH_MODES[0])
+        self.search_mode.set_tooltip_text(_("How to match the paths"))
+        self.search_mode.connect("changed", app.on_search_mode_changed)
+        self.search_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        self.search_box.pack_start(self.search_entry, True, True, 0)
+        self.search_box.pack_end(self.search_mode, False, True, 0)
         # create scrolled_window for treeview under the combobox
         self.scrolled_window = Gtk.ScrolledWindow()
         self.scrolled_window.set_size_request(-1, 384)
@@ -240,16 +335,26 @@ class Window(Gtk.ApplicationWindow):
         # options for the scrollbars (ALWAYS, AUTOMATIC, NEVER)
         self.scrolled_window.set_policy(\
             Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-        # model creation for the treeview
-        treemodel = Gtk.ListStore( str, str, 'glong')
+        # background color depends on theme
+        if self.is_dark:
+            b_colors = ['darkolivegreen', 'black']
+        else:
+            b_colors = ['darkolivegreen', 'white']
+        # model creation for the treeview, rows are fetched from the sidecar when shown
+        self.treemodel = filelist.FileListModel(app.rows_by_rowid, app.on_sort_changed, b_colors)
         # create TreeView
-        self.treeview = Gtk.TreeView(model=treemodel)
-        treeview_columns = ['fileID', 'relativePath', 'flags']
-        for col_num, name in enumerate(treeview_columns):
+        self.treeview = Gtk.TreeView(model=self.treemodel)
+        # all rows have the same height, no need to measure every row
+        self.treeview.set_fixed_height_mode(True)
+        for col_num, name in enumerate(filelist.COLUMNS):
             # align text in column cells of row (0.0 left, 0.5 center, 1.0 right)
-            rendererText = Gtk.CellRendererText(xalign=0.0, editable=False)
+            xalign = 1.0 if name == 'flags' else 0.0
+            rendererText = Gtk.CellRendererText(xalign=xalign, editable=False)
             column = Gtk.TreeViewColumn(name ,rendererText, text=col_num)
-            column.set_cell_data_func(rendererText, self.celldatafunction, func_data=col_num)
+            column.add_attribute(rendererText, 'cell-background', filelist.BACKGROUND_COLUMN)
+            # needed by the fixed height mode
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_fixed_width(320 if name == 'relativePath' else 120)
             # center the column titles in first row
             column.set_alignment(0.5)
             # make all the column reorderable, resizable and sortable
@@ -259,6 +364,30 @@ class Window(Gtk.ApplicationWindow):
             self.treeview.append_column(column)
         # Connect signal handler
         self.treeview.connect("row_activated", app.on_row_activated)
+        # directory tree of a domain, the first columns are the same as in the list,
+        # then name, icon, number of regular files and size of the subtree,
+        # the entries of a directory are read when it is expanded
+        self.treestore = Gtk.TreeStore(str, str, 'glong', str, str, 'glong', str)
+        self.tree_view = Gtk.TreeView(model=self.treestore)
+        column = Gtk.TreeViewColumn('name')
+        rendererIcon = Gtk.CellRendererPixbuf()
+        column.pack_start(rendererIcon, False)
+        column.add_attribute(rendererIcon, 'icon-name', 4)
+        rendererText = Gtk.CellRendererText(xalign=0.0, editable=False)
+        column.pack_start(rendererText, True)
+        column.add_attribute(rendererText, 'text', 3)
+        column.set_alignment(0.5)
+        column.set_resizable(True)
+        column.set_expand(True)
+        self.tree_view.append_column(column)
+        for col_num, name in ((5, 'files'), (6, 'size')):
+            rendererText = Gtk.CellRendererText(xalign=1.0, editable=False)
+            column = Gtk.TreeViewColumn(name, rendererText, text=col_num)
+            column.set_alignment(0.5)
+            column.set_resizable(True)
+            self.tree_view.append_column(column)
+        self.tree_view.connect("test-expand-row", app.on_test_expand_row)
+        self.tree_view.connect("row_activated", app.on_tree_row_activated)
         '''
         # create the Text Buffer
         text_buffer = Gtk.TextBuffer.new()
@@ -279,25 +408,20 @@ class Window(Gtk.ApplicationWindow):
         self.context_id = self.status_bar.push(0, _("Choose a Database, click Open"))
         self.add(self.vbox)
 
-    def celldatafunction(self, column, cell, model, iter, func_data):
-        # column is provided, but not used
-        col_num = func_data
-        value = model.get(iter, col_num)[0]
-        if type(value) is int:
-            cell.set_property('text', f'{value:>8d}')
-        path = model.get_path(iter)
-        row = path[0]
-        # background color depends on theme
-        b_colors = []
-        if self.is_dark:
-            b_colors = ['darkolivegreen', 'black']
-        else:
-            b_colors = ['darkolivegreen', 'white']
-        cell.set_property('cell-background', b_colors[row % 2])
-
 class Application(Gtk.Application):
     def __init__(self):
         super(Application, self).__init__()
+        self.backup = None
+        self.loader = None
+        # reads the domains, apart from self.loader, rows loaded meanwhile do not stop it
+        self.domain_loader = None
+        self.loaded_domain = None
+        # path of the backup being opened in the background
+        self.opening = None
+        # domain shown in the directory tree
+        self.tree_domain = None
+        # queries the rows shown in the treeview again, e.g. in another order
+        self.reload_rows = None
 
     def do_activate(self):
         self.window = Window(self)
@@ -349,16 +473,6 @@ class Application(Gtk.Application):
         dialog.destroy()
         return filename
 
-    def read_binary_plist(self, file):
-        try:
-            with open(file, 'rb') as f:
-                s = _plistlib.load(f)
-            keys = sorted(s.keys())
-            vals = [s[k] for k in keys]
-            return dict(zip(keys, vals))
-        except EnvironmentError:
-            return None
- 
     def on_open(self, action, parameter):
         if (self.window.first_run is False):
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
@@ -368,36 +482,62 @@ class Application(Gtk.Application):
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                 _("No Database chosen, try again"))
             return
-        self.backup_path = os.path.dirname(backup_url)
-        manifest_file = os.path.join(self.backup_path,'Manifest.plist')
-        self.manifest = self.read_binary_plist(manifest_file)
-        status_file = os.path.join(self.backup_path,'Status.plist')
-        self.status = self.read_binary_plist(status_file)
+        # the backup shown so far stays open until the new one could be opened
+        self.open_backup(backup_url)
 
-        try:
-            sqliteConnection = sqlite3.connect(backup_url)
-            cursor = sqliteConnection.cursor()
-            self.window.context_id = self.window.status_bar.push(self.window.context_id,\
-                _("Database created and successfully connected to SQLite"))
-            query = "SELECT * FROM Files"
-            cursor.execute(query)
-            self.records = cursor.fetchall()
-            # order column names into first tuple of the list
-            self.names = list(zip(*cursor.description))
-            # truncate list to first tuple
-            del self.names[1:]
-            cursor.close()
-        except sqlite3.Error as error:
+    def open_backup(self, backup_url, password=None):
+        # Manifest.db, Manifest.plist and Status.plist, nothing is read up front, but an
+        # encrypted backup derives the key and decrypts Manifest.db, which takes seconds,
+        # so it is opened in a thread of its own and on_backup_opened called in the main thread
+        self.opening = backup_url
+        def run():
+            opened = error = None
+            try:
+                opened = backup.Backup(backup_url, password=password)
+            except (encryption.PasswordError, ImportError, sqlite3.Error, EnvironmentError,\
+                    ValueError) as exception:
+                error = exception
+            GLib.idle_add(self.on_backup_opened, backup_url, password, opened, error)
+        threading.Thread(target=run, name='open_backup', daemon=True).start()
+
+    def on_backup_opened(self, backup_url, password, opened, error):
+        if self.opening != backup_url:
+            # another backup was chosen meanwhile
+            if opened is not None:
+                opened.close()
+            return False
+        self.opening = None
+        if isinstance(error, encryption.PasswordError):
+            # the first try is without, then until the password fits or the dialog is cancelled
+            message = _("The backup is encrypted, please enter its password")\
+                if password is None else _("Wrong password, please try again")
+            password = self.ask_password(message)
+            if password is None:
+                self.push_status(_("No password given, the encrypted backup is not opened"))
+            else:
+                self.push_status(_("Unlocking the encrypted backup, please wait ..."))
+                self.open_backup(backup_url, password)
+        elif isinstance(error, ImportError):
+            # package cryptography not installed
+            self.push_status(str(error))
+        elif error is not None:
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                 _("Error while connecting to sqlite"))
-        finally:
-            if (sqliteConnection):
-                sqliteConnection.close()
-                self.window.context_id = self.window.status_bar.push(self.window.context_id,\
-                    _("The SQLite connection is closed after reading"))
+        else:
+            self.show_backup(opened)
+        return False
+
+    def show_backup(self, opened):
+        # stop loading and close the databases of an earlier run
+        self.stop_loading()
+        self.stop_domain_loading()
+        if self.backup is not None:
+            self.backup.close()
+        self.backup = opened
+        self.window.context_id = self.window.status_bar.push(self.window.context_id,\
+            _("Database created and successfully connected to SQLite"))
 
         listmodel = self.window.combo.get_model()
-        treemodel = self.window.treeview.get_model()
         if (len(self.window.naked_domains)):
             del self.window.naked_domains[:]
             # clear entry and models
@@ -406,30 +546,21 @@ class Application(Gtk.Application):
             placeholder = _("Please select domain to display")
             entry.set_text(placeholder)
             listmodel.clear()
-            treemodel.clear()
-        # filter out "naked" domains where relativePath is empty
-        for record in self.records:
-            path = record[2]
-            if (not path):
-                self.window.naked_domains.append(record[1])
-        # sort in ascending order
-        self.window.naked_domains.sort()
-        # fill combobox listmodel
-        index = 0
-        for naked_domain in self.window.naked_domains:
-            index += 1
-            listmodel.append([naked_domain, index])
-        self.window.context_id = self.window.status_bar.push(self.window.context_id,\
-            _('Combobox filled with {} domain names, please select one').format(index))
+            self.clear_rows()
+            self.reload_rows = None
+            self.window.treestore.clear()
+            self.loaded_domain = None
+            self.tree_domain = None
         self.window.remove(self.window.vbox)
         if (self.window.first_run):
             # prepare scrolled window
-            self.window.scrolled_window.add(self.window.treeview)
+            self.window.scrolled_window.add(self.current_view())
             self.window.scrolled_window.show()
             # add new widgets and reorder
             self.window.vbox.remove(self.window.label_box)
             # add horizontal combobox
             self.window.vbox.pack_start(self.window.domain_box, False, False, 0);
+            self.window.vbox.pack_start(self.window.search_box, False, False, 0);
             self.window.vbox.pack_start(self.window.scrolled_window, False, True, 0)
             self.window.vbox.pack_start(self.window.label_box, True, True, 0)
             # generate horizontal box at bottom for manifest, status, export
@@ -446,25 +577,138 @@ class Application(Gtk.Application):
             export_button = Gtk.Button.new_with_label(_("Export CSV..."))
             export_button.connect("clicked", self.on_export_csv)
             self.window.bottom_box.pack_end(export_button, False, True, 0)
-            self.window.bottom_box.pack_end(export_button, True, True, 0)
+            # typed columns for analytics, needs pyarrow
+            parquet_button = Gtk.Button.new_with_label(_("Export Parquet..."))
+            parquet_button.connect("clicked", self.on_export_parquet)
+            self.window.bottom_box.pack_end(parquet_button, False, True, 0)
             self.window.vbox.pack_start(self.window.bottom_box, False, True, 0)
             self.window.first_run = False
-        self.window.manifest_button.set_sensitive(self.manifest is not None)
-        self.window.status_button.set_sensitive(self.status is not None)
+        self.window.manifest_button.set_sensitive(self.backup.manifest is not None)
+        self.window.status_button.set_sensitive(self.backup.status is not None)
         self.window.add(self.window.vbox)
         self.window.show_all()
+        # (re)build the sidecar and query the domains in the background
+        self.window.context_id = self.window.status_bar.push(self.window.context_id,\
+            _("Reading domains, please wait ..."))
+        self.domain_loader = LoaderThread(self.domain_batches, self.on_domains_loaded,\
+            self.on_domains_done, self.backup.sidecar.connection, 'load_domains')
+        self.window.cancel_button.set_sensitive(True)
+        self.domain_loader.start()
+
+    def ask_password(self, message):
+        # password of an encrypted backup, None if cancelled
+        dialog = Gtk.Dialog(title=_("Encrypted Backup"), transient_for=self.window, flags=0)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
+        dialog.set_default_response(Gtk.ResponseType.OK)
+        dialog.set_border_width(8)
+        entry = Gtk.Entry(visibility=False, activates_default=True)
+        box = dialog.get_content_area()
+        box.add(Gtk.Label(label=message))
+        box.add(entry)
+        dialog.show_all()
+        response = dialog.run()
+        password = entry.get_text() if response == Gtk.ResponseType.OK else None
+        dialog.destroy()
+        return password
+
+    def domain_batches(self):
+        # runs in the loader thread
+        if self.backup.open_index():
+            GLib.idle_add(self.push_status,\
+                _("Index for domains created in {}").format(self.backup.sidecar.path))
+        # domains with number of files and total size, ordered by SQLite
+        yield self.backup.domains()
+
+    def on_domains_loaded(self, domains):
+        # fill combobox listmodel
+        listmodel = self.window.combo.get_model()
+        index = len(listmodel)
+        for naked_domain, files, size in domains:
+            index += 1
+            self.window.naked_domains.append(naked_domain)
+            listmodel.append([naked_domain, index, domain_summary(files, size)])
+
+    def on_domains_done(self, cancelled, error):
+        self.domain_loader = None
+        self.window.cancel_button.set_sensitive(self.loader is not None)
+        if error is not None:
+            self.push_status(_("Error while connecting to sqlite"))
+        elif cancelled:
+            self.push_status(_("Reading domains cancelled"))
+        else:
+            self.push_status(_('Combobox filled with {} domain names, please select one')\
+                .format(len(self.window.naked_domains)))
+            self.start_completion()
+            # a search typed while the domains were read
+            if self.window.search_entry.get_text():
+                self.on_search_changed(self.window.search_entry)
+
+    def start_completion(self):
+        # second pass over the sidecar, sizes, attributes and the search index
+        # are filled in the background while the domains can be used
+        opened = self.backup
+        def complete():
+            try:
+                completed = opened.complete_index()
+            except (sqlite3.Error, EnvironmentError):
+                # e.g. another backup was opened and this one closed meanwhile
+                return
+            if completed:
+                GLib.idle_add(self.on_index_completed, opened)
+        threading.Thread(target=complete, name='complete_index', daemon=True).start()
+
+    def on_index_completed(self, opened):
+        if opened is self.backup:
+            # the sizes of the domains are known now
+            summaries = {domain: domain_summary(files, size)
+                for domain, files, size in self.backup.domains()}
+            for row in self.window.combo.get_model():
+                if row[0] in summaries:
+                    row[2] = summaries[row[0]]
+            self.push_status(_("Index for sizes and searching completed"))
+        return False
+
+    def push_status(self, message):
+        self.window.context_id = self.window.status_bar.push(self.window.context_id, message)
+        return False
+
+    def start_loading(self, batches, on_batch, on_done, name='loader'):
+        self.stop_loading()
+        self.loader = LoaderThread(batches, on_batch, on_done, self.backup.sidecar.connection, name)
+        self.window.cancel_button.set_sensitive(True)
+        self.loader.start()
+
+    def stop_loading(self):
+        if self.loader is not None:
+            self.loader.cancel(detach=True)
+            self.loader.join()
+            self.loading_finished()
+
+    def loading_finished(self):
+        self.loader = None
+        self.window.cancel_button.set_sensitive(self.domain_loader is not None)
 
+    def stop_domain_loading(self):
+        if self.domain_loader is not None:
+            self.domain_loader.cancel(detach=True)
+            self.domain_loader.join()
+            self.domain_loader = None
+
+    def on_cancel_loading_clicked(self, button):
+        if self.loader is not None:
+            self.loader.cancel()
+        elif self.domain_loader is not None:
+            self.domain_loader.cancel()
+
+    @instrument.timed('gui.combo_changed')
     def on_combo_changed(self, combo):
         tree_iter = combo.get_active_iter()
         if tree_iter is not None:
             model = combo.get_model()
             domain, row_id = model[tree_iter][:2]
-            treemodel = self.window.treeview.get_model()
-            # delete data of an earlier run
-            if (len(self.window.domain_items) > 0):
-                del self.window.domain_items[:]
-                # make place for new table rows
-                treemodel.clear()
+            # stop a running query and delete data of an earlier run
+            self.stop_loading()
+            self.clear_rows()
             if (row_id > 0):
                 # remove vbox from main window
                 self.window.remove(self.window.vbox)
@@ -472,66 +716,99 @@ class Application(Gtk.Application):
                 self.window.vbox.remove(self.window.label_box)
                 self.window.vbox.remove(self.window.scrolled_window)
                 ''' self.window.vbox.remove(self.window.text_window) '''
-                # filter out file info of the chosen domain
-                indices = [0, 2, 3, 4]
-                for record in self.records:
-                    if (record[1] == domain):
-                        selected_items = [record[index] for index in indices]
-                        self.window.domain_items.append(selected_items)
-                        # do not append file BLOB
-                        treemodel.append(selected_items[0:3])
-                self.window.context_id = self.window.status_bar.push(self.window.context_id,\
-                    _('Chosen domain: {}').format(domain))
                 self.window.vbox.pack_start(self.window.scrolled_window, False, True, 0)
                 ''' self.vbox.pack_end(self.text_window) '''
                 self.window.vbox.pack_start(self.window.label_box, True, True, 0)
                 self.window.vbox.pack_end(self.window.bottom_box, False, True, 0)
                 self.window.add(self.window.vbox)
                 self.window.show_all()
+                self.loaded_domain = domain
+                self.reload_rows = self.load_domain
+                self.load_domain()
+                if self.window.tree_button.get_active():
+                    self.load_tree()
         else:
             entry = combo.get_child()
             # but ignore any input (Enter is treated by signal 'activate' (see below)
 
+    def rows_by_rowid(self, rowids):
+        # called by the model of the treeview for the rows it shows
+        return self.backup.rows_by_rowid(rowids)
+
+    def clear_rows(self, show_domain=False):
+        # the model is detached, it does not signal its changes to the treeview
+        self.window.treeview.set_model(None)
+        self.window.treemodel.reset(show_domain)
+        self.window.treeview.set_model(self.window.treemodel)
+
+    @instrument.timed('gui.append_rows')
+    def append_rows(self, rowids):
+        instrument.count('gui.rows_appended', len(rowids))
+        treemodel = self.window.treemodel
+        if treemodel.iter_n_children(None):
+            # rows are shown already, the treeview is told about the new ones
+            treemodel.extend(rowids, signal=True)
+        else:
+            # the first batch is added detached, without a signal per row
+            self.window.treeview.set_model(None)
+            treemodel.extend(rowids)
+            self.window.treeview.set_model(treemodel)
+
+    def on_sort_changed(self, column, descending):
+        # a column header was clicked, query the rows again ordered by SQLite,
+        # but only after the treeview has finished handling the click
+        if self.reload_rows is not None:
+            GLib.idle_add(self.reload_rows)
+
+    def load_domain(self):
+        domain = self.loaded_domain
+        column, descending = self.window.treemodel.sort_order()
+        self.stop_loading()
+        self.clear_rows()
+        self.push_status(_('Loading domain {} ...').format(domain))
+        # query the rowids of the chosen domain from the indexed sidecar
+        self.start_loading(lambda: self.backup.rowid_batches(domain, column, descending),\
+            self.on_domain_rows_loaded, self.on_domain_rows_done, 'load_domain')
+        return False
+
+    def on_domain_rows_loaded(self, rowids):
+        self.append_rows(rowids)
+        self.push_status(_('Loading domain {}: {} rows')\
+            .format(self.loaded_domain, len(self.window.treemodel)))
+
+    def on_domain_rows_done(self, cancelled, error):
+        self.loading_finished()
+        treemodel = self.window.treemodel
+        if error is not None:
+            self.push_status(_("Error while reading domain {}").format(self.loaded_domain))
+        elif cancelled:
+            self.push_status(_('Loading domain {} cancelled after {} rows')\
+                .format(self.loaded_domain, len(treemodel)))
+        else:
+            self.push_status(_('Chosen domain: {} ({} rows)').format(self.loaded_domain, len(treemodel)))
+
     def on_row_activated(self, treeview, path, column):
-        model = self.window.treeview.get_model()
+        model = treeview.get_model()
         tree_iter = model.get_iter(path)
-        row = path[0]
         if tree_iter:
             file_id = model.get_value(tree_iter, 0)
             relative_path = model.get_value(tree_iter, 1)
             target = os.path.basename(relative_path)
             # flags 1 = RegularFile, 2 = Directory, 3 = Symlink
             flags = model.get_value(tree_iter, 2)
-            # first have a look at the file BLOB
-            domain_item = self.window.domain_items[row]
-            file_blob = domain_item[3]
-            properties = _plistlib.loads(file_blob)
-            buffer = []
-            buffer.append(f'<span face="mono" underline="double">{target}\n</span>')
-            time_stamps = ("Birth", "LastModified", "LastStatusChange")
-            for key in properties:
-                if key == '$objects':
-                    objects = properties[key]
-                    for bodies in objects:
-                        if type(bodies) is str:
-                            buffer.append(f'<span face="mono">{bodies: <25}</span>')
-                        else:
-                            # object is dict
-                            for body in bodies:
-                                if body in time_stamps:
-                                    val = datetime.fromtimestamp(bodies[body])
-                                else:
-                                    val = str(bodies[body])
-                                buffer.append(f'<span face="mono">{body: <25} {val} </span>')
-                else:
-                    val = properties[key]
-                    buffer.append(f'<span face="mono">{key: <25} {val} </span>')
+            # first have a look at the file BLOB, fetched only now,
+            # decoded once and kept in the cache of the backup
+            with instrument.timer('gui.row_activated'):
+                properties = self.backup.properties(file_id) or []
+                buffer = []
+                buffer.append(f'<span face="mono" underline="double">{GLib.markup_escape_text(target)}\n</span>')
+                for name, val in properties:
+                    val = GLib.markup_escape_text(str(val))
+                    buffer.append(f'<span face="mono">{name: <25} {val} </span>')
             self.show_info_dialog(buffer)
             # only if flags == 1 there is a file to copy
             if flags == 1:
-                # get first two characters of file ID
-                file_hash = file_id[0:2]
-                file_url = os.path.join(self.backup_path, file_hash, file_id)
+                file_url = self.backup.payload_path(file_id)
                 self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                     _("URL for backup'd file: {}").format(file_url))
                 target_path = self.choose_folder_for_saving(\
@@ -542,23 +819,145 @@ class Application(Gtk.Application):
                     return
                 target_url = os.path.join(target_path,target)
                 try:
-                    with open(file_url, 'rb') as fr, open(target_url, 'wb') as fw:
-                        while True:
-                            chunk = fr.read(1024)
-                            if chunk: 
-                                fw.write(chunk)
-                            else:
-                                break
-                except EnvironmentError:
+                    # decrypted if the backup is encrypted
+                    self.backup.extract_file(file_id, target_url)
+                except (EnvironmentError, ValueError):
                     self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                         _('An error occurred while copying, good luck!'))
-                finally:
+                else:
                     self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                         _('Copying to {} complete, no errors').format(target_url))
             else:
                 self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                     _('Saving rejected (wrong file type)'))
 
+    def current_view(self):
+        if self.window.tree_button.get_active():
+            return self.window.tree_view
+        return self.window.treeview
+
+    def on_tree_toggled(self, button):
+        # swap list and directory tree in the scrolled window
+        child = self.window.scrolled_window.get_child()
+        if child is None:
+            # no database opened yet
+            return
+        self.window.scrolled_window.remove(child)
+        view = self.current_view()
+        self.window.scrolled_window.add(view)
+        view.show()
+        if button.get_active() and self.loaded_domain != self.tree_domain:
+            self.load_tree()
+
+    def load_tree(self):
+        # top level of the chosen domain, deeper levels are read on expanding
+        self.window.treestore.clear()
+        self.tree_domain = self.loaded_domain
+        if self.tree_domain is not None:
+            self.append_nodes(None, self.backup.children(self.tree_domain))
+
+    @instrument.timed('gui.append_nodes')
+    def append_nodes(self, parent, children):
+        treestore = self.window.treestore
+        for name, relative_path, file_id, flags, has_children, files, size in children:
+            icon = NODE_ICONS.get(flags)
+            node = treestore.append(parent, [file_id, relative_path, flags, name, icon,\
+                files, format_size(size)])
+            if has_children:
+                # placeholder (flags 0) until the directory is expanded
+                treestore.append(node, [None, None, 0, None, None, 0, None])
+
+    def on_test_expand_row(self, tree_view, tree_iter, path):
+        treestore = self.window.treestore
+        child = treestore.iter_children(tree_iter)
+        if child is not None and treestore.get_value(child, 2) == 0:
+            directory = treestore.get_value(tree_iter, 1)
+            self.append_nodes(tree_iter, self.backup.children(self.tree_domain, directory))
+            treestore.remove(child)
+        # go on expanding
+        return False
+
+    def on_tree_row_activated(self, tree_view, path, column):
+        # directories are opened and closed, files are shown like in the list
+        treestore = self.window.treestore
+        if treestore.get_value(treestore.get_iter(path), 2) != 2:
+            self.on_row_activated(tree_view, path, column)
+        elif tree_view.row_expanded(path):
+            tree_view.collapse_row(path)
+        else:
+            tree_view.expand_row(path, False)
+
+    def extraction_rows(self):
+        # rows of the list, or of the subtree selected in the directory tree
+        if self.window.tree_button.get_active():
+            treestore, tree_iter = self.window.tree_view.get_selection().get_selected()
+            if tree_iter is not None:
+                directory = treestore.get_value(tree_iter, 1)
+                # the selected entry is extracted into the chosen folder
+                parent = os.path.dirname(directory)
+                start = len(parent) + 1 if parent else 0
+                for batch in self.backup.subtree_batches(self.tree_domain, directory):
+                    for file_id, relative_path, flags in batch:
+                        yield (file_id, relative_path[start:], flags)
+                return
+        yield from self.window.treemodel.rows()
+
+    def on_search_changed(self, entry):
+        pattern = entry.get_text()
+        if self.backup is None:
+            return
+        if self.domain_loader is not None:
+            # cancelling a search would interrupt the shared connection while the domains
+            # are read, the search starts in on_domains_done
+            self.push_status(_("Searching starts when the domains are read"))
+            return
+        if not pattern:
+            # the search was cleared, show the chosen domain again
+            if self.reload_rows == self.load_search:
+                self.stop_loading()
+                if self.loaded_domain is not None:
+                    self.reload_rows = self.load_domain
+                    self.load_domain()
+                else:
+                    self.reload_rows = None
+                    self.clear_rows()
+            return
+        mode = self.window.search_mode.get_active_id()
+        if mode == 'regex':
+            try:
+                re.compile(pattern)
+            except re.error as error:
+                self.push_status(_("Invalid regular expression: {}").format(error))
+                return
+        self.search_pattern = pattern
+        self.search_mode = mode
+        self.reload_rows = self.load_search
+        self.load_search()
+
+    def load_search(self):
+        pattern = self.search_pattern
+        mode = self.search_mode
+        column, descending = self.window.treemodel.sort_order()
+        self.stop_loading()
+        # paths of several domains are shown (and extracted) below their domain
+        self.clear_rows(show_domain=True)
+        # query the trigram index in the background, the results replace the domain rows
+        self.start_loading(\
+            lambda: [self.backup.search_rowids(pattern, mode, column=column, descending=descending)],\
+            self.append_rows, self.on_search_done, 'search')
+        return False
+
+    def on_search_mode_changed(self, combo):
+        self.on_search_changed(self.window.search_entry)
+
+    def on_search_done(self, cancelled, error):
+        self.loading_finished()
+        treemodel = self.window.treemodel
+        if error is not None:
+            self.push_status(_("Error while searching for {}").format(self.search_pattern))
+        elif not cancelled:
+            self.push_status(_('{} paths found for {}').format(len(treemodel), self.search_pattern))
+
     def on_entry_activate(self, entry):
         # on 'Enter' look for first row with domain containing the actual entry text
         self.window.context_id = self.window.status_bar.push(self.window.context_id,\
@@ -600,8 +999,8 @@ class Application(Gtk.Application):
         if header[0] is True:
             buffer.append('<span face="mono" underline="double">Manifest.plist\n</span>')
         excludes = ("Applications", "BackupKeyBag", "Lockdown")
-        for key in self.manifest:
-            val = self.manifest[key]
+        for key in self.backup.manifest:
+            val = self.backup.manifest[key]
             if key in excludes:
                 if key == "Lockdown":
                     buffer.append(f'<span face="mono">{key: <25} partially skipped </span>')
@@ -620,8 +1019,8 @@ class Application(Gtk.Application):
         buffer = []
         if header[0] is True:
             buffer.append('<span face="mono" underline="double">Status.plist\n</span>')
-        for key in self.status:
-            val = self.status[key]
+        for key in self.backup.status:
+            val = self.backup.status[key]
             buffer.append(f'<span face="mono">{key: <25} {val} </span>')
         self.show_info_dialog(buffer)
 
@@ -652,63 +1051,96 @@ class Application(Gtk.Application):
                 _("No path for CSV file given, try again"))
             return
         export_url = os.path.join(export_path,'Manifest.csv')
-        with open(export_url, 'w') as file:
-            csv_writer = csv.writer(file, lineterminator='\n')
-            for name in self.names:
-                csv_writer.writerow(name)
-            for record in self.records:
-                csv_writer.writerow(record)
+        with export.open_text(export_url) as file:
+            # stream the rows from the database, BLOB decoded into columns
+            export.write_csv(self.backup.manifest_db, file, decode=True)
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                 _('Manifest.csv stored in folder {}').format(export_path))
 
+    def on_export_parquet(self, widget):
+        # export data records with decoded, typed columns into .parquet file
+        export_path = self.choose_folder_for_saving(_("Please choose a folder for exporting Manifest.parquet"))
+        if (export_path is None):
+            self.window.context_id = self.window.status_bar.push(self.window.context_id,\
+                _("No path for Parquet file given, try again"))
+            return
+        export_url = os.path.join(export_path,'Manifest.parquet')
+        try:
+            export.write_columnar(self.backup.manifest_db, export_url)
+        except ImportError as error:
+            self.window.context_id = self.window.status_bar.push(self.window.context_id, str(error))
+            return
+        self.window.context_id = self.window.status_bar.push(self.window.context_id,\
+            _('Manifest.parquet stored in folder {}').format(export_path))
+
     def on_extract_domain_clicked(self, button):
         model = self.window.treeview.get_model()
         if len(model) == 0:
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                 _('Select domain first (no rows in model)'))
             return
+        if not self.choose_extract_path():
+            return
+        # directories and symlinks are made after copying, with their modes and times
+        self.attributes = []
+        self.jobs = self.backup.extraction_jobs(self.extraction_rows(), self.extract_path,\
+            self.attributes)
+        self.start_extraction(_('Nothing extracted (no regular files in domain)'))
+
+    def on_extract_all_clicked(self, button):
+        if self.backup is None or not self.window.naked_domains:
+            return
+        pattern = self.window.combo.get_child().get_text()
+        if not any(character in pattern for character in '*?['):
+            pattern = '*'
+        domains = self.backup.matching_domains([pattern])
+        if not domains:
+            self.push_status(_('No domain matches {}').format(pattern))
+            return
+        if not self.choose_extract_path():
+            return
+        # one job for all domains, the files of each below a folder of its name
+        self.attributes = []
+        self.jobs = self.backup.domains_extraction_jobs(domains, self.extract_path, self.attributes)
+        self.start_extraction(_('Nothing extracted (no regular files in {} domains)').format(len(domains)))
+
+    def choose_extract_path(self):
         self.extract_path = self.choose_folder_for_saving(_("Please choose a folder for extracting files"))
         if (self.extract_path is None):
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                 _('No path for extracting files given, try again'))
-            return
-        elif len(os.listdir(self.extract_path)) != 0:
+            return False
+        elif len(os.listdir(self.extract_path)) != 0 and not extraction.has_journal(self.extract_path):
+            # a folder with the journal of an earlier extraction is resumed
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
                 _('Output directory is not empty!'))
-            return
+            return False
         # now we have a valid extract path
         self.window.context_id = self.window.status_bar.push(self.window.context_id,\
             _('Path to extract files: {}').format(self.extract_path))
         while Gtk.events_pending ():
             Gtk.main_iteration ()
-        self.files = list()
-        names = ['fileID', 'relativePath', 'flags']
-        self.total = 0
-        for row in model:
-            columns = dict()
-            for index, column in enumerate(row):
-                columns[names[index]] = column
-            if columns['flags'] != 1:
-                continue
-            else:
-                # we have a regular file, add file_URL and file_size
-                file_id = columns['fileID']
-                # get first two characters of file ID
-                file_hash = file_id[0:2]
-                file_url = os.path.join(self.backup_path, file_hash, file_id)
-                columns['fileURL'] = file_url
-                file_size = os.path.getsize(file_url)
-                self.total += file_size
-                columns['fileSize'] = file_size
-                self.files.append(columns)
-        if self.total > 0:
+        return True
+
+    def start_extraction(self, nothing_message):
+        # sizes out of the sidecar, the payloads are checked while copying
+        self.total = extraction.total_size(self.jobs)
+        self.workers = self.window.workers_button.get_value_as_int()
+        self.dedup = self.window.dedup_button.get_active()
+        # files copied unchanged before are skipped
+        self.journal = extraction.Journal(self.extract_path)
+        if self.jobs:
             # generate progressbar dialog
             progressbar_dialog = ProgressbarDialog(self)
         else:
             self.window.context_id = self.window.status_bar.push(self.window.context_id,\
-               _('Nothing extracted (no regular files in domain)'))
+               nothing_message)
 
     def on_quit(self, action, parameter):
+        self.stop_loading()
+        self.stop_domain_loading()
+        if self.backup is not None:
+            self.backup.close()
         self.window.destroy()
 
     def on_about(self, action, parameter):
@@ -738,6 +1170,19 @@ de = gettext.translation('ManifestDBView', localedir='locale', languages=['de'])
 de.install()
 # define _ shortcut for translations
 _ = de.gettext # German
+# --profile and --profile-dump FILE (or =FILE) are handled here, Gtk.Application does not know them
+arguments = [sys.argv[0]]
+remaining = iter(sys.argv[1:])
+for argument in remaining:
+    if argument == '--profile':
+        instrument.enable()
+    elif argument == '--profile-dump':
+        instrument.enable(next(remaining, None))
+    elif argument.startswith('--profile-dump='):
+        instrument.enable(argument.partition('=')[2] or None)
+    else:
+        arguments.append(argument)
+sys.argv = arguments
 app = Application()
 exit = app.run(sys.argv)
 sys.exit(exit)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# an iOS backup as seen by the GUI and the command line
+#
+#  File: manifestdb/backup.py
+#
+#  A backup directory holds the SQLite database Manifest.db, the property
+#  lists Manifest.plist and Status.plist and the backup'd files named by
+#  their fileID in subdirectories. The class Backup ties these together
+#  without any reference to GTK, so it can be used in other scripts too:
+#
+#    with Backup('~/Downloads/00008030-...') as backup:
+#        for domain, files, size in backup.domains():
+#            ...
+#
+#  An encrypted backup needs its password, without one (or with a wrong
+#  one) Backup raises encryption.PasswordError. Its Manifest.db is decrypted
+#  into a private temporary directory, which holds the sidecar too and is
+#  removed by close, nothing decrypted is left in the cache directory.
+#  Backups older than iOS 10.2 have no ManifestKey, their Manifest.db is
+#  not encrypted and is read as is, only the payload files need the keys.
+
+import fnmatch, functools, os, shutil, tempfile
+import plistlib as _plistlib
+
+# local modules
+from manifestdb import database
+from manifestdb import encryption
+from manifestdb import extraction
+from manifestdb import filemeta
+from manifestdb import instrument
+from manifestdb import sidecar
+
+# number of decoded file BLOBs kept in memory
+METADATA_CACHE_SIZE = 4096
+# ways to match relativePath in a search
+SEARCH_MODES = sidecar.SEARCH_MODES
+SEARCH_LIMIT = sidecar.SEARCH_LIMIT
+
+def read_plist(file):
+    # keys of the property list in ascending order, None if not readable
+    try:
+        with open(file, 'rb') as f:
+            s = _plistlib.load(f)
+        keys = sorted(s.keys())
+        vals = [s[k] for k in keys]
+        return dict(zip(keys, vals))
+    except (EnvironmentError, _plistlib.InvalidFileException):
+        return None
+
+class Backup:
+    @instrument.timed('backup.open')
+    def __init__(self, path, cache_dir=None, password=None):
+        # path is the backup directory or the Manifest.db inside of it
+        path = os.path.abspath(os.path.expanduser(path))
+        if os.path.isdir(path):
+            self.path = path
+            self.db_url = os.path.join(path, 'Manifest.db')
+        else:
+            self.path = os.path.dirname(path)
+            self.db_url = path
+        if not os.path.isfile(self.db_url):
+            raise FileNotFoundError(self.db_url)
+        self.manifest = read_plist(os.path.join(self.path, 'Manifest.plist'))
+        self.status = read_plist(os.path.join(self.path, 'Status.plist'))
+        # unlocked class keys of an encrypted backup, None for a plain one
+        self.keybag = None
+        self._decrypted_dir = None
+        db_url = self.db_url
+        if encryption.is_encrypted(self.manifest):
+            db_url = self._decrypt_manifest_db(password)
+            if self._decrypted_dir is not None:
+                cache_dir = self._decrypted_dir
+        self.manifest_db = None
+        try:
+            # read-only access to the backup, BLOBs are fetched on demand
+            self.manifest_db = database.ManifestDB(db_url)
+            # indexed copy of the small columns in the user cache directory
+            self.sidecar = sidecar.Sidecar(db_url, cache_dir)
+        except BaseException:
+            # close is never called, nothing decrypted must be left behind
+            if self.manifest_db is not None:
+                self.manifest_db.close()
+            self._remove_decrypted()
+            raise
+        self._indexed = False
+        # decoded BLOBs by fileID, activating a row twice parses only once
+        self.file_metadata = functools.lru_cache(maxsize=METADATA_CACHE_SIZE)(self._file_metadata)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.manifest_db.close()
+        self.sidecar.close()
+        self._remove_decrypted()
+
+    def _remove_decrypted(self):
+        if self._decrypted_dir is not None:
+            shutil.rmtree(self._decrypted_dir, ignore_errors=True)
+            self._decrypted_dir = None
+
+    @instrument.timed('backup.decrypt_manifest_db')
+    def _decrypt_manifest_db(self, password):
+        # unlock the keybag and decrypt Manifest.db into a new temporary directory,
+        # returns the path of the Manifest.db to read
+        if password is None:
+            raise encryption.PasswordError('the backup is encrypted, a password is needed')
+        keybag = encryption.Keybag(self.manifest['BackupKeyBag'])
+        keybag.unlock(password)
+        if 'ManifestKey' not in self.manifest:
+            # before iOS 10.2, Manifest.db itself is not encrypted
+            self.keybag = keybag
+            return self.db_url
+        key = keybag.unwrap(self.manifest['ManifestKey'])
+        directory = tempfile.mkdtemp(prefix='manifestdb-')
+        db_url = os.path.join(directory, 'Manifest.db')
+        try:
+            encryption.decrypt_file(self.db_url, db_url, key)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        self.keybag = keybag
+        self._decrypted_dir = directory
+        return db_url
+
+    def open_index(self):
+        # make sure the sidecar is current, returns True if it was (re)built;
+        # sizes, attributes and the full-text index wait for complete_index
+        rebuilt = self.sidecar.open()
+        self._indexed = True
+        return rebuilt
+
+    def complete_index(self):
+        # second pass over the sidecar, may run in a thread of its own,
+        # returns True if it did the work
+        return self._index().complete()
+
+    def _index(self):
+        if not self._indexed:
+            self.open_index()
+        return self.sidecar
+
+    def column_names(self):
+        return self.manifest_db.column_names()
+
+    def domains(self):
+        # list of (domain, number of regular files, total size) ordered by domain,
+        # the sizes are None until complete_index
+        return self._index().domains()
+
+    def matching_domains(self, patterns):
+        # domains matching any of a list of glob patterns, ordered by domain
+        return [domain for domain, files, size in self.domains()
+            if any(fnmatch.fnmatchcase(domain, pattern) for pattern in patterns)]
+
+    def file_batches(self, domain):
+        # lists of (fileID, relativePath, flags) of a domain ordered by relativePath
+        return self._index().domain_batches(domain)
+
+    def payload_batches(self):
+        # lists of (fileID, domain, relativePath, size out of the BLOB) of all regular files
+        self.complete_index()
+        return self._index().payload_batches()
+
+    def children(self, domain, directory=''):
+        # entries of a directory with number of regular files and size of their subtrees,
+        # the sizes are None until complete_index
+        return self._index().children(domain, directory)
+
+    def subtree_batches(self, domain, directory=''):
+        # lists of (fileID, relativePath, flags) of directory and everything below
+        return self._index().subtree_batches(domain, directory)
+
+    def rowid_batches(self, domain, column='relativePath', descending=False):
+        # lists of rowids of the sidecar for the files of a domain, ordered by SQLite
+        return self._index().rowid_batches(domain, column, descending)
+
+    def rows_by_rowid(self, rowids):
+        # dict rowid -> (fileID, domain, relativePath, flags)
+        return self._index().rows_by_rowid(rowids)
+
+    def search(self, pattern, mode='substring', limit=SEARCH_LIMIT):
+        # (domain, relativePath, fileID, flags) of all domains matching pattern
+        return self._index().search(pattern, mode, limit)
+
+    def search_rowids(self, pattern, mode='substring', limit=SEARCH_LIMIT,
+            column='relativePath', descending=False):
+        return self._index().search_rowids(pattern, mode, limit, column, descending)
+
+    def files(self, domain):
+        for batch in self.file_batches(domain):
+            yield from batch
+
+    def blob(self, file_id):
+        return self.manifest_db.blob(file_id)
+
+    @instrument.timed('backup.file_metadata')
+    def _file_metadata(self, file_id):
+        return filemeta.decode(self.blob(file_id))
+
+    def properties(self, file_id):
+        # decoded file BLOB as list of (name, value) pairs, None for unknown IDs
+        metadata = self.file_metadata(file_id)
+        if metadata is None:
+            return None
+        return metadata.items()
+
+    def metadata_batches(self, domain):
+        # lists of (fileID, FileMetadata) of all files of a domain
+        for batch in self.manifest_db.blob_batches(domain):
+            decoded = filemeta.decode_batch(blob for file_id, blob in batch)
+            yield [(file_id, metadata) for (file_id, blob), metadata in zip(batch, decoded)]
+
+    def metadata(self, domain):
+        for batch in self.metadata_batches(domain):
+            yield from batch
+
+    def metadata_for(self, file_ids):
+        # dict fileID -> FileMetadata for a list of fileIDs, one query per chunk,
+        # out of the sidecar if it is complete (but without EncryptionKey then),
+        # encrypted backups need the keys and decode the BLOBs
+        if self._indexed and self.keybag is None and self.sidecar.is_complete():
+            return self.sidecar.metadata_for(file_ids)
+        result = {}
+        for file_id, blob in self.manifest_db.blobs(list(file_ids)):
+            result[file_id] = filemeta.decode(blob)
+        return result
+
+    def payload_path(self, file_id):
+        return extraction.payload_path(self.path, file_id)
+
+    def extract_file(self, file_id, target):
+        # copy the payload of a single file, decrypted if need be, returns the bytes written
+        source = self.payload_path(file_id)
+        if self.keybag is None:
+            return extraction.copy_file(source, target)
+        metadata = self.file_metadata(file_id)
+        if metadata is None or metadata.encryption_key is None:
+            raise ValueError('no EncryptionKey in Manifest.db for {}'.format(file_id))
+        return encryption.decrypt_file(source, target, self.keybag.unwrap(metadata.encryption_key),
+            metadata.size)
+
+    @instrument.timed('backup.extraction_jobs')
+    def extraction_jobs(self, rows, extract_path, attributes=None):
+        # jobs copying the regular files out of rows of (fileID, relativePath, flags),
+        # sizes are those of the file BLOBs, no payload is touched before copying;
+        # with a list attributes the jobs carry mode and time of their files and
+        # those of the directories and symlinks are appended for extraction.apply_attributes
+        rows = [tuple(row) for row in rows]
+        self._index()
+        metadata = self.metadata_for([row[0] for row in rows])
+        return extraction.plan(self.path, rows, extract_path, metadata, attributes)
+
+    def domains_extraction_jobs(self, domains, extract_path, attributes=None, per_domain=True):
+        # jobs of all regular files of several domains planned up front for one pool,
+        # each domain below a directory of its name unless per_domain is False
+        jobs = []
+        for domain in domains:
+            target = os.path.join(extract_path, domain) if per_domain else extract_path
+            for batch in self.file_batches(domain):
+                jobs.extend(self.extraction_jobs(batch, target, attributes))
+        extraction.sort_jobs(jobs)
+        return jobs
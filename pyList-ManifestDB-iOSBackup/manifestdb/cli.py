@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# List ManifestDB from the command line
+#
+#  File: manifestdb/cli.py
+#
+#  Headless counterpart of manifestDBview.py for scripts and servers without
+#  a display, it is a client of the module backup and never imports GTK.
+#
+#  Usage: manifestdb [--profile] [--profile-dump FILE] BACKUP COMMAND [ARGUMENTS]
+#    BACKUP is the backup directory or its Manifest.db
+#    --password-file FILE       password of an encrypted backup in the first line
+#                               of FILE ('-' standard input), otherwise it is taken
+#                               from MANIFESTDB_PASSWORD or asked for on the terminal
+#    --profile                  report where the time went on exit, see instrument.py
+#    --profile-dump FILE        same with a cProfile dump for pstats
+#    domains                    domains with number of files and total size
+#    ls DOMAIN                  fileID, flags and relativePath of a domain
+#    extract DOMAIN|GLOB... DEST
+#                               extract the regular files of matching domains,
+#                               into a directory each unless a single domain is
+#                               named, again into the same DEST only changed files
+#    search PATTERN             paths of all domains matching a substring,
+#                               prefix, glob or regular expression
+#    diff NEWER                 added, removed and modified files of the backup
+#                               NEWER (same password) against BACKUP by domain,
+#                               optionally extracting only the changed ones
+#    verify                     check that every regular file has its payload
+#                               with the right size and no payload is orphaned,
+#                               optionally hash all payloads for sha256sum
+#    info FILEID                decoded content of the file BLOB
+#    export-csv [FILE]          table Files as CSV (default standard output),
+#                               optionally decoded and compressed
+#    export-columnar FILE       table Files with decoded, typed columns as
+#                               Parquet or Arrow IPC (needs pyarrow)
+
+import argparse, collections, getpass, os, re, sqlite3, sys
+
+# local modules
+from manifestdb import backup
+from manifestdb import diff
+from manifestdb import encryption
+from manifestdb import export
+from manifestdb import extraction
+from manifestdb import instrument
+from manifestdb import verify
+from manifestdb.backup import Backup
+
+# seconds between two progress lines while extracting
+PROGRESS_INTERVAL = 0.5
+# environment variable with the password of an encrypted backup
+PASSWORD_VARIABLE = 'MANIFESTDB_PASSWORD'
+
+def command_domains(backup, args):
+    # the sizes need the second pass over the sidecar
+    backup.complete_index()
+    for domain, files, size in backup.domains():
+        print(f'{domain}\t{files}\t{size}')
+    return 0
+
+def command_ls(backup, args):
+    for batch in backup.file_batches(args.domain):
+        for file_id, relative_path, flags in batch:
+            print(f'{file_id}\t{flags}\t{relative_path}')
+    return 0
+
+def command_info(backup, args):
+    properties = backup.properties(args.file_id)
+    if properties is None:
+        print(f'no such fileID or BLOB not decodable: {args.file_id}', file=sys.stderr)
+        return 1
+    for name, val in properties:
+        if val is None:
+            print(name)
+        else:
+            print(f'{name: <25} {val}')
+    print('{: <25} {}'.format('payload', backup.payload_path(args.file_id)))
+    return 0
+
+def command_export_csv(backup, args):
+    compression = args.compress
+    if args.file is None or args.file == '-':
+        if compression is not None:
+            print('compressed output needs a file name', file=sys.stderr)
+            return 1
+        rows = export.write_csv(backup.manifest_db, sys.stdout, args.decode)
+    else:
+        if compression is None:
+            compression = export.compression_for(args.file)
+        try:
+            with export.open_text(args.file, compression) as file:
+                rows = export.write_csv(backup.manifest_db, file, args.decode)
+        except ImportError as error:
+            print(error, file=sys.stderr)
+            return 1
+    print(f'{rows} rows exported', file=sys.stderr)
+    return 0
+
+def command_export_columnar(backup, args):
+    file_format = args.format or export.columnar_format_for(args.file) or 'parquet'
+    try:
+        rows = export.write_columnar(backup.manifest_db, args.file, file_format)
+    except ImportError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print(f'{rows} rows exported', file=sys.stderr)
+    return 0
+
+def command_search(backup, args):
+    try:
+        results = backup.search(args.pattern, args.mode, args.limit)
+    except re.error as error:
+        print(f'invalid regular expression: {error}', file=sys.stderr)
+        return 1
+    for domain, relative_path, file_id, flags in results:
+        print(f'{file_id}\t{flags}\t{domain}\t{relative_path}')
+    return 0 if results else 1
+
+def run_extraction(jobs, workers, quiet, journal=None, attributes=None, dedup=False, keybag=None):
+    # copy the jobs, report progress on standard error, returns the Progress
+    progress = extraction.Progress(len(jobs), extraction.total_size(jobs))
+    worker = extraction.Extraction(jobs, workers, journal, attributes, dedup, keybag)
+    worker.start()
+    show = not quiet and sys.stderr.isatty()
+    try:
+        while worker.is_alive():
+            worker.join(PROGRESS_INTERVAL)
+            progress.drain(worker.events)
+            if show:
+                print('\r{}/{} files, {:.0%}, {}'.format(progress.files, progress.total_files,
+                    progress.fraction(), progress.summary()), end='', file=sys.stderr)
+    except KeyboardInterrupt:
+        worker.cancel()
+        worker.join()
+    progress.drain(worker.events)
+    progress.finish()
+    progress.errors.extend(worker.errors)
+    if show:
+        print(file=sys.stderr)
+    return progress
+
+def is_pattern(name):
+    # the characters fnmatch treats specially
+    return any(character in name for character in '*?[')
+
+def command_extract(backup, args):
+    domains = backup.matching_domains(args.domains)
+    if not domains:
+        print('no domain matches {}'.format(' '.join(args.domains)), file=sys.stderr)
+        return 1
+    os.makedirs(args.dest, exist_ok=True)
+    # a directory with a journal is resumed or synced
+    if os.listdir(args.dest) and not extraction.has_journal(args.dest):
+        print(f'output directory is not empty and holds no journal: {args.dest}', file=sys.stderr)
+        return 1
+    # directories and symlinks made after copying, with their modes and times
+    attributes = []
+    # a single domain named literally is extracted flat, any pattern or several names
+    # get a directory each however many domains match, so a sync keeps the layout
+    per_domain = len(args.domains) > 1 or is_pattern(args.domains[0])
+    jobs = backup.domains_extraction_jobs(domains, args.dest, attributes, per_domain)
+    progress = run_extraction(jobs, args.workers, args.quiet, extraction.Journal(args.dest),
+        attributes, args.dedup, backup.keybag)
+    for error in progress.errors:
+        print(error, file=sys.stderr)
+    print('{} files extracted to: {}, {}'.format(progress.files, args.dest, progress.summary()),
+        file=sys.stderr)
+    return 1 if progress.errors or progress.files < len(jobs) else 0
+
+def _time(timestamp):
+    return '' if timestamp is None else int(timestamp)
+
+def command_diff(backup, args):
+    try:
+        newer = open_backup(args.newer, args)
+    except FileNotFoundError as error:
+        print(f'no Manifest.db found: {error}', file=sys.stderr)
+        return 1
+    except (ImportError, ValueError) as error:
+        print(f'the encrypted backup can not be opened: {error}', file=sys.stderr)
+        return 1
+    with newer:
+        if args.extract is not None:
+            os.makedirs(args.extract, exist_ok=True)
+            if os.listdir(args.extract) and not extraction.has_journal(args.extract):
+                print(f'output directory is not empty and holds no journal: {args.extract}',
+                    file=sys.stderr)
+                return 1
+        # domain -> Counter of the changes
+        counts = {}
+        # domain -> (fileID, relativePath, flags) of the added and modified rows
+        changed = {}
+        for batch in diff.change_batches(backup, newer, args.domains):
+            for change, domain, relative_path, file_id, flags, old_size, new_size, \
+                    old_modified, new_modified in batch:
+                counts.setdefault(domain, collections.Counter())[change] += 1
+                if args.extract is not None and change != diff.REMOVED:
+                    changed.setdefault(domain, []).append((file_id, relative_path, flags))
+                if not args.summary:
+                    print('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(change, file_id, flags,
+                        '' if old_size is None else old_size, '' if new_size is None else new_size,
+                        _time(old_modified), _time(new_modified), domain, relative_path))
+        total = collections.Counter()
+        for domain, counter in counts.items():
+            total.update(counter)
+            print('{}\t{}\t{}\t{}'.format(domain, counter[diff.ADDED], counter[diff.REMOVED],
+                counter[diff.MODIFIED]), file=sys.stdout if args.summary else sys.stderr)
+        print('{} domains changed, {} files added, {} removed, {} modified'.format(len(counts),
+            total[diff.ADDED], total[diff.REMOVED], total[diff.MODIFIED]), file=sys.stderr)
+        if args.extract is None:
+            return 0
+        # every domain into a directory of its name, as extract does with patterns
+        attributes = []
+        jobs = []
+        for domain, rows in changed.items():
+            jobs.extend(newer.extraction_jobs(rows, os.path.join(args.extract, domain), attributes))
+        extraction.sort_jobs(jobs)
+        progress = run_extraction(jobs, args.workers, args.quiet, extraction.Journal(args.extract),
+            attributes, False, newer.keybag)
+        for error in progress.errors:
+            print(error, file=sys.stderr)
+        print('{} files extracted to: {}, {}'.format(progress.files, args.extract,
+            progress.summary()), file=sys.stderr)
+        return 1 if progress.errors or progress.files < len(jobs) else 0
+
+def command_verify(backup, args):
+    result = verify.verify(backup, args.workers)
+    for file_id, domain, relative_path, size in result.missing:
+        print(f'missing\t{file_id}\t{size}\t\t{domain}\t{relative_path}')
+    for file_id, domain, relative_path, size, actual in result.wrong_size:
+        problem = 'truncated' if actual < size else 'size'
+        print(f'{problem}\t{file_id}\t{size}\t{actual}\t{domain}\t{relative_path}')
+    for name in result.orphans:
+        print(f'orphan\t{name}')
+    unreadable = 0
+    if args.hash is not None:
+        show = not args.quiet and sys.stderr.isatty()
+        hashed = 0
+        read = 0
+        with open(args.hash, 'w', encoding='utf-8') as f:
+            for name, digest, error, size in verify.hash_payloads(backup.path, result.payloads,
+                    args.processes):
+                hashed += 1
+                read += size
+                if error is not None:
+                    unreadable += 1
+                    print(f'unreadable\t{name}\t{error}')
+                else:
+                    # format of sha256sum, relative to the backup directory
+                    f.write(f'{digest}  {name}\n')
+                if show and hashed % 1000 == 0:
+                    print('\r{}/{} payloads hashed, {:.1f} GB'.format(hashed,
+                        len(result.payloads), read / 1e9), end='', file=sys.stderr)
+        if show:
+            print(file=sys.stderr)
+    summary = result.summary()
+    if args.hash is not None:
+        summary += f', {unreadable} unreadable, hashes written to {args.hash}'
+    print(summary, file=sys.stderr)
+    return 1 if result.problems() or unreadable else 0
+
+def parser():
+    parser = argparse.ArgumentParser(prog='manifestdb',
+        description='List, query and extract an iOS backup without GTK.')
+    parser.add_argument('backup', help='backup directory or its Manifest.db')
+    parser.add_argument('--profile', action='store_true',
+        help='report timers and counters on exit (or set {}=1)'.format(
+        instrument.ENVIRONMENT_VARIABLE))
+    parser.add_argument('--profile-dump', metavar='FILE',
+        help='as --profile, additionally write a cProfile dump into FILE')
+    parser.add_argument('--password-file', metavar='FILE',
+        help='password of an encrypted backup in the first line of FILE (- standard input)')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND', required=True)
+    command = commands.add_parser('domains', help='list domains with number of files and size')
+    command.set_defaults(function=command_domains)
+    command = commands.add_parser('ls', help='list the files of a domain')
+    command.add_argument('domain')
+    command.set_defaults(function=command_ls)
+    command = commands.add_parser('extract', help='extract the files of matching domains')
+    command.add_argument('domains', nargs='+', metavar='domain',
+        help='domain name or glob pattern, e.g. \'*\' for the whole backup')
+    command.add_argument('dest',
+        help='empty target directory or one with the journal of an earlier extraction')
+    command.add_argument('-j', '--workers', type=int, default=extraction.DEFAULT_WORKERS,
+        help='number of copy threads (default %(default)s)')
+    command.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    command.add_argument('-D', '--dedup', action='store_true',
+        help='write identical files once, duplicates become reflinks or hardlinks '
+        '(which keep mode and time of the first file)')
+    command.set_defaults(function=command_extract)
+    command = commands.add_parser('search', help='search paths in all domains')
+    command.add_argument('pattern')
+    command.add_argument('-m', '--mode', choices=backup.SEARCH_MODES, default='substring',
+        help='substring (case-insensitive), prefix, glob or regex (default %(default)s)')
+    command.add_argument('-n', '--limit', type=int, default=backup.SEARCH_LIMIT,
+        help='maximal number of results (default %(default)s)')
+    command.set_defaults(function=command_search)
+    command = commands.add_parser('diff',
+        help='list the files added, removed or modified in a newer backup')
+    command.add_argument('newer', help='newer backup directory or its Manifest.db')
+    command.add_argument('-d', '--domain', dest='domains', action='append', metavar='DOMAIN',
+        help='compare only domains matching a name or glob pattern, may be repeated')
+    command.add_argument('-s', '--summary', action='store_true',
+        help='print only the number of added, removed and modified files per domain')
+    command.add_argument('-x', '--extract', metavar='DEST',
+        help='extract the added and modified files of the newer backup into DEST')
+    command.add_argument('-j', '--workers', type=int, default=extraction.DEFAULT_WORKERS,
+        help='number of copy threads (default %(default)s)')
+    command.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    command.set_defaults(function=command_diff)
+    command = commands.add_parser('verify',
+        help='check the payloads against Manifest.db before archiving a backup')
+    command.add_argument('-j', '--workers', type=int, default=extraction.DEFAULT_WORKERS,
+        help='number of threads listing the payload directories (default %(default)s)')
+    command.add_argument('-H', '--hash', metavar='FILE',
+        help='read every payload and write its SHA-256 into FILE (format of sha256sum)')
+    command.add_argument('-P', '--processes', type=int, default=verify.DEFAULT_PROCESSES,
+        help='number of hashing processes (default %(default)s)')
+    command.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    command.set_defaults(function=command_verify)
+    command = commands.add_parser('info', help='show the decoded file BLOB')
+    command.add_argument('file_id', metavar='fileID')
+    command.set_defaults(function=command_info)
+    command = commands.add_parser('export-csv', help='export table Files as CSV')
+    command.add_argument('file', nargs='?',
+        help='output file, .gz or .zst are compressed (default standard output)')
+    command.add_argument('-d', '--decode', action='store_true',
+        help='decode the file BLOB into columns ({})'.format(', '.join(export.DECODED_COLUMNS)))
+    command.add_argument('-z', '--compress', choices=sorted(export.COMPRESSIONS),
+        help='compress the output regardless of the file name')
+    command.set_defaults(function=command_export_csv)
+    command = commands.add_parser('export-columnar',
+        help='export table Files with decoded, typed columns as Parquet or Arrow')
+    command.add_argument('file', help='output file, .parquet or .arrow')
+    command.add_argument('-f', '--format', choices=sorted(export.COLUMNAR_FORMATS),
+        help='file format regardless of the file name (default parquet)')
+    command.set_defaults(function=command_export_columnar)
+    return parser
+
+def read_password(args):
+    # password of an encrypted backup, None if there is no way to get one
+    if args.password_file == '-':
+        return sys.stdin.readline().rstrip('\n')
+    if args.password_file is not None:
+        try:
+            with open(args.password_file, encoding='utf-8') as f:
+                return f.readline().rstrip('\n')
+        except EnvironmentError as error:
+            raise encryption.PasswordError(f'password file not readable: {error}')
+    if PASSWORD_VARIABLE in os.environ:
+        return os.environ[PASSWORD_VARIABLE]
+    if sys.stdin.isatty():
+        return getpass.getpass('Password of the encrypted backup: ')
+    return None
+
+def open_backup(path, args):
+    # the password is asked for only if the backup is encrypted, once for both of diff
+    try:
+        return Backup(path)
+    except encryption.PasswordError:
+        password = getattr(args, 'password', None)
+        if password is None:
+            password = read_password(args)
+        if password is None:
+            raise
+        backup = Backup(path, password=password)
+        args.password = password
+        return backup
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.profile or args.profile_dump:
+        instrument.enable(args.profile_dump)
+    try:
+        backup = open_backup(args.backup, args)
+    except FileNotFoundError as error:
+        print(f'no Manifest.db found: {error}', file=sys.stderr)
+        return 1
+    except (ImportError, ValueError) as error:
+        # no or a wrong password (PasswordError), no package cryptography
+        # or a Manifest.db not decryptable
+        print(f'the encrypted backup can not be opened: {error}', file=sys.stderr)
+        return 1
+    try:
+        with instrument.timer('cli.' + args.command):
+            return args.function(backup, args)
+    except sqlite3.Error as error:
+        print(f'error while reading the database: {error}', file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # output was piped into a command like head
+        sys.stderr.close()
+        return 0
+    finally:
+        backup.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
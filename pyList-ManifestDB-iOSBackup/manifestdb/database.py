@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# lazy access to the SQLite database Manifest.db of an iOS backup
+#
+#  File: manifestdb/database.py
+#
+#  The table Files holds one row per backup'd item
+#    fileID TEXT PRIMARY KEY, domain TEXT, relativePath TEXT, flags INTEGER, file BLOB
+#  Large backups contain several hundred thousand rows, so the rows are
+#  streamed in batches and only the four small columns are read up front.
+#  The 'file' BLOB (a binary plist) is fetched by fileID when really needed.
+
+import os, sqlite3
+from urllib.request import pathname2url
+
+# local modules
+from manifestdb import instrument
+
+# number of rows fetched from a cursor at once
+BATCH_SIZE = 4096
+
+class ManifestDB:
+    def __init__(self, db_url):
+        self.db_url = os.path.abspath(db_url)
+        # open the database read-only, the backup itself must never be touched
+        uri = 'file:{}?mode=ro'.format(pathname2url(self.db_url))
+        # connection may be used by a loader thread, access is serialized by the caller
+        self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def column_names(self):
+        # names of all columns of table Files (including the BLOB)
+        cursor = self.connection.execute("SELECT * FROM Files LIMIT 0")
+        names = [description[0] for description in cursor.description]
+        cursor.close()
+        return names
+
+    def _batches(self, query, parameters=(), batch_size=BATCH_SIZE):
+        cursor = self.connection.execute(query, parameters)
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            cursor.close()
+
+    def full_batches(self, batch_size=BATCH_SIZE):
+        # yields lists of complete rows including the BLOB, e.g. for exporting
+        yield from self._batches("SELECT * FROM Files", batch_size=batch_size)
+
+    def blob_batches(self, domain, batch_size=BATCH_SIZE):
+        # yields lists of (fileID, file BLOB) of a single domain
+        yield from self._batches("SELECT fileID, file FROM Files WHERE domain = ?",
+            (domain,), batch_size)
+
+    def blobs(self, file_ids, batch_size=500):
+        # yields (fileID, file BLOB) for a list of fileIDs, queried in chunks
+        for start in range(0, len(file_ids), batch_size):
+            chunk = file_ids[start:start + batch_size]
+            query = "SELECT fileID, file FROM Files WHERE fileID IN ({})".format(
+                ', '.join('?' * len(chunk)))
+            for batch in self._batches(query, chunk):
+                yield from batch
+
+    @instrument.timed('manifestdb.blob')
+    def blob(self, file_id):
+        # fetch the 'file' BLOB of a single row
+        cursor = self.connection.execute(
+            "SELECT file FROM Files WHERE fileID = ?", (file_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None:
+            return None
+        return row[0]
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# changes between two backups of the same device
+#
+#  File: manifestdb/diff.py
+#
+#  The sidecars of both backups hold the rows of table Files and the
+#  attributes decoded out of the file BLOBs, so they are attached to one
+#  SQLite connection and compared in SQL, no BLOB is decoded again and
+#  only the changed rows come back to Python. The fileID is the SHA-1 of
+#  domain and relativePath, so rows are joined by their primary key:
+#    added     only in the newer backup
+#    removed   only in the older backup
+#    modified  in both, but the type (flags) changed, or a regular file has
+#              another size or LastModified, or a symlink another Target;
+#              directories change their times with every entry and are
+#              compared by type only
+#
+#    for batch in diff.change_batches(old_backup, new_backup):
+#        for change, domain, relative_path, file_id, flags, *sizes_and_times in batch:
+#            ...
+
+import sqlite3
+from urllib.request import pathname2url
+
+# local modules
+from manifestdb import instrument
+
+ADDED, REMOVED, MODIFIED = 'added', 'removed', 'modified'
+# number of changes fetched from the cursor at once
+BATCH_SIZE = 4096
+# a row of both backups is modified if this is true, a is the older one
+MODIFIED_TEST = ("b.flags IS NOT a.flags"
+    " OR a.flags = 1 AND (b.size IS NOT a.size OR bm.last_modified IS NOT am.last_modified)"
+    " OR a.flags = 3 AND bm.target IS NOT am.target")
+# (change, domain, relativePath, fileID, flags, size in older, size in newer,
+# LastModified in older, LastModified in newer), ordered by domain and path
+CHANGES_QUERY = ("SELECT * FROM ("
+    "SELECT CASE WHEN b.fileID IS NULL THEN '" + REMOVED + "' ELSE '" + MODIFIED + "' END,"
+    " a.domain AS domain, a.relativePath AS relativePath, a.fileID, COALESCE(b.flags, a.flags),"
+    " a.size, b.size, am.last_modified, bm.last_modified"
+    " FROM main.Files AS a LEFT JOIN other.Files AS b ON b.fileID = a.fileID"
+    " LEFT JOIN main.Metadata AS am ON am.fileID = a.fileID"
+    " LEFT JOIN other.Metadata AS bm ON bm.fileID = a.fileID"
+    " WHERE (b.fileID IS NULL OR " + MODIFIED_TEST + "){a}"
+    " UNION ALL "
+    "SELECT '" + ADDED + "', b.domain, b.relativePath, b.fileID, b.flags,"
+    " NULL, b.size, NULL, bm.last_modified"
+    " FROM other.Files AS b LEFT JOIN other.Metadata AS bm ON bm.fileID = b.fileID"
+    " WHERE NOT EXISTS (SELECT 1 FROM main.Files AS a WHERE a.fileID = b.fileID){b}"
+    ") ORDER BY domain, relativePath")
+
+def _read_only(path):
+    return 'file:{}?mode=ro'.format(pathname2url(path))
+
+def _domain_test(table, patterns):
+    if not patterns:
+        return ''
+    return ' AND ({})'.format(' OR '.join('{}.domain GLOB ?'.format(table) for _ in patterns))
+
+def change_batches(old, new, patterns=None, batch_size=BATCH_SIZE):
+    # yields lists of changes from the Backup old to the Backup new, with a list of
+    # glob patterns only of the domains matching one of them
+    old.complete_index()
+    new.complete_index()
+    patterns = list(patterns or [])
+    connection = sqlite3.connect(_read_only(old.sidecar.path), uri=True)
+    try:
+        connection.execute("ATTACH DATABASE ? AS other", (_read_only(new.sidecar.path),))
+        query = CHANGES_QUERY.format(a=_domain_test('a', patterns), b=_domain_test('b', patterns))
+        with instrument.timer('diff.query'):
+            cursor = connection.execute(query, patterns + patterns)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            instrument.count('diff.changes', len(batch))
+            yield batch
+        cursor.close()
+    finally:
+        connection.close()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# encrypted backups
+#
+#  File: manifestdb/encryption.py
+#
+#  A backup made with "Encrypt local backup" has in Manifest.plist the
+#  BackupKeyBag, a list of class keys wrapped (AES key wrap, RFC 3394) with
+#  a key derived from the password, and the ManifestKey, the key of
+#  Manifest.db wrapped with one of the class keys. The file BLOB of every
+#  file holds its EncryptionKey, wrapped the same way. Manifest.db and the
+#  payloads are encrypted with AES-256 in CBC mode, IV 0 and PKCS#7 padding.
+#  Both are decrypted in chunks, so the size of a file does not matter.
+#  The password is stretched by PBKDF2 twice (SHA-256 with DPIC iterations
+#  and the salt DPSL, then SHA-1 with ITER iterations and SALT), which takes
+#  seconds on purpose; its result is kept for the session, so opening the
+#  same backup again (e.g. after a sync) does not pay for it once more.
+#  AES needs the package 'cryptography', PBKDF2 is part of hashlib.
+
+import functools, hashlib, struct
+try:
+    from cryptography.hazmat.primitives import keywrap
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    keywrap = None
+
+# local modules
+from manifestdb import instrument
+
+# bytes decrypted at once, a multiple of the AES block size
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = 16
+# flag of WRAP, the class key is protected by the password
+WRAP_PASSCODE = 2
+# tags belonging to a class key, the first UUID after the header starts one
+CLASS_KEY_TAGS = {b'CLAS', b'WRAP', b'WPKY', b'KTYP', b'PBKY'}
+
+class PasswordError(ValueError):
+    # no or a wrong password for an encrypted backup
+    pass
+
+def _require():
+    if keywrap is None:
+        raise ImportError("encrypted backups need the package 'cryptography'")
+
+def is_encrypted(manifest):
+    # manifest is the content of Manifest.plist, None if not readable
+    return bool(manifest and manifest.get('IsEncrypted'))
+
+@functools.lru_cache(maxsize=8)
+@instrument.timed('encryption.derive_key')
+def derive_key(password, dpsl, dpic, salt, iterations):
+    # key wrapping the class keys, backups older than iOS 10.2 have no DPSL
+    if dpsl is not None and dpic:
+        password = hashlib.pbkdf2_hmac('sha256', password, dpsl, dpic, 32)
+    return hashlib.pbkdf2_hmac('sha1', password, salt, iterations, 32)
+
+def _blocks(data):
+    # yields (tag, value) of the keybag, values of 4 bytes are big-endian integers
+    offset = 0
+    while offset + 8 <= len(data):
+        tag = data[offset:offset + 4]
+        length, = struct.unpack('>I', data[offset + 4:offset + 8])
+        value = data[offset + 8:offset + 8 + length]
+        offset += 8 + length
+        yield tag, struct.unpack('>I', value)[0] if length == 4 else value
+
+class Keybag:
+    # class keys out of the BackupKeyBag of Manifest.plist, usable after unlock
+    def __init__(self, data):
+        # header tags as ITER, SALT, DPIC, DPSL
+        self.attributes = {}
+        # protection class -> tags of its class key
+        self.class_keys = {}
+        self._keys = None
+        class_key = None
+        for tag, value in _blocks(data):
+            if tag == b'UUID' and b'UUID' not in self.attributes:
+                self.attributes[tag] = value
+            elif tag == b'UUID':
+                if class_key is not None:
+                    self.class_keys[class_key[b'CLAS']] = class_key
+                class_key = {tag: value}
+            elif tag in CLASS_KEY_TAGS and class_key is not None:
+                class_key[tag] = value
+            else:
+                self.attributes[tag] = value
+        if class_key is not None:
+            self.class_keys[class_key[b'CLAS']] = class_key
+
+    def unlock(self, password):
+        # unwrap the class keys, a wrong password raises PasswordError
+        _require()
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        key = derive_key(password, self.attributes.get(b'DPSL'), self.attributes.get(b'DPIC'),
+            self.attributes[b'SALT'], self.attributes[b'ITER'])
+        keys = {}
+        for protection_class, class_key in self.class_keys.items():
+            if b'WPKY' not in class_key or not class_key.get(b'WRAP', 0) & WRAP_PASSCODE:
+                continue
+            try:
+                keys[protection_class] = keywrap.aes_key_unwrap(key, class_key[b'WPKY'])
+            except keywrap.InvalidUnwrap:
+                raise PasswordError('wrong password for the encrypted backup')
+        self._keys = keys
+
+    def unwrap(self, wrapped):
+        # key out of a ManifestKey or EncryptionKey, the protection class
+        # (4 bytes, little-endian) followed by the wrapped key
+        if self._keys is None:
+            raise PasswordError('keybag is locked')
+        protection_class, = struct.unpack('<I', wrapped[:4])
+        class_key = self._keys.get(protection_class)
+        if class_key is None:
+            raise ValueError('no class key for protection class {}'.format(protection_class))
+        try:
+            return keywrap.aes_key_unwrap(class_key, wrapped[4:])
+        except keywrap.InvalidUnwrap:
+            raise ValueError('EncryptionKey can not be unwrapped')
+
+def _unpad(block):
+    # remove the PKCS#7 padding of the last block, if it is one
+    padding = block[-1] if block else 0
+    if 1 <= padding <= BLOCK_SIZE and block.endswith(bytes((padding,)) * padding):
+        return block[:-padding]
+    return block
+
+def decrypt_file(source, target, key, size=None):
+    # decrypt source into target chunk by chunk, returns the number of bytes written;
+    # the padding is removed, with size (out of the file BLOB) the plaintext ends there
+    _require()
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(bytes(BLOCK_SIZE))).decryptor()
+    written = 0
+    with open(source, 'rb') as fr, open(target, 'wb') as fw:
+        # the last block holds the padding, it is written when the end is reached
+        pending = b''
+        while True:
+            chunk = fr.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = pending + decryptor.update(chunk)
+            pending = data[-BLOCK_SIZE:]
+            data = data[:-BLOCK_SIZE]
+            if size is not None:
+                data = data[:max(0, size - written)]
+            fw.write(data)
+            written += len(data)
+        # payloads not made of whole blocks raise ValueError here
+        data = _unpad(pending + decryptor.finalize())
+        if size is not None:
+            data = data[:max(0, size - written)]
+        fw.write(data)
+        written += len(data)
+    return written
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# export of the table Files
+#
+#  File: manifestdb/export.py
+#
+#  The rows are streamed out of a cursor batch by batch and written at once,
+#  so the whole table is never held in memory. Instead of the opaque 'file'
+#  BLOB the decoded attributes can be written as columns of their own, the
+#  output may be compressed with gzip or (if installed) zstandard.
+#  For analytics the same columns are written with their types into an
+#  Apache Arrow IPC or Parquet file, which needs the package pyarrow.
+
+import csv, gzip, io
+from datetime import datetime, timezone
+
+# local modules
+from manifestdb import filemeta
+from manifestdb import instrument
+
+# attributes out of the file BLOB written as columns
+DECODED_COLUMNS = ('Size', 'Mode', 'Birth', 'LastModified', 'LastStatusChange',
+    'InodeNumber', 'UserID', 'GroupID')
+# known compressions and the suffix of their files
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+# columnar formats and the suffixes of their files
+COLUMNAR_FORMATS = {'parquet': ('.parquet',), 'arrow': ('.arrow', '.feather', '.ipc')}
+
+def compression_for(path):
+    # compression implied by the file name, None for plain text
+    for compression, suffix in COMPRESSIONS.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+def open_text(path, compression=None):
+    # text file for writing, compressed on the fly
+    if compression is None:
+        return open(path, 'w', newline='')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', newline='')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression needs the package 'zstandard'")
+        writer = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+        return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    raise ValueError('unknown compression: {}'.format(compression))
+
+def _time_stamp(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+def _seconds(value):
+    # time stamps are whole seconds
+    return int(value) if value is not None else None
+
+def decoded_attributes(metadata):
+    # raw values of DECODED_COLUMNS out of a FileMetadata, None for broken BLOBs
+    if metadata is None:
+        return [None] * len(DECODED_COLUMNS)
+    return [metadata.size, metadata.mode, _seconds(metadata.birth),
+        _seconds(metadata.last_modified), _seconds(metadata.last_status_change),
+        metadata.inode, metadata.user_id, metadata.group_id]
+
+def decoded_values(metadata):
+    # values of DECODED_COLUMNS formatted for text, mode in octal, ISO time stamps
+    size, mode, birth, modified, changed, inode, user, group = decoded_attributes(metadata)
+    return [size, oct(mode) if mode is not None else None, _time_stamp(birth),
+        _time_stamp(modified), _time_stamp(changed), inode, user, group]
+
+@instrument.timed('export.csv')
+def write_csv(manifest_db, file, decode=False):
+    # header with the column names, then the rows, returns the number of rows;
+    # with decode the BLOB is replaced by the columns DECODED_COLUMNS
+    csv_writer = csv.writer(file, lineterminator='\n')
+    names = manifest_db.column_names()
+    blob_index = names.index('file') if decode else None
+    if decode:
+        names = names[:blob_index] + names[blob_index + 1:] + list(DECODED_COLUMNS)
+    csv_writer.writerow(names)
+    rows = 0
+    for batch in manifest_db.full_batches():
+        if decode:
+            decoded = filemeta.decode_batch(row[blob_index] for row in batch)
+            batch = [row[:blob_index] + row[blob_index + 1:] + tuple(decoded_values(metadata))
+                for row, metadata in zip(batch, decoded)]
+        csv_writer.writerows(batch)
+        rows += len(batch)
+    return rows
+
+def columnar_format_for(path):
+    # columnar format implied by the file name, None if unknown
+    for name, suffixes in COLUMNAR_FORMATS.items():
+        if path.endswith(suffixes):
+            return name
+    return None
+
+def _arrow_schema(pa):
+    time_stamp = pa.timestamp('s', tz='UTC')
+    return pa.schema([('fileID', pa.string()), ('domain', pa.string()),
+        ('relativePath', pa.string()), ('flags', pa.int8()),
+        ('Size', pa.int64()), ('Mode', pa.int32()), ('Birth', time_stamp),
+        ('LastModified', time_stamp), ('LastStatusChange', time_stamp),
+        ('InodeNumber', pa.int64()), ('UserID', pa.int32()), ('GroupID', pa.int32())])
+
+@instrument.timed('export.columnar')
+def write_columnar(manifest_db, path, file_format='parquet'):
+    # table Files with typed, decoded columns, one record batch per cursor batch,
+    # returns the number of rows
+    try:
+        import pyarrow as pa
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Arrow and Parquet export needs the package 'pyarrow'")
+    schema = _arrow_schema(pa)
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(path, schema, compression='zstd')
+    elif file_format == 'arrow':
+        writer = pa.ipc.new_file(path, schema)
+    else:
+        raise ValueError('unknown format: {}'.format(file_format))
+    names = manifest_db.column_names()
+    indices = [names.index(name) for name in ('fileID', 'domain', 'relativePath', 'flags')]
+    blob_index = names.index('file')
+    rows = 0
+    with writer:
+        for batch in manifest_db.full_batches():
+            columns = [[row[index] for row in batch] for index in indices]
+            decoded = filemeta.decode_batch(row[blob_index] for row in batch)
+            attributes = [decoded_attributes(metadata) for metadata in decoded]
+            columns.extend(map(list, zip(*attributes)))
+            arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(batch)
+    return rows
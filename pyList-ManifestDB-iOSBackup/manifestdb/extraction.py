@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# parallel extraction of backup'd files
+#
+#  File: manifestdb/extraction.py
+#
+#  The files of a domain are copied by a pool of worker threads, copying is
+#  mostly waiting for the disk, so several files in flight at once hide the
+#  latency of opening and creating many small files. Every finished file is
+#  reported into one queue, which is drained by the consumer (the progress
+#  dialog or the command line) to aggregate files, bytes and throughput.
+#  The data itself is copied inside the kernel with copy_file_range (which
+#  may even share extents on btrfs or XFS) or sendfile, only if neither is
+#  supported between the two filesystems it is read into a large buffer.
+#  Every copied file gets the mode and modification time out of its file
+#  BLOB and is then appended to a journal in the target directory, an
+#  interrupted (cancelled or crashed) extraction started again into the same
+#  directory skips the files whose payload and copy are unchanged since, so
+#  does a later sync. When all files are copied, directories and symlinks
+#  are created and their modes and times applied in one pass, directories
+#  last, as every entry made in them changes their time.
+#  Optionally identical files are written only once: files of a size found
+#  more than once are hashed by the workers, every further copy of a content
+#  becomes a reflink (FICLONE, btrfs or XFS) or else a hardlink of the first.
+#  A reflink gets its own mode and time, a hardlink shares the inode and so
+#  keeps those of the first file, the journal records the time it really has.
+#  The payloads of an encrypted backup are decrypted by the workers, each
+#  with its own key unwrapped out of the EncryptionKey of its file BLOB.
+
+import collections, errno, hashlib, json, os, queue, stat, threading, time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# local modules
+from manifestdb import encryption
+from manifestdb import instrument
+
+# default number of copy threads
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+# size of the buffer for copying without kernel support
+BUFFER_SIZE = 1024 * 1024
+# errors telling that the kernel can not copy between these two files
+UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF,
+    errno.ENOTSUP, errno.EOPNOTSUPP, errno.ETXTBSY}
+# errors telling that the filesystem can not share extents
+REFLINK_UNSUPPORTED = UNSUPPORTED | {errno.ENOTTY}
+# ioctl cloning a file, from linux/fs.h
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+# outcome of a job as reported in the events
+COPIED, SKIPPED, LINKED = 'copied', 'skipped', 'linked'
+# name of the journal of completed files in the target directory
+JOURNAL_NAME = '.manifestdb-journal'
+# every thread keeps its own copy buffer
+_local = threading.local()
+
+class Job:
+    # one file to extract, size out of the file BLOB (None if unknown),
+    # mtime in ns and mode are applied right after copying (None to keep them),
+    # key the wrapped EncryptionKey of the file BLOB (None in plain backups)
+    __slots__ = ('file_id', 'source', 'target', 'size', 'mtime', 'key', 'mode')
+
+    def __init__(self, file_id, source, target, size, mtime=None, key=None, mode=None):
+        self.file_id = file_id
+        self.source = source
+        self.target = target
+        self.size = size
+        self.mtime = mtime
+        self.key = key
+        self.mode = mode
+
+def payload_path(backup_path, file_id):
+    # the file is stored in a subdirectory named by the first two characters of its ID
+    return os.path.join(backup_path, file_id[0:2], file_id)
+
+def _nanoseconds(value):
+    if value is None:
+        return None
+    return int(value * 1000000000)
+
+@instrument.timed('extract.plan')
+def plan(backup_path, rows, extract_path, metadata=None, attributes=None):
+    # jobs for the regular files out of rows of (fileID, relativePath, flags)
+    # with sizes out of the dict fileID -> FileMetadata, the payloads are not
+    # looked at; if the list attributes is given, the jobs carry mode and mtime
+    # and (target, flags, mode, mtime in ns, symlink target) of every directory
+    # and symlink is appended to it
+    jobs = []
+    for file_id, relative_path, flags in rows:
+        target_url = os.path.join(extract_path, relative_path)
+        mode = mtime = None
+        file_metadata = metadata.get(file_id) if metadata is not None else None
+        # the row of the domain itself is the chosen folder
+        if file_metadata is not None and relative_path and attributes is not None:
+            mode = file_metadata.mode
+            mtime = _nanoseconds(file_metadata.last_modified)
+            if flags != 1:
+                attributes.append((target_url, flags, mode, mtime, file_metadata.target))
+        # flags 1 = RegularFile, 2 = Directory, 3 = Symlink
+        if flags != 1:
+            continue
+        file_url = payload_path(backup_path, file_id)
+        file_size = file_metadata.size if file_metadata is not None else None
+        key = file_metadata.encryption_key if file_metadata is not None else None
+        jobs.append(Job(file_id, file_url, target_url, file_size, mtime, key, mode))
+    sort_jobs(jobs)
+    return jobs
+
+def sort_jobs(jobs):
+    # in order of the fileIDs, that is of the payload subdirectories,
+    # so the backup is read in the order it is laid out on disk
+    jobs.sort(key=lambda job: job.file_id)
+
+def _set_attributes(path, mode, mtime, follow_symlinks=True):
+    if mode is not None:
+        os.chmod(path, mode)
+    if mtime is not None:
+        # the birth time can not be set on Linux, access time is modification time
+        os.utime(path, ns=(mtime, mtime), follow_symlinks=follow_symlinks)
+
+def set_file_attributes(job):
+    # mode and time of a copied regular file, the owner keeps write access,
+    # so a later sync can replace the copy
+    mode = job.mode
+    if mode is not None:
+        mode = stat.S_IMODE(mode) | stat.S_IRUSR | stat.S_IWUSR
+    _set_attributes(job.target, mode, job.mtime)
+
+@instrument.timed('extract.attributes')
+def apply_attributes(attributes):
+    # create directories and symlinks and set modes and times out of a list of
+    # (target, flags, mode, mtime in ns, symlink target), returns the error messages;
+    # the owner keeps write access, so a later sync can replace them
+    errors = []
+    directories = []
+    for target, flags, mode, mtime, link in attributes:
+        try:
+            if flags == 2:
+                os.makedirs(target, exist_ok=True, mode=0o750)
+                if mode is not None:
+                    mode = stat.S_IMODE(mode) | stat.S_IRWXU
+                directories.append((target, mode, mtime))
+            elif flags == 3:
+                if link is None or os.path.isdir(target) and not os.path.islink(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True, mode=0o750)
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(link, target)
+                # the mode of a symlink is meaningless on Linux
+                if mtime is not None and os.utime in os.supports_follow_symlinks:
+                    _set_attributes(target, None, mtime, follow_symlinks=False)
+        except EnvironmentError as exception:
+            errors.append('{}: {}'.format(target, exception.strerror or exception))
+    # deepest first, setting the time of a directory must not change that of its parent
+    directories.sort(key=lambda directory: directory[0].count(os.sep), reverse=True)
+    for target, mode, mtime in directories:
+        try:
+            _set_attributes(target, mode, mtime)
+        except EnvironmentError as exception:
+            errors.append('{}: {}'.format(target, exception.strerror or exception))
+    return errors
+
+def total_size(jobs):
+    # bytes to copy according to Manifest.db
+    return sum(job.size or 0 for job in jobs)
+
+def has_journal(directory):
+    return os.path.isfile(os.path.join(directory, JOURNAL_NAME))
+
+class Journal:
+    # files copied into a directory, one JSON line per file with
+    # [target relative to the directory, fileID, size, mtime of the payload,
+    # mtime of the copy], the last line of a target counts
+    @instrument.timed('extract.journal_load')
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL_NAME)
+        self.entries = {}
+        self._lines = 0
+        self._file = None
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        target, *entry = json.loads(line)
+                    except ValueError:
+                        # a line cut off by a crash
+                        continue
+                    self.entries[target] = tuple(entry)
+                    self._lines += 1
+        except FileNotFoundError:
+            pass
+
+    def _target(self, job):
+        return os.path.relpath(job.target, self.directory)
+
+    def is_current(self, job):
+        # True if the target was copied from the same, unchanged payload and not touched since
+        entry = self.entries.get(self._target(job))
+        if entry is None or entry[0] != job.file_id:
+            return False
+        try:
+            source = os.stat(job.source)
+            target = os.stat(job.target)
+        except FileNotFoundError:
+            return False
+        # the payload of an encrypted backup is longer than the file by its padding
+        size = job.size if job.size is not None else source.st_size
+        return (job.file_id, source.st_size, source.st_mtime_ns, target.st_mtime_ns) == entry \
+            and target.st_size == size
+
+    def _open(self):
+        if self._lines > len(self.entries):
+            # drop superseded lines of earlier syncs
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                for target, entry in self.entries.items():
+                    f.write(json.dumps([target, *entry]) + '\n')
+            os.replace(temporary, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def add(self, job):
+        # record a copied file with its attributes applied, the line is flushed at once
+        source = os.stat(job.source)
+        target = os.stat(job.target)
+        entry = (job.file_id, source.st_size, source.st_mtime_ns, target.st_mtime_ns)
+        line = json.dumps([self._target(job), *entry]) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._file.flush()
+            self.entries[self._target(job)] = entry
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class Progress:
+    # aggregates the events of the progress queue
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        # unchanged files found in the journal and duplicates linked instead
+        # of copied are counted in files but not in bytes
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.linked = 0
+        self.saved_bytes = 0
+        self.errors = []
+        self._start = time.monotonic()
+        self._stop = None
+
+    def drain(self, events):
+        # consume all events available at the moment, returns their number
+        count = 0
+        while True:
+            try:
+                size, error, outcome = events.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+            self.files += 1
+            if outcome == SKIPPED:
+                self.skipped += 1
+                self.skipped_bytes += size
+            elif outcome == LINKED:
+                self.linked += 1
+                self.saved_bytes += size
+            else:
+                self.bytes += size
+            if error is not None:
+                self.errors.append(error)
+
+    def finish(self):
+        self._stop = time.monotonic()
+
+    def elapsed(self):
+        stop = self._stop if self._stop is not None else time.monotonic()
+        return max(stop - self._start, 1e-9)
+
+    def fraction(self):
+        if self.total_bytes > 0:
+            done = self.bytes + self.skipped_bytes + self.saved_bytes
+            return min(done / self.total_bytes, 1.0)
+        if self.total_files > 0:
+            return self.files / self.total_files
+        return 1.0
+
+    def megabytes_per_second(self):
+        return self.bytes / self.elapsed() / 1e6
+
+    def files_per_second(self):
+        return self.files / self.elapsed()
+
+    def summary(self):
+        summary = '{:.1f} MB/s, {:.0f} files/s'.format(
+            self.megabytes_per_second(), self.files_per_second())
+        if self.skipped:
+            summary += ', {} unchanged files skipped'.format(self.skipped)
+        if self.linked:
+            summary += ', {} duplicates linked, {:.1f} MB saved'.format(
+                self.linked, self.saved_bytes / 1e6)
+        return summary
+
+def _copy_file_range(fd_in, fd_out, offset, size):
+    # explicit offsets, the file positions are not moved
+    while offset < size:
+        copied = os.copy_file_range(fd_in, fd_out, size - offset, offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+def _sendfile(fd_in, fd_out, offset, size):
+    # sendfile writes at the current position of the output file
+    os.lseek(fd_out, offset, os.SEEK_SET)
+    while offset < size:
+        copied = os.sendfile(fd_out, fd_in, offset, size - offset)
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+# copy functions of the kernel available on this platform, in order of preference
+KERNEL_COPIES = []
+if hasattr(os, 'copy_file_range'):
+    KERNEL_COPIES.append(_copy_file_range)
+if hasattr(os, 'sendfile'):
+    KERNEL_COPIES.append(_sendfile)
+
+def _buffer():
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = memoryview(bytearray(BUFFER_SIZE))
+    return buffer
+
+def _copy_buffered(fr, fw, offset):
+    fr.seek(offset)
+    fw.seek(offset)
+    buffer = _buffer()
+    while True:
+        length = fr.readinto(buffer)
+        if not length:
+            break
+        fw.write(buffer[:length])
+        offset += length
+    return offset
+
+def copy_file(source, target):
+    # copy the content of source to target, returns the number of bytes copied
+    with open(source, 'rb', buffering=0) as fr, open(target, 'wb', buffering=0) as fw:
+        fd_in, fd_out = fr.fileno(), fw.fileno()
+        size = os.fstat(fd_in).st_size
+        offset = 0
+        for kernel_copy in KERNEL_COPIES:
+            if offset >= size:
+                break
+            try:
+                offset = kernel_copy(fd_in, fd_out, offset, size)
+                break
+            except OSError as exception:
+                if exception.errno not in UNSUPPORTED:
+                    raise
+        # the file may have grown or the kernel could not copy at all
+        return _copy_buffered(fr, fw, offset)
+
+def sha256(f):
+    # SHA-256 of an open binary file read chunk by chunk
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+        digest.update(chunk)
+    return digest
+
+def content_hash(path):
+    with open(path, 'rb') as f:
+        return sha256(f).digest()
+
+def reflink(source, target):
+    # target shares the extents of source, returns the size
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, os.strerror(errno.ENOTSUP))
+    try:
+        with open(source, 'rb') as fr, open(target, 'wb') as fw:
+            fcntl.ioctl(fw.fileno(), FICLONE, fr.fileno())
+            return os.fstat(fw.fileno()).st_size
+    except OSError:
+        if os.path.exists(target):
+            os.unlink(target)
+        raise
+
+class Extraction(threading.Thread):
+    # copies a list of jobs with a pool of worker threads, every finished file
+    # puts a tuple (bytes, error message or None, outcome) into self.events,
+    # missing payloads and sizes differing from Manifest.db are errors;
+    # with dedup every content is written once, hardlinked duplicates keep
+    # mode and times of the first file;
+    # every file gets mode and mtime of its job before it is recorded in the
+    # journal, so unchanged files are skipped even after a cancel or a crash;
+    # the journal is closed when all workers are done; the directories and
+    # symlinks of the list attributes of plan are made afterwards unless
+    # cancelled, its errors are in self.errors, as are unexpected exceptions
+    # of the workers;
+    # with the unlocked keybag of an encrypted backup the payloads are decrypted
+    def __init__(self, jobs, workers=DEFAULT_WORKERS, journal=None, attributes=None,
+            dedup=False, keybag=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.jobs = jobs
+        self.workers = max(1, workers)
+        self.journal = journal
+        self.attributes = attributes
+        self.errors = []
+        self.keybag = keybag
+        # equal contents are encrypted with different keys, there is nothing to find
+        self.dedup = dedup and keybag is None
+        # only files of a size found more than once can have duplicates
+        self._sizes = collections.Counter(job.size for job in jobs if job.size) if self.dedup else None
+        # (size, hash) -> (first target, Event set when it is written, list set on failure)
+        self._contents = {}
+        self._reflinks = True
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._iterator = iter(jobs)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _next_job(self):
+        with self._lock:
+            return next(self._iterator, None)
+
+    def _copy(self, job):
+        # write the target of a job with its mode and time, returns the number of bytes
+        if self.keybag is None:
+            copied = copy_file(job.source, job.target)
+        elif job.key is None:
+            raise ValueError('no EncryptionKey in Manifest.db')
+        else:
+            copied = encryption.decrypt_file(job.source, job.target,
+                self.keybag.unwrap(job.key), job.size)
+        set_file_attributes(job)
+        return copied
+
+    def _copy_unique(self, job):
+        # copy the first file of a content, link the others, returns (bytes, outcome)
+        with instrument.timer('extract.hash'):
+            key = (job.size, content_hash(job.source))
+        with self._lock:
+            first = key not in self._contents
+            if first:
+                self._contents[key] = (job.target, threading.Event(), [])
+            original, written, failed = self._contents[key]
+        if first:
+            try:
+                return self._copy(job), COPIED
+            except EnvironmentError:
+                failed.append(job.target)
+                raise
+            finally:
+                written.set()
+        written.wait()
+        if failed:
+            return self._copy(job), COPIED
+        return self._link(original, job)
+
+    def _link(self, original, job):
+        # reflinks and copies get the attributes of the job, a hardlink keeps
+        # those of the original, setting them would change all its links
+        if self._reflinks:
+            try:
+                copied = reflink(original, job.target)
+            except OSError as exception:
+                if exception.errno not in REFLINK_UNSUPPORTED:
+                    raise
+                # no need to try again on this filesystem
+                self._reflinks = False
+            else:
+                set_file_attributes(job)
+                return copied, LINKED
+        try:
+            os.link(original, job.target)
+        except OSError:
+            # e.g. too many links or no hardlinks at all
+            copied = copy_file(original, job.target)
+            set_file_attributes(job)
+            return copied, COPIED
+        return os.stat(job.target).st_size, LINKED
+
+    @instrument.profiled
+    def _work(self):
+        created = set()
+        while not self.cancelled.is_set():
+            job = self._next_job()
+            if job is None:
+                break
+            error = None
+            try:
+                if self.journal is not None and self.journal.is_current(job):
+                    instrument.count('extract.skipped')
+                    self.events.put((job.size or 0, None, SKIPPED))
+                    continue
+                target_dirs = os.path.dirname(job.target)
+                # every worker remembers the directories it created already
+                if target_dirs not in created:
+                    os.makedirs(target_dirs, exist_ok=True, mode=0o750)
+                    created.add(target_dirs)
+                # a hardlink of an earlier extraction is replaced, not written through
+                if os.path.lexists(job.target):
+                    os.unlink(job.target)
+                with instrument.timer('extract.copy'):
+                    if self.dedup and self._sizes[job.size] > 1:
+                        copied, outcome = self._copy_unique(job)
+                    else:
+                        copied, outcome = self._copy(job), COPIED
+                if job.size is not None and copied != job.size:
+                    error = '{}: {} bytes copied, but {} in Manifest.db'.format(
+                        job.source, copied, job.size)
+                if self.journal is not None:
+                    self.journal.add(job)
+            except EnvironmentError as exception:
+                copied, outcome = 0, COPIED
+                error = '{}: {}'.format(job.source, exception.strerror or exception)
+            except ValueError as exception:
+                # no key or a payload not decryptable
+                copied, outcome = 0, COPIED
+                error = '{}: {}'.format(job.source, exception)
+            instrument.count('extract.' + outcome)
+            instrument.count('extract.bytes', copied)
+            if error is not None:
+                instrument.count('extract.errors')
+            self.events.put((copied, error, outcome))
+
+    def run(self):
+        errors = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(self._work) for _ in range(self.workers)]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as exception:
+                    # a bug, the other workers went on with the remaining jobs
+                    errors.append('worker failed: {!r}'.format(exception))
+        finally:
+            if self.journal is not None:
+                self.journal.close()
+        if self.attributes and not self.cancelled.is_set():
+            errors.extend(apply_attributes(self.attributes))
+        self.errors = errors
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# decoding of the 'file' BLOB of table Files
+#
+#  File: manifestdb/filemeta.py
+#
+#  The BLOB is a binary plist written by NSKeyedArchiver, the attributes of
+#  the file (Size, Mode, LastModified, ...) are found in the root object
+#  referenced by '$top' out of the list '$objects'. Values of the root object
+#  may again be references (plistlib.UID) into '$objects', e.g. RelativePath,
+#  the Target of a symlink or the EncryptionKey, they are resolved here into
+#  a compact FileMetadata record.
+
+import plistlib as _plistlib
+from datetime import datetime
+
+# local modules
+from manifestdb import instrument
+
+class FileMetadata:
+    # decoded attributes of one file, directory or symlink
+    __slots__ = ('relative_path', 'size', 'mode', 'birth', 'last_modified',
+        'last_status_change', 'inode', 'user_id', 'group_id', 'protection_class',
+        'target', 'encryption_key', 'has_extended_attributes')
+
+    def items(self):
+        # (name, value) pairs for display named as in the archive, unset values are left out
+        items = [('RelativePath', self.relative_path), ('Size', self.size),
+            ('Mode', oct(self.mode) if self.mode is not None else None),
+            ('Birth', _date_time(self.birth)), ('LastModified', _date_time(self.last_modified)),
+            ('LastStatusChange', _date_time(self.last_status_change)),
+            ('InodeNumber', self.inode), ('UserID', self.user_id), ('GroupID', self.group_id),
+            ('ProtectionClass', self.protection_class), ('Target', self.target),
+            ('EncryptionKey', 'yes' if self.encryption_key else 'no'),
+            ('ExtendedAttributes', 'yes' if self.has_extended_attributes else 'no')]
+        return [(name, val) for name, val in items if val is not None]
+
+def _date_time(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value)
+
+def _resolve(objects, value):
+    # follow a reference into '$objects', NSData and NSString are unwrapped
+    if isinstance(value, _plistlib.UID):
+        value = objects[value.data]
+        if value == '$null':
+            return None
+    if isinstance(value, dict):
+        if 'NS.data' in value:
+            return value['NS.data']
+        if 'NS.string' in value:
+            return value['NS.string']
+    return value
+
+def _archive(blob):
+    # list '$objects' and the root object out of it
+    try:
+        archive = _plistlib.loads(blob)
+        objects = archive['$objects']
+        return objects, objects[archive['$top']['root'].data]
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+        return None
+
+def decode(blob):
+    # FileMetadata of a file BLOB, None if not decodable
+    if blob is None:
+        return None
+    instrument.count('filemeta.decoded')
+    archive = _archive(blob)
+    if archive is None or not isinstance(archive[1], dict):
+        return None
+    objects, root = archive
+    get = root.get
+    metadata = FileMetadata()
+    try:
+        metadata.relative_path = _resolve(objects, get('RelativePath'))
+        metadata.target = _resolve(objects, get('Target'))
+        metadata.encryption_key = _resolve(objects, get('EncryptionKey'))
+    except (IndexError, TypeError):
+        return None
+    metadata.size = get('Size', 0)
+    metadata.mode = get('Mode')
+    metadata.birth = get('Birth')
+    metadata.last_modified = get('LastModified')
+    metadata.last_status_change = get('LastStatusChange')
+    metadata.inode = get('InodeNumber')
+    metadata.user_id = get('UserID')
+    metadata.group_id = get('GroupID')
+    metadata.protection_class = get('ProtectionClass')
+    metadata.has_extended_attributes = get('ExtendedAttributes') is not None
+    return metadata
+
+@instrument.timed('filemeta.decode_batch')
+def decode_batch(blobs):
+    # FileMetadata (or None) for every BLOB of an iterable, e.g. a cursor batch
+    return [decode(blob) for blob in blobs]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# named timers and counters on the hot paths
+#
+#  File: manifestdb/instrument.py
+#
+#  When a backup seems to hang, the question is where the time goes: into
+#  SQLite, decoding the file BLOBs, filling the views or copying files.
+#  The GUI, the command line and the extraction wrap their hot paths in
+#  named timers and counters, which test a single module variable and do
+#  nothing else unless enabled by the environment variable
+#  MANIFESTDB_PROFILE or the options --profile and --profile-dump:
+#    MANIFESTDB_PROFILE=1               report of timers and counters at exit
+#    MANIFESTDB_PROFILE=FILE.pstats     additionally a cProfile dump of the
+#                                       main thread and all profiled threads
+#  The report is written to standard error when the program ends, the dump
+#  is read with 'python -m pstats FILE.pstats' (or viewers like snakeviz).
+#
+#    with instrument.timer('sidecar.build'):
+#        ...
+#    instrument.count('extract.bytes', size)
+
+import atexit, collections, contextlib, cProfile, functools, os, pstats, sys, threading, time
+
+ENVIRONMENT_VARIABLE = 'MANIFESTDB_PROFILE'
+
+# tested by every timer and counter, set only by enable
+enabled = False
+_lock = threading.Lock()
+# name -> [calls, total seconds, longest call in seconds]
+_timers = {}
+_counters = collections.Counter()
+_started = None
+# file for the cProfile dump, None if not profiling
+_profile_path = None
+# profiles of the main thread and the threads run by profiled
+_profiles = []
+# returned by timer when disabled, nullcontext can be entered any number of times
+_NO_TIMER = contextlib.nullcontext()
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        add_time(self.name, time.perf_counter() - self.start)
+
+def timer(name):
+    # context manager adding the time of its block to the timer name
+    if not enabled:
+        return _NO_TIMER
+    return _Timer(name)
+
+def timed(name):
+    # decorator adding the time of every call to the timer name
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_time(name, seconds):
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+def count(name, value=1):
+    if enabled:
+        with _lock:
+            _counters[name] += value
+
+def _start_profile():
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12 and newer allow one active profiler, it sees all threads
+        return None
+    with _lock:
+        _profiles.append(profile)
+    return profile
+
+def profiled(function):
+    # decorator for the functions run by threads, their calls are added to the dump
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _profile_path is None:
+            return function(*args, **kwargs)
+        profile = _start_profile()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+    return wrapper
+
+def enable(profile_path=None):
+    # start recording, with profile_path also profile into this file, report at exit
+    global enabled, _started, _profile_path
+    if enabled:
+        return
+    enabled = True
+    _started = time.perf_counter()
+    if profile_path:
+        _profile_path = os.path.abspath(profile_path)
+        _start_profile()
+    atexit.register(finish)
+
+def enable_from_environment():
+    # MANIFESTDB_PROFILE is unset, empty or 0 (off), 1 (report) or a file name (dump)
+    value = os.environ.get(ENVIRONMENT_VARIABLE, '')
+    if value not in ('', '0'):
+        enable(None if value == '1' else value)
+
+def report():
+    # lines of text with all timers (by total time) and counters (by name)
+    with _lock:
+        timers = sorted(_timers.items(), key=lambda item: item[1][1], reverse=True)
+        counters = sorted(_counters.items())
+    elapsed = time.perf_counter() - _started if _started is not None else 0.0
+    lines = ['session of {:.3f} s'.format(elapsed)]
+    if timers:
+        lines.append('{:<32} {:>9} {:>12} {:>12} {:>12}'.format(
+            'timer', 'calls', 'total s', 'mean ms', 'max ms'))
+        for name, (calls, total, longest) in timers:
+            lines.append('{:<32} {:>9} {:>12.4f} {:>12.3f} {:>12.3f}'.format(
+                name, calls, total, total / calls * 1000, longest * 1000))
+    if counters:
+        lines.append('{:<32} {:>9}'.format('counter', 'value'))
+        for name, value in counters:
+            lines.append('{:<32} {:>9}'.format(name, value))
+    return lines
+
+def dump(path):
+    # merge the profiles into one pstats file, False if there was nothing profiled
+    with _lock:
+        profiles = list(_profiles)
+    if not profiles:
+        return False
+    for profile in profiles:
+        profile.disable()
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    stats.dump_stats(path)
+    return True
+
+def finish(file=None):
+    # write the report (to standard error) and the profile dump, called at exit
+    file = file or sys.stderr
+    try:
+        for line in report():
+            print(line, file=file)
+        if _profile_path is not None and dump(_profile_path):
+            print('profile written to {}'.format(_profile_path), file=file)
+    except (EnvironmentError, ValueError):
+        # standard error closed already or the dump not writable
+        pass
+
+enable_from_environment()
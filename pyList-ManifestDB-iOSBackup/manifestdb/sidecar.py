@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# local sidecar database for fast queries on a backup
+#
+#  File: manifestdb/sidecar.py
+#
+#  The backup itself must stay read-only, so any index we need is kept in a
+#  separate SQLite database in the user cache directory. It is built in two
+#  passes. The first copies the small columns of table Files inside SQLite,
+#  with a covering index on (domain, relativePath), so choosing a domain is
+#  a pure index range scan, and the list of domains with their number of
+#  files into table Domains; it takes a fraction of a second, so the domains
+#  can be shown at once. The second pass (complete) decodes every BLOB in
+#  Python, keeps the attributes in table Metadata, fills in the sizes of the
+#  files and domains and builds a full-text index with the trigram
+#  tokenizer of FTS5 over relativePath, which answers substring searches
+#  across all domains without scanning. It takes seconds for large backups
+#  and is deferred: the GUI runs it in the background, other callers when
+#  they need sizes or attributes. Until then the sizes are None, searches
+#  scan table Files and attributes are decoded out of the BLOBs asked for.
+#  The key 'complete' of table Meta tells whether the second pass is done.
+#  Views of many rows keep only the rowids of table Files in the order given
+#  by SQLite and fetch the rows they actually show by rowid.
+#  The sidecar is keyed by the path of Manifest.db, its mtime, size and
+#  SHA-256 hash, so reopening an unchanged backup needs a single stat, and
+#  a changed backup is rebuilt automatically. Both passes write in one
+#  immediate transaction, so the lock of SQLite serializes processes opening
+#  the same backup, the one coming second finds the work done; in WAL mode
+#  the readers go on reading meanwhile.
+
+import hashlib, os, re, sqlite3, threading
+from urllib.request import pathname2url
+
+# local modules
+from manifestdb import extraction
+from manifestdb import filemeta
+from manifestdb import instrument
+
+# bump when the layout of the sidecar changes
+SCHEMA_VERSION = '6'
+# seconds to wait for another process building the same sidecar
+LOCK_TIMEOUT = 600
+# number of rows fetched from a cursor at once
+BATCH_SIZE = 4096
+# columns of table Metadata besides fileID, in the order of FileMetadata
+METADATA_COLUMNS = ('size', 'mode', 'birth', 'last_modified', 'last_status_change',
+    'inode', 'user_id', 'group_id', 'protection_class', 'target', 'has_extended_attributes')
+# ways to match relativePath in a search
+SEARCH_MODES = ('substring', 'prefix', 'glob', 'regex')
+# maximal number of search results
+SEARCH_LIMIT = 1000
+# orderings of rows by a column of table Files, the path breaks ties
+ORDERINGS = {'fileID': ('fileID',), 'relativePath': ('domain', 'relativePath'),
+    'flags': ('flags', 'domain', 'relativePath')}
+# highest code point, closes a range of strings starting with a prefix
+MAX_CHARACTER = '\U0010ffff'
+
+def cache_dir():
+    # follow the XDG base directory specification
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ManifestDBView')
+
+def _phrase(text):
+    # FTS5 phrase matching text literally
+    return '"{}"'.format(text.replace('"', '""'))
+
+def _glob_literal(pattern):
+    # longest run of plain characters in a glob pattern
+    plain = re.sub(r'\[[^\]]*\]', '*', pattern)
+    return max(re.split(r'[*?]', plain), key=len)
+
+def _order_by(column, descending, table='Files'):
+    direction = ' DESC' if descending else ''
+    return ' ORDER BY ' + ', '.join('{}.{}{}'.format(table, name, direction)
+        for name in ORDERINGS[column])
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return extraction.sha256(f).hexdigest()
+
+class Sidecar:
+    def __init__(self, db_url, directory=None):
+        self.db_url = os.path.realpath(db_url)
+        directory = directory or cache_dir()
+        os.makedirs(directory, exist_ok=True, mode=0o700)
+        # one sidecar per backup, named after the path of its Manifest.db
+        key = hashlib.sha1(self.db_url.encode()).hexdigest()
+        self.path = os.path.join(directory, key + '.db')
+        self.connection = self._connect()
+        self.connection.execute("CREATE TABLE IF NOT EXISTS Meta (key TEXT PRIMARY KEY, value TEXT)")
+        # serializes the writes of the threads sharing the connection, e.g. the
+        # GUI writing from the main thread while a loader thread reads;
+        # other processes are kept out by the lock of SQLite
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        # readers are not blocked by the transaction of the second pass
+        connection.execute("PRAGMA journal_mode = WAL")
+        return connection
+
+    def _attach_backup(self, connection):
+        uri = 'file:{}?mode=ro'.format(pathname2url(self.db_url))
+        connection.execute("ATTACH DATABASE ? AS backup", (uri,))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _signature(self):
+        stat = os.stat(self.db_url)
+        return {'schema': SCHEMA_VERSION, 'dbURL': self.db_url,
+                'mtime': str(stat.st_mtime_ns), 'size': str(stat.st_size)}
+
+    def _meta(self, connection=None):
+        connection = connection or self.connection
+        return dict(connection.execute("SELECT key, value FROM main.Meta"))
+
+    @instrument.timed('sidecar.check')
+    def is_current(self):
+        meta = self._meta()
+        signature = self._signature()
+        if all(meta.get(key) == value for key, value in signature.items()):
+            return True
+        if any(meta.get(key) != signature[key] for key in ('schema', 'dbURL', 'size')):
+            return False
+        # only the mtime differs (e.g. the backup was copied), compare the content
+        if meta.get('sha256') != file_hash(self.db_url):
+            return False
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE Meta SET value = ? WHERE key = 'mtime'",
+                (signature['mtime'],))
+        return True
+
+    @instrument.timed('sidecar.build')
+    def build(self):
+        # first pass, copy the small columns of the backup's Files table and index them,
+        # returns False if another process has built it meanwhile
+        connection = self.connection
+        signature = self._signature()
+        signature['sha256'] = file_hash(self.db_url)
+        with self.lock:
+            self._attach_backup(connection)
+            try:
+                with connection:
+                    # waits while another process builds the same sidecar
+                    connection.execute("BEGIN IMMEDIATE")
+                    meta = self._meta()
+                    if all(meta.get(key) == value for key, value in signature.items()):
+                        return False
+                    self._build(connection, signature)
+                    return True
+            finally:
+                connection.execute("DETACH DATABASE backup")
+
+    def _build(self, connection, signature):
+        # names are qualified with 'main', the attached backup has a table Files too
+        connection.execute("DELETE FROM main.Meta")
+        # Payloads is left over from schema 4
+        for table in ('Paths', 'Files', 'Metadata', 'Domains', 'Payloads'):
+            connection.execute("DROP TABLE IF EXISTS main.{}".format(table))
+        # size is NULL until the second pass
+        connection.execute("CREATE TABLE main.Files (fileID TEXT PRIMARY KEY,"
+            " domain TEXT, relativePath TEXT, flags INTEGER, size INTEGER)")
+        connection.execute("CREATE TABLE main.Metadata (fileID TEXT PRIMARY KEY, {})".format(
+            ', '.join(METADATA_COLUMNS)))
+        connection.execute("CREATE TABLE main.Domains (domain TEXT PRIMARY KEY,"
+            " files INTEGER, size INTEGER)")
+        cursor = connection.execute("INSERT INTO main.Files (fileID, domain, relativePath, flags)"
+            " SELECT fileID, domain, relativePath, flags FROM backup.Files")
+        instrument.count('sidecar.rows_indexed', cursor.rowcount)
+        # covering index, queries by domain never touch the table itself
+        connection.execute("CREATE INDEX main.FilesDomainPathIdx"
+            " ON Files(domain, relativePath, fileID, flags, size)")
+        connection.execute("CREATE INDEX main.FilesPathIdx ON Files(relativePath)")
+        connection.execute("INSERT INTO main.Domains SELECT domain, SUM(flags = 1), NULL"
+            " FROM main.Files GROUP BY domain")
+        connection.executemany("INSERT INTO main.Meta (key, value) VALUES (?, ?)",
+            list(signature.items()) + [('complete', '0')])
+
+    def open(self):
+        # make sure the sidecar matches the backup, returns True if it was rebuilt
+        if self.is_current():
+            return False
+        return self.build()
+
+    def is_complete(self):
+        # True if the second pass is done
+        return self._meta().get('complete') == '1'
+
+    @instrument.timed('sidecar.complete')
+    def complete(self):
+        # second pass, decode the BLOBs into table Metadata, fill in the sizes and build
+        # the full-text index, returns True if it did the work; it uses a connection of
+        # its own, so it may run in a thread of its own while the sidecar is read
+        if self.is_complete():
+            return False
+        connection = self._connect()
+        try:
+            self._attach_backup(connection)
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                # done by another thread or process meanwhile
+                if self._meta(connection).get('complete') != '0':
+                    return False
+                self._complete(connection)
+                return True
+        finally:
+            connection.close()
+
+    def _complete(self, connection):
+        insert_metadata = "INSERT INTO main.Metadata VALUES ({})".format(
+            ', '.join('?' * (len(METADATA_COLUMNS) + 1)))
+        cursor = connection.execute("SELECT fileID, file FROM backup.Files")
+        while True:
+            batch = cursor.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+            decoded = filemeta.decode_batch(blob for file_id, blob in batch)
+            connection.executemany(insert_metadata, [(file_id,) + tuple(
+                getattr(attributes, name) for name in METADATA_COLUMNS)
+                for (file_id, blob), attributes in zip(batch, decoded) if attributes is not None])
+            instrument.count('sidecar.blobs_decoded', len(batch))
+        cursor.close()
+        # BLOBs not decodable count as empty
+        connection.execute("UPDATE main.Files SET size = COALESCE((SELECT Metadata.size"
+            " FROM main.Metadata WHERE Metadata.fileID = Files.fileID), 0)")
+        connection.execute("UPDATE main.Domains SET size = (SELECT TOTAL(size) FROM main.Files"
+            " WHERE Files.domain = Domains.domain)")
+        # trigram index for searching, needs SQLite 3.34 or newer
+        try:
+            connection.execute("CREATE VIRTUAL TABLE main.Paths USING fts5(relativePath,"
+                " content='Files', content_rowid='rowid', tokenize='trigram')")
+            connection.execute("INSERT INTO main.Paths(Paths) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            pass
+        connection.execute("UPDATE main.Meta SET value = '1' WHERE key = 'complete'")
+
+    @instrument.timed('sidecar.domains')
+    def domains(self):
+        # list of (domain, number of regular files, total size in bytes) ordered by domain,
+        # the sizes are None until the second pass
+        cursor = self.connection.execute("SELECT domain, files, size FROM Domains ORDER BY domain")
+        domains = [(domain, files, None if size is None else int(size))
+            for domain, files, size in cursor]
+        cursor.close()
+        return domains
+
+    def _batches(self, query, parameters, batch_size):
+        cursor = self.connection.execute(query, parameters)
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            cursor.close()
+
+    def domain_batches(self, domain, batch_size=BATCH_SIZE):
+        # yields lists of (fileID, relativePath, flags) tuples of a single domain
+        return self._batches("SELECT fileID, relativePath, flags FROM Files"
+            " WHERE domain = ? ORDER BY relativePath", (domain,), batch_size)
+
+    def payload_batches(self, batch_size=BATCH_SIZE):
+        # yields lists of (fileID, domain, relativePath, size) of all regular files ordered by fileID
+        return self._batches("SELECT fileID, domain, relativePath, size FROM Files"
+            " WHERE flags = 1 ORDER BY fileID", (), batch_size)
+
+    @instrument.timed('sidecar.children')
+    def children(self, domain, directory=''):
+        # entries of a directory as list of (name, relativePath, fileID, flags, has children,
+        # regular files, size) ordered by name, files and size count the whole subtree,
+        # the sizes are None until the second pass;
+        # directories only implied by deeper paths have no fileID and flags 2
+        prefix = directory + '/' if directory else ''
+        start = len(prefix) + 1
+        cursor = self.connection.execute("SELECT name, ? || name, MAX(CASE WHEN slash = 0"
+            " THEN fileID END), COALESCE(MAX(CASE WHEN slash = 0 THEN flags END), 2),"
+            " MAX(slash > 0), SUM(flags = 1), SUM(size) FROM (SELECT fileID, flags, size,"
+            " slash, CASE slash WHEN 0 THEN rest ELSE substr(rest, 1, slash - 1) END AS name"
+            " FROM (SELECT fileID, flags, size, substr(relativePath, ?) AS rest,"
+            " instr(substr(relativePath, ?), '/') AS slash FROM Files"
+            " WHERE domain = ? AND relativePath > ? AND relativePath < ?))"
+            " GROUP BY name ORDER BY name",
+            (prefix, start, start, domain, prefix, prefix + MAX_CHARACTER))
+        children = [row[:4] + (bool(row[4]), row[5], None if row[6] is None else int(row[6]))
+            for row in cursor]
+        cursor.close()
+        return children
+
+    def subtree_batches(self, domain, directory='', batch_size=BATCH_SIZE):
+        # yields lists of (fileID, relativePath, flags) of directory and everything below
+        if not directory:
+            return self.domain_batches(domain, batch_size)
+        prefix = directory + '/'
+        # the range is scanned on the index, the test skips siblings like 'directory.old'
+        return self._batches("SELECT fileID, relativePath, flags FROM Files WHERE domain = ?"
+            " AND relativePath >= ? AND relativePath < ? AND (relativePath = ? OR relativePath > ?)"
+            " ORDER BY relativePath",
+            (domain, directory, prefix + MAX_CHARACTER, directory, prefix), batch_size)
+
+    def rowid_batches(self, domain, column='relativePath', descending=False,
+            batch_size=BATCH_SIZE):
+        # yields lists of rowids of the files of a domain ordered by column
+        query = "SELECT rowid FROM Files WHERE domain = ?" + _order_by(column, descending)
+        for batch in self._batches(query, (domain,), batch_size):
+            instrument.count('sidecar.rowids', len(batch))
+            yield [rowid for rowid, in batch]
+
+    @instrument.timed('sidecar.rows_by_rowid')
+    def rows_by_rowid(self, rowids):
+        # dict rowid -> (fileID, domain, relativePath, flags)
+        query = "SELECT rowid, fileID, domain, relativePath, flags FROM Files WHERE rowid IN ({})"
+        rowids = list(rowids)
+        instrument.count('sidecar.rows_fetched', len(rowids))
+        return {row[0]: row[1:] for row in self._select_in(query, rowids)}
+
+    def has_full_text(self):
+        cursor = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Paths'")
+        found = cursor.fetchone() is not None
+        cursor.close()
+        return found
+
+    def search(self, pattern, mode='substring', limit=SEARCH_LIMIT):
+        # list of (domain, relativePath, fileID, flags) of all domains matching pattern,
+        # substring is case-insensitive, prefix, glob and regex are case-sensitive,
+        # an invalid regular expression raises re.error
+        return self._search("Files.domain, Files.relativePath, Files.fileID, Files.flags",
+            pattern, mode, limit, 'relativePath', False)
+
+    def search_rowids(self, pattern, mode='substring', limit=SEARCH_LIMIT,
+            column='relativePath', descending=False):
+        # list of rowids of the files matching pattern ordered by column
+        rows = self._search("Files.rowid", pattern, mode, limit, column, descending)
+        return [rowid for rowid, in rows]
+
+    @instrument.timed('sidecar.search')
+    def _search(self, columns, pattern, mode, limit, column, descending):
+        tail = _order_by(column, descending) + " LIMIT ?"
+        full_text = self.has_full_text()
+        if mode == 'substring':
+            if full_text and len(pattern) >= 3:
+                query = ("SELECT {} FROM Paths JOIN Files ON Files.rowid = Paths.rowid"
+                    " WHERE Paths MATCH ?").format(columns)
+                parameters = [_phrase(pattern)]
+            else:
+                query = "SELECT {} FROM Files WHERE instr(lower(relativePath), lower(?)) > 0".format(
+                    columns)
+                parameters = [pattern]
+        elif mode == 'prefix':
+            # range scan on the index of relativePath
+            query = "SELECT {} FROM Files WHERE relativePath >= ? AND relativePath < ?".format(
+                columns)
+            parameters = [pattern, pattern + MAX_CHARACTER]
+        elif mode == 'glob':
+            literal = _glob_literal(pattern)
+            if full_text and len(literal) >= 3:
+                # the trigram index narrows down the rows, GLOB decides
+                query = ("SELECT {} FROM Paths JOIN Files ON Files.rowid = Paths.rowid"
+                    " WHERE Paths MATCH ? AND Files.relativePath GLOB ?").format(columns)
+                parameters = [_phrase(literal), pattern]
+            else:
+                query = "SELECT {} FROM Files WHERE relativePath GLOB ?".format(columns)
+                parameters = [pattern]
+        elif mode == 'regex':
+            regex = re.compile(pattern)
+            self.connection.create_function('path_matches', 1,
+                lambda path: path is not None and regex.search(path) is not None)
+            query = "SELECT {} FROM Files WHERE path_matches(relativePath)".format(columns)
+            parameters = []
+        else:
+            raise ValueError('unknown search mode: {}'.format(mode))
+        cursor = self.connection.execute(query + tail, parameters + [limit])
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+
+    def _select_in(self, query, keys, chunk_size=500):
+        # rows of a query with an IN list, the keys are given in chunks
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            cursor = self.connection.execute(query.format(', '.join('?' * len(chunk))), chunk)
+            yield from cursor
+            cursor.close()
+
+    @instrument.timed('sidecar.metadata_for')
+    def metadata_for(self, file_ids):
+        # dict fileID -> FileMetadata (without EncryptionKey) out of table Metadata
+        result = {}
+        query = "SELECT fileID, {} FROM Metadata WHERE fileID IN ({{}})".format(
+            ', '.join(METADATA_COLUMNS))
+        for row in self._select_in(query, list(file_ids)):
+            metadata = filemeta.FileMetadata()
+            for name, value in zip(METADATA_COLUMNS, row[1:]):
+                setattr(metadata, name, value)
+            metadata.relative_path = None
+            metadata.encryption_key = None
+            result[row[0]] = metadata
+        return result
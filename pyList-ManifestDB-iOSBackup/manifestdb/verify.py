@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# integrity check of a backup directory
+#
+#  File: manifestdb/verify.py
+#
+#  Before a copied backup is archived it should be complete: every regular
+#  file (flags 1) of table Files has its payload 'xx/fileID' with the size
+#  out of its file BLOB, and no payload is left over without a row. The
+#  payloads are listed with one scandir per subdirectory in a pool of
+#  threads, so only the directories are read, never the files, and all
+#  rows are compared in one pass ordered by fileID against the listing.
+#  Optionally every payload is read and hashed (SHA-256) by a pool of
+#  processes, which finds unreadable files and gives a list for sha256sum:
+#    cd BACKUP && sha256sum --check --quiet FILE
+#  The payloads of encrypted backups are padded to whole AES blocks, their
+#  size is up to one block larger than the one in the BLOB.
+
+import os, re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# local modules
+from manifestdb import encryption
+from manifestdb import extraction
+from manifestdb import instrument
+
+# subdirectories holding the payloads, named by the first two characters of the fileIDs
+PAYLOAD_DIRECTORY = re.compile('^[0-9a-f]{2}$')
+# payloads given to a hashing process at once
+HASH_CHUNK_SIZE = 64
+# default number of hashing processes
+DEFAULT_PROCESSES = os.cpu_count() or 1
+
+class Result:
+    # outcome of verify, problems are listed ordered by fileID
+    def __init__(self):
+        # regular files of Manifest.db and the bytes of their payloads found
+        self.files = 0
+        self.bytes = 0
+        # (fileID, domain, relativePath, size out of the BLOB)
+        self.missing = []
+        # (fileID, domain, relativePath, size out of the BLOB, size of the payload)
+        self.wrong_size = []
+        # payloads relative to the backup directory without a row in Manifest.db
+        self.orphans = []
+        # payloads found for the rows, the ones to hash
+        self.payloads = []
+
+    def problems(self):
+        return len(self.missing) + len(self.wrong_size) + len(self.orphans)
+
+    def summary(self):
+        return '{} files checked ({:.1f} GB), {} missing, {} with wrong size, {} orphaned payloads'\
+            .format(self.files, self.bytes / 1e9, len(self.missing), len(self.wrong_size),
+            len(self.orphans))
+
+def payload_name(file_id):
+    # path of the payload relative to the backup directory
+    return os.path.join(file_id[0:2], file_id)
+
+def _list_directory(backup_path, name):
+    # (payload name, size) of the regular files of one subdirectory
+    payloads = []
+    with os.scandir(os.path.join(backup_path, name)) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                size = entry.stat(follow_symlinks=False).st_size
+                payloads.append((os.path.join(name, entry.name), size))
+    return payloads
+
+@instrument.timed('verify.scan')
+def scan(backup_path, workers=extraction.DEFAULT_WORKERS):
+    # dict payload name -> size of all files in the subdirectories of the backup
+    names = [entry.name for entry in os.scandir(backup_path)
+        if entry.is_dir(follow_symlinks=False) and PAYLOAD_DIRECTORY.match(entry.name)]
+    payloads = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for listing in pool.map(lambda name: _list_directory(backup_path, name), names):
+            payloads.update(listing)
+    return payloads
+
+def _size_matches(expected, actual, encrypted):
+    if not encrypted:
+        return actual == expected
+    # PKCS#7 adds 1 to 16 bytes, empty files may have an empty payload
+    block = encryption.BLOCK_SIZE
+    return actual == expected == 0 or actual % block == 0 and expected < actual <= expected + block
+
+@instrument.timed('verify.check')
+def verify(backup, workers=extraction.DEFAULT_WORKERS):
+    # compare the regular files of the backup with its payloads, returns a Result
+    payloads = scan(backup.path, workers)
+    encrypted = backup.keybag is not None
+    result = Result()
+    for batch in backup.payload_batches():
+        for file_id, domain, relative_path, size in batch:
+            result.files += 1
+            actual = payloads.pop(payload_name(file_id), None)
+            if actual is None:
+                result.missing.append((file_id, domain, relative_path, size))
+                continue
+            result.bytes += actual
+            result.payloads.append(payload_name(file_id))
+            if not _size_matches(size, actual, encrypted):
+                result.wrong_size.append((file_id, domain, relative_path, size, actual))
+    # what is left has no row, directories and symlinks have no payload
+    result.orphans = sorted(payloads)
+    return result
+
+def _hash(path):
+    # (SHA-256 as hex or None, error message or None, bytes read), runs in a process of the pool
+    try:
+        with open(path, 'rb') as f:
+            digest = extraction.sha256(f)
+            return digest.hexdigest(), None, f.tell()
+    except EnvironmentError as exception:
+        return None, exception.strerror or str(exception), 0
+
+def hash_payloads(backup_path, names, processes=DEFAULT_PROCESSES):
+    # yields (payload name, SHA-256 as hex or None, error message or None, bytes read)
+    # in the order of names, the files are read by a pool of processes
+    paths = [os.path.join(backup_path, name) for name in names]
+    with ProcessPoolExecutor(max_workers=max(1, processes)) as pool:
+        for name, (digest, error, size) in zip(names,
+                pool.map(_hash, paths, chunksize=HASH_CHUNK_SIZE)):
+            yield name, digest, error, size
@@ -11,7 +11,13 @@ setup(
     url='https://github.com/ekuester/pyGTK-List-ManifestDB-from-iOSBackup',
     author="Erich Küster",
     author_email='erich.kuester@arcor.de',
-    packages=['pyList-ManifestDB-iOSBackup'],
+    # the GTK-free core is the package manifestdb, used by the GUI and the command line
+    packages=['pyList-ManifestDB-iOSBackup', 'manifestdb'],
+    package_dir={'pyList-ManifestDB-iOSBackup': 'pyList-ManifestDB-iOSBackup',
+        'manifestdb': 'pyList-ManifestDB-iOSBackup/manifestdb'},
+    entry_points={
+        'console_scripts': ['manifestdb = manifestdb.cli:main'],
+    },
     license="MIT",
     classifiers=[
         'Development Status :: 12 - Beta',
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# tests of the command line interface
+#
+#  File: tests/test_cli.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import contextlib, csv, filecmp, gzip, io, os, shutil, sqlite3, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import cli
+import synthetic
+
+ROWS = 1000
+
+def setUpModule():
+    global DIRECTORY, BACKUP_PATH
+    DIRECTORY = tempfile.mkdtemp()
+    BACKUP_PATH = os.path.join(DIRECTORY, 'backup')
+    synthetic.generate(BACKUP_PATH, ROWS, seed=3)
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY)
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # the sidecars go into a cache of their own, no password is found
+        environment = {'XDG_CACHE_HOME': os.path.join(self.directory, 'cache')}
+        patcher = mock.patch.dict(os.environ, environment)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(cli.PASSWORD_VARIABLE, None)
+        connection = sqlite3.connect(os.path.join(BACKUP_PATH, 'Manifest.db'))
+        self.rows = connection.execute(
+            "SELECT fileID, domain, relativePath, flags FROM Files ORDER BY domain, relativePath")\
+            .fetchall()
+        connection.close()
+
+    def run_cli(self, *arguments):
+        # (exit status, standard output, standard error)
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = cli.main([BACKUP_PATH] + list(arguments))
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def _lines(self, text):
+        return [line.split('\t') for line in text.splitlines()]
+
+    def _domain_rows(self, domain):
+        return [row for row in self.rows if row[1] == domain]
+
+    def test_domains(self):
+        status, stdout, stderr = self.run_cli('domains')
+        self.assertEqual(status, 0)
+        lines = self._lines(stdout)
+        domains = sorted({row[1] for row in self.rows})
+        self.assertEqual([line[0] for line in lines], domains)
+        for domain, files, size in lines:
+            regular = [row[0] for row in self._domain_rows(domain) if row[3] == 1]
+            self.assertEqual(int(files), len(regular))
+            self.assertEqual(int(size), sum(os.path.getsize(
+                os.path.join(BACKUP_PATH, file_id[:2], file_id)) for file_id in regular))
+
+    def test_ls(self):
+        status, stdout, stderr = self.run_cli('ls', 'HomeDomain')
+        self.assertEqual(status, 0)
+        self.assertEqual(self._lines(stdout), [[file_id, str(flags), relative_path]
+            for file_id, domain, relative_path, flags in self._domain_rows('HomeDomain')])
+
+    def test_search(self):
+        status, stdout, stderr = self.run_cli('search', '-m', 'prefix', 'Library/Pref')
+        self.assertEqual(status, 0)
+        expected = sorted([file_id, str(flags), domain, relative_path]
+            for file_id, domain, relative_path, flags in self.rows
+            if relative_path.startswith('Library/Pref'))
+        self.assertEqual(sorted(self._lines(stdout)), expected)
+        self.assertEqual(len(self._lines(self.run_cli('search', '-n', '3', 'a')[1])), 3)
+        # nothing found and an invalid regular expression
+        self.assertEqual(self.run_cli('search', 'no such path')[0], 1)
+        status, stdout, stderr = self.run_cli('search', '-m', 'regex', '(')
+        self.assertEqual(status, 1)
+        self.assertIn('invalid regular expression', stderr)
+
+    def test_info(self):
+        file_id, domain, relative_path, flags = self._domain_rows('HomeDomain')[-1]
+        status, stdout, stderr = self.run_cli('info', file_id)
+        self.assertEqual(status, 0)
+        values = dict(line.split(None, 1) for line in stdout.splitlines())
+        self.assertEqual(values['RelativePath'], relative_path)
+        self.assertEqual(values['payload'], os.path.join(BACKUP_PATH, file_id[:2], file_id))
+        self.assertEqual(self.run_cli('info', '0' * 40)[0], 1)
+
+    def test_export_csv(self):
+        path = os.path.join(self.directory, 'files.csv.gz')
+        status, stdout, stderr = self.run_cli('export-csv', '--decode', path)
+        self.assertEqual(status, 0)
+        self.assertIn('{} rows exported'.format(len(self.rows)), stderr)
+        with gzip.open(path, 'rt', newline='') as file:
+            self.assertEqual(len(list(csv.reader(file))), len(self.rows) + 1)
+        # standard output is not compressed
+        self.assertEqual(self.run_cli('export-csv', '-z', 'gzip')[0], 1)
+        status, stdout, stderr = self.run_cli('export-csv')
+        self.assertEqual(status, 0)
+        self.assertEqual(len(list(csv.reader(io.StringIO(stdout)))), len(self.rows) + 1)
+
+    def _check_extracted(self, target, domain):
+        rows = self._domain_rows(domain)
+        for file_id, _, relative_path, flags in rows:
+            if flags == 1:
+                self.assertTrue(filecmp.cmp(os.path.join(BACKUP_PATH, file_id[:2], file_id),
+                    os.path.join(target, relative_path), shallow=False))
+            elif flags == 2:
+                self.assertTrue(os.path.isdir(os.path.join(target, relative_path)))
+            else:
+                self.assertTrue(os.path.islink(os.path.join(target, relative_path)))
+
+    def test_extract(self):
+        # a single domain is extracted flat
+        target = os.path.join(self.directory, 'home')
+        status, stdout, stderr = self.run_cli('extract', '-q', 'HomeDomain', target)
+        self.assertEqual(status, 0, stderr)
+        self._check_extracted(target, 'HomeDomain')
+        # again only changed files are copied
+        status, stdout, stderr = self.run_cli('extract', '-q', 'HomeDomain', target)
+        self.assertEqual(status, 0, stderr)
+        regular = len([row for row in self._domain_rows('HomeDomain') if row[3] == 1])
+        self.assertIn('{} unchanged files skipped'.format(regular), stderr)
+
+    def test_extract_pattern(self):
+        # a pattern gets a directory per domain
+        target = os.path.join(self.directory, 'apps')
+        status, stdout, stderr = self.run_cli('extract', '-q', '--dedup', 'AppDomain-*', target)
+        self.assertEqual(status, 0, stderr)
+        domains = sorted({row[1] for row in self.rows if row[1].startswith('AppDomain-')})
+        self.assertTrue(domains)
+        for domain in domains:
+            self._check_extracted(os.path.join(target, domain), domain)
+        self.assertEqual(self.run_cli('extract', 'NoSuchDomain*', target)[0], 1)
+
+    def test_extract_not_empty(self):
+        target = os.path.join(self.directory, 'full')
+        os.makedirs(target)
+        open(os.path.join(target, 'other'), 'w').close()
+        status, stdout, stderr = self.run_cli('extract', 'HomeDomain', target)
+        self.assertEqual(status, 1)
+        self.assertIn('holds no journal', stderr)
+
+    def test_no_backup(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            status = cli.main([os.path.join(self.directory, 'missing'), 'domains'])
+        self.assertEqual(status, 1)
+        self.assertIn('no Manifest.db found', stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
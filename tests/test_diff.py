@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# tests of the changes between two backups
+#
+#  File: tests/test_diff.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import contextlib, io, os, shutil, sqlite3, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import backup
+from manifestdb import cli
+from manifestdb import diff
+from manifestdb import filemeta
+import synthetic
+
+ROWS = 600
+LAST_MODIFIED = 1700000000
+
+def setUpModule():
+    global DIRECTORY, BACKUP_PATH
+    DIRECTORY = tempfile.mkdtemp()
+    BACKUP_PATH = os.path.join(DIRECTORY, 'backup')
+    synthetic.generate(BACKUP_PATH, ROWS, seed=6)
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY)
+
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = os.path.join(self.directory, 'cache')
+        # the newer backup is a copy with a few rows changed
+        self.newer = os.path.join(self.directory, 'newer')
+        shutil.copytree(BACKUP_PATH, self.newer)
+        self.connection = sqlite3.connect(os.path.join(self.newer, 'Manifest.db'))
+        self.addCleanup(self.connection.close)
+        self.rows = {}
+        for file_id, domain, relative_path, flags, blob in self.connection.execute(
+                "SELECT fileID, domain, relativePath, flags, file FROM Files"
+                " WHERE domain = 'HomeDomain' ORDER BY relativePath"):
+            self.rows.setdefault(flags, []).append(
+                (file_id, domain, relative_path, flags, filemeta.decode(blob)))
+
+    def _update(self, row, size=None, last_modified=None, target=None):
+        file_id, domain, relative_path, flags, metadata = row
+        blob = synthetic.file_blob(relative_path, flags,
+            metadata.size if size is None else size,
+            metadata.last_modified if last_modified is None else last_modified,
+            metadata.inode, target or metadata.target)
+        with self.connection:
+            self.connection.execute("UPDATE Files SET file = ? WHERE fileID = ?", (blob, file_id))
+
+    def _add(self, domain, relative_path, content):
+        file_id = synthetic.file_id(domain, relative_path)
+        blob = synthetic.file_blob(relative_path, 1, len(content), LAST_MODIFIED, 1)
+        with self.connection:
+            self.connection.execute("INSERT INTO Files VALUES (?, ?, ?, 1, ?)",
+                (file_id, domain, relative_path, blob))
+        with open(os.path.join(self.newer, file_id[:2], file_id), 'wb') as f:
+            f.write(content)
+        return file_id
+
+    def _changes(self, patterns=None):
+        with backup.Backup(BACKUP_PATH, self.cache) as old, \
+                backup.Backup(self.newer, self.cache) as new:
+            return [change for batch in diff.change_batches(old, new, patterns, batch_size=2)
+                for change in batch]
+
+    def test_unchanged(self):
+        self.assertEqual(self._changes(), [])
+
+    def test_changes(self):
+        regular = self.rows[1]
+        removed = regular[0]
+        with self.connection:
+            self.connection.execute("DELETE FROM Files WHERE fileID = ?", (removed[0],))
+        added = self._add('HomeDomain', 'Library/added.plist', b'new file')
+        resized = regular[1]
+        self._update(resized, size=resized[4].size + 1)
+        touched = regular[2]
+        self._update(touched, last_modified=LAST_MODIFIED)
+        # directories change their times with every entry, they are no change
+        self._update(self.rows[2][1], last_modified=LAST_MODIFIED)
+        changes = self._changes()
+        expected = [
+            (diff.REMOVED, 'HomeDomain', removed[2], removed[0], 1, removed[4].size, None,
+                removed[4].last_modified, None),
+            (diff.ADDED, 'HomeDomain', 'Library/added.plist', added, 1, None, 8,
+                None, LAST_MODIFIED),
+            (diff.MODIFIED, 'HomeDomain', resized[2], resized[0], 1, resized[4].size,
+                resized[4].size + 1, resized[4].last_modified, resized[4].last_modified),
+            (diff.MODIFIED, 'HomeDomain', touched[2], touched[0], 1, touched[4].size,
+                touched[4].size, touched[4].last_modified, LAST_MODIFIED)]
+        # ordered by domain and path
+        self.assertEqual(changes, sorted(expected, key=lambda change: change[1:3]))
+
+    def test_type_and_target(self):
+        changed_type = self.rows[1][0]
+        with self.connection:
+            self.connection.execute("UPDATE Files SET flags = 2 WHERE fileID = ?",
+                (changed_type[0],))
+        changes = self._changes()
+        self.assertEqual([change[:5] for change in changes],
+            [(diff.MODIFIED, 'HomeDomain', changed_type[2], changed_type[0], 2)])
+        if 3 in self.rows:
+            self._update(self.rows[3][0], target='/private/var/mobile/elsewhere')
+            self.assertEqual(len(self._changes()), 2)
+
+    def test_domain_patterns(self):
+        self._add('HomeDomain', 'Library/added.plist', b'new')
+        self._add('MediaDomain', 'Media/added.jpg', b'new')
+        self.assertEqual([change[1] for change in self._changes()], ['HomeDomain', 'MediaDomain'])
+        self.assertEqual([change[1] for change in self._changes(['Media*'])], ['MediaDomain'])
+        self.assertEqual(self._changes(['Camera*', 'NoSuchDomain']), [])
+
+    def test_command(self):
+        self._add('HomeDomain', 'Library/added.plist', b'added file')
+        with self.connection:
+            self.connection.execute("DELETE FROM Files WHERE fileID = ?", (self.rows[1][0][0],))
+        target = os.path.join(self.directory, 'changed')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.cache}), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = cli.main([BACKUP_PATH, 'diff', '-q', '--summary', '--extract', target,
+                self.newer])
+        self.assertEqual(status, 0, stderr.getvalue())
+        self.assertEqual(stdout.getvalue(), 'HomeDomain\t1\t1\t0\n')
+        self.assertIn('1 domains changed, 1 files added, 1 removed, 0 modified', stderr.getvalue())
+        # only the added file is extracted, below its domain
+        with open(os.path.join(target, 'HomeDomain', 'Library', 'added.plist'), 'rb') as f:
+            self.assertEqual(f.read(), b'added file')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# tests of encrypted backups, needs the package cryptography
+#
+#  File: tests/test_encryption.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import filecmp, os, plistlib, shutil, sqlite3, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import backup
+from manifestdb import encryption
+from manifestdb import extraction
+from manifestdb import sidecar
+import synthetic
+
+try:
+    import cryptography
+except ImportError:
+    cryptography = None
+
+ROWS = 400
+PASSWORD = 'secret'
+
+def setUpModule():
+    global DIRECTORY, PLAIN_PATH, ENCRYPTED_PATH
+    DIRECTORY = tempfile.mkdtemp()
+    # the same rows and payloads, once plain and once encrypted
+    PLAIN_PATH = os.path.join(DIRECTORY, 'plain')
+    synthetic.generate(PLAIN_PATH, ROWS, seed=4)
+    ENCRYPTED_PATH = os.path.join(DIRECTORY, 'encrypted')
+    if cryptography is not None:
+        synthetic.generate(ENCRYPTED_PATH, ROWS, seed=4, password=PASSWORD)
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY)
+
+def read_manifest(path):
+    with open(os.path.join(path, 'Manifest.plist'), 'rb') as f:
+        return plistlib.load(f)
+
+def regular_files(path):
+    connection = sqlite3.connect(os.path.join(path, 'Manifest.db'))
+    file_ids = [file_id for file_id, in connection.execute(
+        "SELECT fileID FROM Files WHERE flags = 1 ORDER BY fileID")]
+    connection.close()
+    return file_ids
+
+@unittest.skipIf(cryptography is None, "needs the package 'cryptography'")
+class KeybagTest(unittest.TestCase):
+    def setUp(self):
+        self.manifest = read_manifest(ENCRYPTED_PATH)
+
+    def test_unwrap(self):
+        self.assertTrue(encryption.is_encrypted(self.manifest))
+        self.assertFalse(encryption.is_encrypted(read_manifest(PLAIN_PATH)))
+        keybag = encryption.Keybag(self.manifest['BackupKeyBag'])
+        # locked
+        with self.assertRaises(encryption.PasswordError):
+            keybag.unwrap(self.manifest['ManifestKey'])
+        keybag.unlock(PASSWORD)
+        key = keybag.unwrap(self.manifest['ManifestKey'])
+        self.assertEqual(len(key), 32)
+        # decrypted Manifest.db has the rows of the plain one
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        target = os.path.join(directory, 'Manifest.db')
+        encryption.decrypt_file(os.path.join(ENCRYPTED_PATH, 'Manifest.db'), target, key)
+        self.assertEqual(regular_files(directory), regular_files(PLAIN_PATH))
+
+    def test_wrong_password(self):
+        keybag = encryption.Keybag(self.manifest['BackupKeyBag'])
+        with self.assertRaises(encryption.PasswordError):
+            keybag.unlock('wrong')
+
+    def test_damaged_key(self):
+        keybag = encryption.Keybag(self.manifest['BackupKeyBag'])
+        keybag.unlock(PASSWORD)
+        wrapped = self.manifest['ManifestKey']
+        with self.assertRaises(ValueError):
+            keybag.unwrap(wrapped[:-1] + bytes((wrapped[-1] ^ 1,)))
+        # no such protection class
+        with self.assertRaises(ValueError):
+            keybag.unwrap(b'\x63\x00\x00\x00' + wrapped[4:])
+
+@unittest.skipIf(cryptography is None, "needs the package 'cryptography'")
+class EncryptedBackupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = os.path.join(self.directory, 'cache')
+
+    def _check_backup(self, path):
+        # same domains and, decrypted, the same payloads as the plain backup
+        with backup.Backup(PLAIN_PATH, os.path.join(self.directory, 'plain')) as plain, \
+                backup.Backup(path, self.cache, password=PASSWORD) as opened:
+            self.assertIsNotNone(opened.keybag)
+            self.assertEqual(opened.domains(), plain.domains())
+            for file_id in regular_files(PLAIN_PATH)[::10]:
+                target = os.path.join(self.directory, file_id)
+                size = opened.extract_file(file_id, target)
+                self.assertEqual(size, os.path.getsize(plain.payload_path(file_id)))
+                self.assertTrue(filecmp.cmp(plain.payload_path(file_id), target, shallow=False))
+            return opened
+
+    def test_password(self):
+        with self.assertRaises(encryption.PasswordError):
+            backup.Backup(ENCRYPTED_PATH, self.cache)
+        with self.assertRaises(encryption.PasswordError):
+            backup.Backup(ENCRYPTED_PATH, self.cache, password='wrong')
+
+    def test_decrypted(self):
+        opened = self._check_backup(ENCRYPTED_PATH)
+        # nothing decrypted is left in the cache or the temporary directory
+        self.assertFalse(os.path.exists(opened.sidecar.path))
+        self.assertIsNone(opened._decrypted_dir)
+        self.assertFalse(os.path.exists(self.cache) and os.listdir(self.cache))
+
+    def test_without_manifest_key(self):
+        # before iOS 10.2 Manifest.db was not encrypted, only the payloads
+        path = os.path.join(self.directory, 'old')
+        shutil.copytree(ENCRYPTED_PATH, path)
+        with backup.Backup(ENCRYPTED_PATH, password=PASSWORD) as opened:
+            shutil.copy(opened.sidecar.db_url, os.path.join(path, 'Manifest.db'))
+        manifest = read_manifest(path)
+        del manifest['ManifestKey']
+        with open(os.path.join(path, 'Manifest.plist'), 'wb') as f:
+            plistlib.dump(manifest, f, fmt=plistlib.FMT_BINARY)
+        with backup.Backup(path, self.cache, password=PASSWORD) as opened:
+            self.assertIsNone(opened._decrypted_dir)
+            self.assertEqual(opened.sidecar.db_url, os.path.join(path, 'Manifest.db'))
+        self._check_backup(path)
+
+    def test_cleanup_on_failure(self):
+        directories = []
+        make_directory = tempfile.mkdtemp
+        def mkdtemp(*args, **kwargs):
+            directories.append(make_directory(*args, **kwargs))
+            return directories[-1]
+        with mock.patch('tempfile.mkdtemp', mkdtemp), \
+                mock.patch.object(sidecar, 'Sidecar', side_effect=OSError('no space left')):
+            with self.assertRaises(OSError):
+                backup.Backup(ENCRYPTED_PATH, self.cache, password=PASSWORD)
+        self.assertEqual(len(directories), 1)
+        self.assertFalse(os.path.exists(directories[0]))
+
+    def test_extraction(self):
+        # the workers decrypt the payloads
+        target = os.path.join(self.directory, 'target')
+        with backup.Backup(ENCRYPTED_PATH, self.cache, password=PASSWORD) as opened:
+            jobs = opened.domains_extraction_jobs(['HomeDomain'], target)
+            worker = extraction.Extraction(jobs, 4, keybag=opened.keybag)
+            worker.run()
+            self.assertEqual(worker.errors, [])
+            progress = extraction.Progress(len(jobs), extraction.total_size(jobs))
+            progress.drain(worker.events)
+            self.assertEqual(progress.errors, [])
+            self.assertTrue(jobs)
+            for job in jobs:
+                self.assertTrue(filecmp.cmp(os.path.join(PLAIN_PATH, job.file_id[:2], job.file_id),
+                    job.target, shallow=False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# tests of exporting table Files
+#
+#  File: tests/test_export.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import csv, gzip, io, os, shutil, sqlite3, sys, tempfile, unittest
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import database
+from manifestdb import export
+from manifestdb import filemeta
+import synthetic
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+ROWS = 500
+
+def setUpModule():
+    global DIRECTORY, BACKUP_PATH
+    DIRECTORY = tempfile.mkdtemp()
+    BACKUP_PATH = os.path.join(DIRECTORY, 'backup')
+    synthetic.generate(BACKUP_PATH, ROWS, seed=2)
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY)
+
+def manifest_rows():
+    # (fileID, domain, relativePath, flags, decoded BLOB) in the order of the table
+    connection = sqlite3.connect(os.path.join(BACKUP_PATH, 'Manifest.db'))
+    rows = [row[:4] + (filemeta.decode(row[4]),) for row in connection.execute(
+        "SELECT fileID, domain, relativePath, flags, file FROM Files ORDER BY rowid")]
+    connection.close()
+    return rows
+
+class CsvTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.manifest_db = database.ManifestDB(os.path.join(BACKUP_PATH, 'Manifest.db'))
+        self.addCleanup(self.manifest_db.close)
+        self.rows = manifest_rows()
+
+    def _check_decoded(self, text):
+        records = list(csv.reader(io.StringIO(text)))
+        self.assertEqual(records[0], ['fileID', 'domain', 'relativePath', 'flags']
+            + list(export.DECODED_COLUMNS))
+        self.assertEqual(len(records), len(self.rows) + 1)
+        for record, (file_id, domain, relative_path, flags, metadata) in zip(records[1:], self.rows):
+            self.assertEqual(record[:4], [file_id, domain, relative_path, str(flags)])
+            values = dict(zip(export.DECODED_COLUMNS, record[4:]))
+            self.assertEqual(values['Size'], str(metadata.size))
+            self.assertEqual(values['Mode'], oct(metadata.mode))
+            self.assertEqual(values['LastModified'],
+                datetime.fromtimestamp(metadata.last_modified, timezone.utc).isoformat())
+            self.assertEqual(values['InodeNumber'], str(metadata.inode))
+
+    def test_raw(self):
+        # the BLOB is written as it is, csv turns bytes into their repr
+        output = io.StringIO()
+        self.assertEqual(export.write_csv(self.manifest_db, output), len(self.rows))
+        records = list(csv.reader(io.StringIO(output.getvalue())))
+        self.assertEqual(records[0], ['fileID', 'domain', 'relativePath', 'flags', 'file'])
+        self.assertEqual([record[:3] for record in records[1:]],
+            [list(row[:3]) for row in self.rows])
+
+    def test_decoded(self):
+        output = io.StringIO()
+        self.assertEqual(export.write_csv(self.manifest_db, output, decode=True), len(self.rows))
+        self._check_decoded(output.getvalue())
+
+    def test_gzip(self):
+        path = os.path.join(self.directory, 'files.csv.gz')
+        self.assertEqual(export.compression_for(path), 'gzip')
+        with export.open_text(path, export.compression_for(path)) as file:
+            export.write_csv(self.manifest_db, file, decode=True)
+        with gzip.open(path, 'rt', newline='') as file:
+            self._check_decoded(file.read())
+
+    @unittest.skipIf(zstandard is None, "needs the package 'zstandard'")
+    def test_zstd(self):
+        path = os.path.join(self.directory, 'files.csv.zst')
+        self.assertEqual(export.compression_for(path), 'zstd')
+        with export.open_text(path, export.compression_for(path)) as file:
+            export.write_csv(self.manifest_db, file, decode=True)
+        with open(path, 'rb') as file:
+            reader = zstandard.ZstdDecompressor().stream_reader(file)
+            self._check_decoded(io.TextIOWrapper(reader, encoding='utf-8', newline='').read())
+
+    @unittest.skipIf(zstandard is not None, "the package 'zstandard' is installed")
+    def test_zstd_missing(self):
+        path = os.path.join(self.directory, 'files.csv.zst')
+        with self.assertRaises(ImportError):
+            export.open_text(path, 'zstd')
+        self.assertFalse(os.path.exists(path))
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            export.open_text(os.path.join(self.directory, 'files.csv.xz'), 'xz')
+        self.assertIsNone(export.compression_for('files.csv'))
+
+@unittest.skipIf(pyarrow is None, "needs the package 'pyarrow'")
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.manifest_db = database.ManifestDB(os.path.join(BACKUP_PATH, 'Manifest.db'))
+        self.addCleanup(self.manifest_db.close)
+        self.rows = manifest_rows()
+
+    def _check(self, table):
+        self.assertEqual(table.column_names, ['fileID', 'domain', 'relativePath', 'flags']
+            + list(export.DECODED_COLUMNS))
+        # Parquet has no unit of seconds, it keeps milliseconds
+        time_stamp = table.schema.field('LastModified').type
+        self.assertTrue(pyarrow.types.is_timestamp(time_stamp))
+        self.assertEqual(time_stamp.tz, 'UTC')
+        columns = table.to_pydict()
+        self.assertEqual(columns['fileID'], [row[0] for row in self.rows])
+        self.assertEqual(columns['flags'], [row[3] for row in self.rows])
+        self.assertEqual(columns['Size'], [row[4].size for row in self.rows])
+        self.assertEqual(columns['Mode'], [row[4].mode for row in self.rows])
+        self.assertEqual([value.timestamp() for value in columns['LastModified']],
+            [row[4].last_modified for row in self.rows])
+
+    def test_parquet(self):
+        import pyarrow.parquet
+        path = os.path.join(self.directory, 'files.parquet')
+        self.assertEqual(export.columnar_format_for(path), 'parquet')
+        self.assertEqual(export.write_columnar(self.manifest_db, path), len(self.rows))
+        self._check(pyarrow.parquet.read_table(path))
+
+    def test_arrow(self):
+        path = os.path.join(self.directory, 'files.arrow')
+        self.assertEqual(export.columnar_format_for(path), 'arrow')
+        self.assertEqual(export.write_columnar(self.manifest_db, path, 'arrow'), len(self.rows))
+        with pyarrow.memory_map(path) as source:
+            self._check(pyarrow.ipc.open_file(source).read_all())
+
+    def test_unknown_format(self):
+        self.assertIsNone(export.columnar_format_for('files.csv'))
+        with self.assertRaises(ValueError):
+            export.write_columnar(self.manifest_db, os.path.join(self.directory, 'files.orc'),
+                'orc')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# tests of the extraction into a directory with a journal
+#
+#  File: tests/test_extraction.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import os, shutil, stat, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+
+# local modules
+from manifestdb import extraction
+from manifestdb import filemeta
+
+# LastModified of the first file, the others follow a second apart
+LAST_MODIFIED = 1500000000
+
+class CancellingExtraction(extraction.Extraction):
+    # hands out only the first jobs, then cancels as the user would
+    def __init__(self, jobs, handed_out, **kwargs):
+        extraction.Extraction.__init__(self, jobs, **kwargs)
+        self._handed_out = handed_out
+
+    def _next_job(self):
+        with self._lock:
+            if self._handed_out == 0:
+                self.cancel()
+                return None
+            self._handed_out -= 1
+        return extraction.Extraction._next_job(self)
+
+class FailingExtraction(extraction.Extraction):
+    # a bug in copying, not an EnvironmentError of a single file
+    def _copy(self, job):
+        raise RuntimeError('broken copy')
+
+def _drain(worker):
+    progress = extraction.Progress(len(worker.jobs), extraction.total_size(worker.jobs))
+    progress.drain(worker.events)
+    return progress
+
+class ExtractionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.backup_path = os.path.join(self.directory, 'backup')
+        self.target = os.path.join(self.directory, 'target')
+        # rows of (fileID, relativePath, flags) and their decoded file BLOBs
+        self.rows = [('', '', 2)]
+        self.metadata = {'': self._metadata('', 0o40755, 0)}
+        self.rows.append(('dd' * 20, 'Media', 2))
+        self.metadata['dd' * 20] = self._metadata('Media', 0o40755, 0)
+        for number in range(40):
+            file_id = '{:040x}'.format(number * 7919 + 1)
+            content = 'file {}\n'.format(number % 10).encode()
+            payload = extraction.payload_path(self.backup_path, file_id)
+            os.makedirs(os.path.dirname(payload), exist_ok=True)
+            with open(payload, 'wb') as f:
+                f.write(content)
+            relative_path = 'Media/IMG_{:04}.JPG'.format(number)
+            self.rows.append((file_id, relative_path, 1))
+            self.metadata[file_id] = self._metadata(relative_path, 0o100644, len(content),
+                LAST_MODIFIED + number)
+
+    def _metadata(self, relative_path, mode, size, last_modified=LAST_MODIFIED):
+        metadata = filemeta.FileMetadata()
+        for name in filemeta.FileMetadata.__slots__:
+            setattr(metadata, name, None)
+        metadata.relative_path = relative_path
+        metadata.mode = mode
+        metadata.size = size
+        metadata.last_modified = last_modified
+        return metadata
+
+    def _plan(self):
+        attributes = []
+        jobs = extraction.plan(self.backup_path, self.rows, self.target, self.metadata, attributes)
+        return jobs, attributes
+
+    def _extract(self, dedup=False):
+        jobs, attributes = self._plan()
+        worker = extraction.Extraction(jobs, 4, extraction.Journal(self.target), attributes, dedup)
+        worker.run()
+        self.assertEqual(worker.errors, [])
+        return _drain(worker)
+
+    def test_resume_after_cancel(self):
+        jobs, attributes = self._plan()
+        worker = CancellingExtraction(jobs, 15, workers=4,
+            journal=extraction.Journal(self.target), attributes=attributes)
+        worker.run()
+        self.assertTrue(worker.cancelled.is_set())
+        self.assertEqual(_drain(worker).files, 15)
+        # the files copied before the cancel have their time, although the
+        # final pass over directories and symlinks did not run
+        for job in jobs:
+            if os.path.exists(job.target):
+                self.assertEqual(os.stat(job.target).st_mtime_ns, job.mtime)
+        progress = self._extract()
+        self.assertEqual(progress.skipped, 15)
+        self.assertEqual(progress.files, len(jobs))
+        self.assertEqual(progress.errors, [])
+
+    def test_worker_exception(self):
+        jobs, attributes = self._plan()
+        worker = FailingExtraction(jobs, 4, attributes=attributes)
+        worker.run()
+        self.assertEqual(len(worker.errors), 4)
+        self.assertIn('broken copy', worker.errors[0])
+
+    def test_attributes(self):
+        self._extract()
+        for file_id, relative_path, flags in self.rows[2:]:
+            target = os.stat(os.path.join(self.target, relative_path))
+            self.assertEqual(stat.S_IMODE(target.st_mode), 0o644)
+            self.assertEqual(target.st_mtime_ns, self.metadata[file_id].last_modified * 1000000000)
+        # a sync finds every file unchanged
+        progress = self._extract()
+        self.assertEqual(progress.skipped, 40)
+
+    def test_dedup_sync(self):
+        # 40 files with 10 different contents
+        progress = self._extract(dedup=True)
+        self.assertEqual(progress.linked, 30)
+        for file_id, relative_path, flags in self.rows[2:]:
+            target = os.stat(os.path.join(self.target, relative_path))
+            if target.st_nlink == 1:
+                # a reflink or a copy has its own time
+                self.assertEqual(target.st_mtime_ns,
+                    self.metadata[file_id].last_modified * 1000000000)
+        # hardlinked duplicates keep the time of their first file, still they are unchanged
+        self.assertEqual(self._extract(dedup=True).skipped, 40)
+        self.assertEqual(self._extract().skipped, 40)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# tests of decoding the file BLOB archived by NSKeyedArchiver
+#
+#  File: tests/test_filemeta.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import os, plistlib, sys, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import filemeta
+import synthetic
+
+LAST_MODIFIED = 1500000000
+
+class DecodeTest(unittest.TestCase):
+    def test_regular_file(self):
+        metadata = filemeta.decode(synthetic.file_blob('Media/DCIM/IMG_0001.HEIC', 1, 1234,
+            LAST_MODIFIED, 4711))
+        self.assertEqual(metadata.relative_path, 'Media/DCIM/IMG_0001.HEIC')
+        self.assertEqual(metadata.size, 1234)
+        self.assertEqual(metadata.mode, 0o100644)
+        self.assertEqual(metadata.birth, LAST_MODIFIED - 3600)
+        self.assertEqual(metadata.last_modified, LAST_MODIFIED)
+        self.assertEqual(metadata.last_status_change, LAST_MODIFIED)
+        self.assertEqual(metadata.inode, 4711)
+        self.assertEqual((metadata.user_id, metadata.group_id), (501, 501))
+        self.assertEqual(metadata.protection_class, 3)
+        self.assertIsNone(metadata.target)
+        self.assertIsNone(metadata.encryption_key)
+        self.assertFalse(metadata.has_extended_attributes)
+
+    def test_directory(self):
+        metadata = filemeta.decode(synthetic.file_blob('Library', 2, 0, LAST_MODIFIED, 1))
+        self.assertEqual(metadata.mode, 0o40755)
+        self.assertEqual(metadata.size, 0)
+
+    def test_symlink(self):
+        metadata = filemeta.decode(synthetic.file_blob('Library/link', 3, 0, LAST_MODIFIED, 1,
+            target='/private/var/mobile/Library/target'))
+        self.assertEqual(metadata.mode, 0o120755)
+        self.assertEqual(metadata.target, '/private/var/mobile/Library/target')
+
+    def test_encryption_key(self):
+        # NSData is unwrapped
+        key = bytes(range(44))
+        metadata = filemeta.decode(synthetic.file_blob('Library/Notes.db', 1, 10, LAST_MODIFIED,
+            1, encryption_key=key))
+        self.assertEqual(metadata.encryption_key, key)
+        self.assertEqual(dict(metadata.items())['EncryptionKey'], 'yes')
+
+    def test_null_reference(self):
+        # a reference to '$null' is None
+        archive = plistlib.loads(synthetic.file_blob('Library', 2, 0, LAST_MODIFIED, 1))
+        archive['$objects'][1]['Target'] = plistlib.UID(0)
+        metadata = filemeta.decode(plistlib.dumps(archive, fmt=plistlib.FMT_BINARY))
+        self.assertIsNone(metadata.target)
+        self.assertEqual(metadata.relative_path, 'Library')
+
+    def test_not_decodable(self):
+        self.assertIsNone(filemeta.decode(None))
+        self.assertIsNone(filemeta.decode(b''))
+        self.assertIsNone(filemeta.decode(b'bplist00 broken'))
+        # a plist, but no archive
+        self.assertIsNone(filemeta.decode(plistlib.dumps({'Size': 1}, fmt=plistlib.FMT_BINARY)))
+        # a reference out of range
+        archive = plistlib.loads(synthetic.file_blob('Library', 2, 0, LAST_MODIFIED, 1))
+        archive['$objects'][1]['RelativePath'] = plistlib.UID(99)
+        self.assertIsNone(filemeta.decode(plistlib.dumps(archive, fmt=plistlib.FMT_BINARY)))
+
+    def test_items(self):
+        metadata = filemeta.decode(synthetic.file_blob('Library/Preferences/a.plist', 1, 10,
+            LAST_MODIFIED, 1))
+        items = dict(metadata.items())
+        self.assertEqual(items['RelativePath'], 'Library/Preferences/a.plist')
+        self.assertEqual(items['Mode'], '0o100644')
+        self.assertEqual(items['LastModified'].timestamp(), LAST_MODIFIED)
+        # unset values are left out
+        self.assertNotIn('Target', items)
+
+    def test_batch(self):
+        blobs = [synthetic.file_blob('a', 1, 1, LAST_MODIFIED, 1), b'broken', None,
+            synthetic.file_blob('b', 2, 0, LAST_MODIFIED, 2)]
+        decoded = filemeta.decode_batch(iter(blobs))
+        self.assertEqual(len(decoded), 4)
+        self.assertEqual(decoded[0].relative_path, 'a')
+        self.assertIsNone(decoded[1])
+        self.assertIsNone(decoded[2])
+        self.assertEqual(decoded[3].mode, 0o40755)
+
+if __name__ == '__main__':
+    unittest.main()
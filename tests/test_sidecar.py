@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# tests of the sidecar index on a synthetic backup
+#
+#  File: tests/test_sidecar.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import fnmatch, os, re, shutil, sqlite3, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import backup
+import synthetic
+
+# rows of the synthetic backup shared by all tests
+ROWS = 2000
+
+def setUpModule():
+    global DIRECTORY, BACKUP_PATH
+    DIRECTORY = tempfile.mkdtemp()
+    BACKUP_PATH = os.path.join(DIRECTORY, 'backup')
+    synthetic.generate(BACKUP_PATH, ROWS, seed=1)
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY)
+
+def manifest_rows(path):
+    # (fileID, domain, relativePath, flags, size of the payload) straight out of the backup
+    connection = sqlite3.connect(os.path.join(path, 'Manifest.db'))
+    rows = []
+    for file_id, domain, relative_path, flags in connection.execute(
+            "SELECT fileID, domain, relativePath, flags FROM Files"):
+        payload = os.path.join(path, file_id[:2], file_id)
+        size = os.path.getsize(payload) if flags == 1 else 0
+        rows.append((file_id, domain, relative_path, flags, size))
+    connection.close()
+    return rows
+
+class SidecarTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache)
+        self.backup = backup.Backup(BACKUP_PATH, self.cache)
+        self.addCleanup(self.backup.close)
+        self.rows = manifest_rows(BACKUP_PATH)
+
+    def test_two_passes(self):
+        self.assertTrue(self.backup.open_index())
+        sidecar = self.backup.sidecar
+        self.assertFalse(sidecar.is_complete())
+        files = {}
+        sizes = {}
+        for file_id, domain, relative_path, flags, size in self.rows:
+            files[domain] = files.get(domain, 0) + (flags == 1)
+            sizes[domain] = sizes.get(domain, 0) + size
+        # the first pass knows the files of the domains, not their sizes
+        self.assertEqual(self.backup.domains(),
+            [(domain, files[domain], None) for domain in sorted(files)])
+        # attributes are decoded out of the BLOBs until the second pass
+        sample = [row[0] for row in self.rows[::50]]
+        decoded = self.backup.metadata_for(sample)
+        self.assertTrue(self.backup.complete_index())
+        self.assertTrue(sidecar.is_complete())
+        self.assertFalse(self.backup.complete_index())
+        self.assertEqual(self.backup.domains(),
+            [(domain, files[domain], sizes[domain]) for domain in sorted(files)])
+        indexed = self.backup.metadata_for(sample)
+        self.assertEqual(sorted(indexed), sorted(decoded))
+        for file_id, metadata in indexed.items():
+            self.assertEqual((metadata.size, metadata.mode, metadata.last_modified),
+                (decoded[file_id].size, decoded[file_id].mode, decoded[file_id].last_modified))
+
+    def test_reopen(self):
+        self.backup.open_index()
+        self.backup.complete_index()
+        # an unchanged backup is neither rebuilt nor completed again
+        with backup.Backup(BACKUP_PATH, self.cache) as opened:
+            self.assertFalse(opened.open_index())
+            self.assertFalse(opened.complete_index())
+        # a changed one is
+        changed = os.path.join(self.cache, 'changed')
+        shutil.copytree(BACKUP_PATH, changed)
+        with backup.Backup(changed, self.cache) as opened:
+            opened.open_index()
+            opened.complete_index()
+        connection = sqlite3.connect(os.path.join(changed, 'Manifest.db'))
+        with connection:
+            connection.execute("DELETE FROM Files WHERE flags = 1 AND domain = 'HomeDomain'")
+        connection.close()
+        with backup.Backup(changed, self.cache) as opened:
+            self.assertTrue(opened.open_index())
+            self.assertFalse(opened.sidecar.is_complete())
+            self.assertNotIn('HomeDomain', [domain for domain, files, size in opened.domains()
+                if files])
+
+class SearchTest(unittest.TestCase):
+    # every search is run by scanning table Files before the second pass
+    # and on the full-text index after it, both must find the same rows
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache)
+        self.backup = backup.Backup(BACKUP_PATH, self.cache)
+        self.addCleanup(self.backup.close)
+        self.rows = manifest_rows(BACKUP_PATH)
+
+    def _check(self, pattern, mode, test):
+        expected = sorted((domain, relative_path, file_id, flags)
+            for file_id, domain, relative_path, flags, size in self.rows if test(relative_path))
+        self.assertTrue(expected)
+        scanned = sorted(self.backup.search(pattern, mode, ROWS))
+        self.backup.complete_index()
+        self.assertTrue(self.backup.sidecar.has_full_text())
+        self.assertEqual(scanned, expected)
+        self.assertEqual(sorted(self.backup.search(pattern, mode, ROWS)), expected)
+
+    def test_substring(self):
+        # case-insensitive
+        self.assertEqual(self.backup.search('CaChE', 'substring', ROWS),
+            self.backup.search('cache', 'substring', ROWS))
+        self._check('CaChE', 'substring', lambda path: 'cache' in path.lower())
+
+    def test_short_substring(self):
+        # shorter than a trigram
+        self._check('db', 'substring', lambda path: 'db' in path.lower())
+
+    def test_prefix(self):
+        self._check('Library/Pref', 'prefix', lambda path: path.startswith('Library/Pref'))
+
+    def test_glob(self):
+        self._check('*/Caches/*.plist', 'glob',
+            lambda path: fnmatch.fnmatchcase(path, '*/Caches/*.plist'))
+
+    def test_regex(self):
+        self._check(r'\d{4}\.(png|jpg)$', 'regex',
+            lambda path: re.search(r'\d{4}\.(png|jpg)$', path) is not None)
+
+    def test_limit(self):
+        self.assertEqual(len(self.backup.search('a', 'substring', 7)), 7)
+        self.backup.complete_index()
+        self.assertEqual(len(self.backup.search('ache', 'substring', 7)), 7)
+
+    def test_sorted_rowids(self):
+        self.backup.complete_index()
+        rowids = self.backup.search_rowids('cache', 'substring', ROWS, 'relativePath', True)
+        rows = self.backup.rows_by_rowid(rowids)
+        # paths are shown below their domains
+        paths = [rows[rowid][1:3] for rowid in rowids]
+        self.assertEqual(len(paths), len(self.backup.search('cache', 'substring', ROWS)))
+        self.assertEqual(paths, sorted(paths, reverse=True))
+
+    def test_invalid_regex(self):
+        with self.assertRaises(re.error):
+            self.backup.search('Library/(', 'regex')
+
+class TreeTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache)
+        self.backup = backup.Backup(BACKUP_PATH, self.cache)
+        self.addCleanup(self.backup.close)
+        self.rows = manifest_rows(BACKUP_PATH)
+
+    def _rows(self, domain):
+        return [row for row in self.rows if row[1] == domain]
+
+    def _children(self, domain, directory):
+        # children computed out of the paths of the domain
+        rows = self._rows(domain)
+        by_path = {relative_path: (file_id, flags) for file_id, _, relative_path, flags, _ in rows}
+        prefix = directory + '/' if directory else ''
+        names = sorted({relative_path[len(prefix):].split('/')[0]
+            for file_id, _, relative_path, flags, size in rows
+            if relative_path.startswith(prefix) and relative_path != directory})
+        children = []
+        for name in names:
+            path = prefix + name
+            below = [row for row in rows if row[2] == path or row[2].startswith(path + '/')]
+            file_id, flags = by_path.get(path, (None, 2))
+            children.append((name, path, file_id, flags, len(below) > 1,
+                sum(row[3] == 1 for row in below), sum(row[4] for row in below)))
+        return children
+
+    def test_children(self):
+        self.backup.complete_index()
+        for domain, directory in (('HomeDomain', ''), ('HomeDomain', 'Library'),
+                ('CameraRollDomain', 'Media'), ('CameraRollDomain', 'Media/DCIM')):
+            expected = self._children(domain, directory)
+            self.assertTrue(expected)
+            self.assertEqual(self.backup.children(domain, directory), expected)
+
+    def test_children_without_sizes(self):
+        # before the second pass everything but the sizes is known
+        expected = [child[:6] + (None,) for child in self._children('HomeDomain', 'Library')]
+        self.assertEqual(self.backup.children('HomeDomain', 'Library'), expected)
+
+    def test_subtree(self):
+        for domain, directory in (('HomeDomain', 'Library'), ('CameraRollDomain', 'Media/DCIM')):
+            expected = sorted((file_id, relative_path, flags)
+                for file_id, _, relative_path, flags, size in self._rows(domain)
+                if relative_path == directory or relative_path.startswith(directory + '/'))
+            rows = [row for batch in self.backup.subtree_batches(domain, directory) for row in batch]
+            self.assertEqual(sorted(rows), expected)
+            self.assertEqual([row[1] for row in rows], sorted(row[1] for row in rows))
+        # the whole domain
+        rows = [row for batch in self.backup.subtree_batches('HomeDomain') for row in batch]
+        self.assertEqual(len(rows), len(self._rows('HomeDomain')))
+
+    def test_sibling_prefix(self):
+        # 'Library.old' starts with 'Library' but is not below it
+        changed = os.path.join(self.cache, 'changed')
+        shutil.copytree(BACKUP_PATH, changed)
+        connection = sqlite3.connect(os.path.join(changed, 'Manifest.db'))
+        with connection:
+            connection.execute("INSERT INTO Files VALUES (?, 'HomeDomain', 'Library.old', 2, NULL)",
+                (synthetic.file_id('HomeDomain', 'Library.old'),))
+        connection.close()
+        with backup.Backup(changed, self.cache) as opened:
+            paths = [row[1] for batch in opened.subtree_batches('HomeDomain', 'Library')
+                for row in batch]
+            self.assertNotIn('Library.old', paths)
+            self.assertEqual(len(paths), len(
+                [row for row in self._rows('HomeDomain') if row[2].startswith('Library')]))
+            self.assertIn('Library.old', [child[0] for child in opened.children('HomeDomain')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# tests of verifying the payloads of a backup
+#
+#  File: tests/test_verify.py
+#
+#  Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+import contextlib, hashlib, io, os, shutil, sqlite3, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyList-ManifestDB-iOSBackup'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+# local modules
+from manifestdb import backup
+from manifestdb import cli
+from manifestdb import verify
+import synthetic
+
+ROWS = 300
+
+def setUpModule():
+    global DIRECTORY, BACKUP_PATH
+    DIRECTORY = tempfile.mkdtemp()
+    BACKUP_PATH = os.path.join(DIRECTORY, 'backup')
+    synthetic.generate(BACKUP_PATH, ROWS, seed=5)
+
+def tearDownModule():
+    shutil.rmtree(DIRECTORY)
+
+class VerifyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # every test damages a copy of its own
+        self.path = os.path.join(self.directory, 'backup')
+        shutil.copytree(BACKUP_PATH, self.path)
+        self.cache = os.path.join(self.directory, 'cache')
+        connection = sqlite3.connect(os.path.join(self.path, 'Manifest.db'))
+        self.files = connection.execute("SELECT fileID, domain, relativePath FROM Files"
+            " WHERE flags = 1 ORDER BY fileID").fetchall()
+        connection.close()
+        self.sizes = {file_id: os.path.getsize(self._payload(file_id))
+            for file_id, domain, relative_path in self.files}
+        # regular files with a payload of at least 2 bytes to truncate, ordered by fileID
+        self.files = [row for row in self.files if self.sizes[row[0]] >= 2]
+
+    def _payload(self, file_id):
+        return os.path.join(self.path, verify.payload_name(file_id))
+
+    def _verify(self):
+        with backup.Backup(self.path, self.cache) as opened:
+            return verify.verify(opened, workers=4)
+
+    def test_complete(self):
+        result = self._verify()
+        self.assertEqual(result.problems(), 0)
+        self.assertEqual(result.files, len(self.sizes))
+        self.assertEqual(result.bytes, sum(self.sizes.values()))
+        self.assertEqual(sorted(result.payloads),
+            sorted(verify.payload_name(file_id) for file_id in self.sizes))
+
+    def test_missing(self):
+        file_id, domain, relative_path = self.files[3]
+        os.remove(self._payload(file_id))
+        result = self._verify()
+        self.assertEqual(result.missing, [(file_id, domain, relative_path, self.sizes[file_id])])
+        self.assertEqual((result.wrong_size, result.orphans), ([], []))
+        self.assertEqual(result.files, len(self.sizes))
+
+    def test_truncated(self):
+        file_id, domain, relative_path = self.files[5]
+        size = self.sizes[file_id]
+        with open(self._payload(file_id), 'r+b') as f:
+            f.truncate(size // 2)
+        result = self._verify()
+        self.assertEqual(result.wrong_size,
+            [(file_id, domain, relative_path, size, size // 2)])
+        self.assertEqual((result.missing, result.orphans), ([], []))
+
+    def test_orphan(self):
+        name = verify.payload_name('ab' + '0' * 38)
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(b'left over')
+        # files outside of the payload directories are no payloads
+        os.makedirs(os.path.join(self.path, 'Snapshot'))
+        open(os.path.join(self.path, 'Snapshot', 'other'), 'w').close()
+        result = self._verify()
+        self.assertEqual(result.orphans, [name])
+        self.assertEqual((result.missing, result.wrong_size), ([], []))
+
+    def test_hash(self):
+        names = sorted(verify.payload_name(file_id) for file_id in self.sizes)[:20]
+        os.chmod(os.path.join(self.path, names[0]), 0)
+        readable = os.access(os.path.join(self.path, names[0]), os.R_OK)
+        results = {name: (digest, error, size)
+            for name, digest, error, size in verify.hash_payloads(self.path, names, 2)}
+        self.assertEqual(sorted(results), names)
+        for name in names[1:]:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                content = f.read()
+            self.assertEqual(results[name], (hashlib.sha256(content).hexdigest(), None,
+                len(content)))
+        if not readable:
+            # not when running as root
+            self.assertIsNone(results[names[0]][0])
+            self.assertIsNotNone(results[names[0]][1])
+
+    def test_command(self):
+        missing = self.files[1][0]
+        truncated = self.files[2][0]
+        os.remove(self._payload(missing))
+        with open(self._payload(truncated), 'r+b') as f:
+            f.truncate(1)
+        orphan = verify.payload_name('cd' + '1' * 38)
+        open(os.path.join(self.path, orphan), 'w').close()
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        hashes = os.path.join(self.directory, 'SHA256SUMS')
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.cache}), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = cli.main([self.path, 'verify', '-q', '--hash', hashes, '-P', '2'])
+        self.assertEqual(status, 1)
+        problems = sorted(line.split('\t')[:2] for line in stdout.getvalue().splitlines())
+        self.assertEqual(problems, sorted([['missing', missing], ['truncated', truncated],
+            ['orphan', orphan]]))
+        self.assertIn('1 missing, 1 with wrong size, 1 orphaned payloads', stderr.getvalue())
+        with open(hashes) as f:
+            self.assertEqual(len(f.readlines()), len(self.sizes) - 1)
+
+if __name__ == '__main__':
+    unittest.main()